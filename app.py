@@ -1,19 +1,172 @@
 import streamlit as st
-import sys
 import modules.ui_components as ui
 import modules.constants as co
 import modules.data_handler as dh
 import modules.fitting_calculator as fc
 import modules.plot_generator as pg
+import modules.stages as sg
+import modules.background as bg
+from concurrent.futures import CancelledError
+from modules.cache import make_cache_key
+from modules.instrumentation import RerunTimings, fragment_timings
+from modules.pipeline import StageCancelled
 
 st.set_page_config(layout="wide", page_title="簡易グラフ作成アプリ")
 st.title("簡易グラフ作成アプリ")
 
 notification_was_shown = co.show_initial_update_notification()
 
-# fit_results_1とfit_results_2を初期化（常に定義されていることを保証）
-fit_results_1 = None
-fit_results_2 = None
+# 処理段階ごとの計測（パネル表示中は、STREAM_TRACE_ALLOCATIONS で有効にしたメモリ割り当ても記録する）
+show_instrumentation = st.session_state.get("show_instrumentation", False)
+timings = RerunTimings(trace_allocations=show_instrumentation)
+
+# 処理段階の結果はセッションごとに1つずつ保持し、段階が使う設定と前段が変わらなければ再利用する（modules.stages）
+stage_memo = st.session_state.setdefault("stage_memo", {})
+
+
+def run_stage(name, stage_inputs, stage_sources, stage_timings):
+    return sg.PIPELINE.run(name, stage_inputs, stage_memo, stage_sources, stage_timings)
+
+
+def compute_stages(slot, names, stage_inputs, stage_sources, stage_timings, message):
+    """
+    時間のかかる段階（フィットと描画）を計算プールで計算してメモに反映し、結果を返す（メモにあれば計算しない）。
+    待つ間もこの再実行は新しい入力で打ち切られ、古い入力の計算は次の投入で取り消される。
+    計算に失敗した場合はエラーを表示し、すべて None を返す（次の再実行で計算し直す）。
+    """
+    jobs = st.session_state.setdefault("stage_jobs", bg.SessionJobs())
+    job = jobs.submit(slot, sg.PIPELINE, names, stage_inputs, stage_memo, stage_sources,
+                      trace_allocations=stage_timings.trace_allocations)
+    if job is not None:
+        try:
+            ui.wait_for_job(job.future, message)
+            jobs.collect(slot, job, sg.PIPELINE, stage_memo, stage_timings)
+        except (StageCancelled, CancelledError):
+            pass  # 新しい入力の計算に置き換えられた（前回の結果を返す）
+        except Exception as e:
+            st.error(f"計算中にエラーが発生しました: {e}")
+            return [None] * len(names)
+    return [sg.PIPELINE.latest(name, stage_memo) for name in names]
+
+
+def show_graph(graph_slot, interactive, graph, timings):
+    """画像（PNG）または Vega-Lite の仕様のグラフを graph_slot に表示する"""
+    if graph is None:
+        return
+    with timings.stage("st.vega_lite_chart" if interactive else "st.image"), graph_slot.container():
+        if interactive:
+            ui.render_interactive_chart(graph)
+        else:
+            ui.render_graph_image(graph)
+
+
+@st.fragment
+def render_graph_section(stage_inputs, stage_sources, timings):
+    """
+    凡例設定・グラフ表示・ダウンロードボタン。ここでの操作ではこのフラグメントだけを再実行し、
+    描画と書き出しだけを計算し直す（フィットとデータの読み込みはメモを再利用する）。
+    """
+    stage_inputs = dict(stage_inputs)
+    with fragment_timings(timings, "graph") as timings:
+        st.subheader("グラフ表示")
+        interactive = ui.render_display_mode_setting()
+        # 画像の表示では、ダウンロード用に figure（描画段階の結果）も保持する
+        outputs = ["chart_spec"] if interactive else ["draw", "display_png"]
+        output = outputs[-1]
+        plot_data = run_stage("clean", stage_inputs, stage_sources, timings)[1]
+        has_points = plot_data is not None and len(plot_data) > 0
+
+        # 計算が終わるまでは、前回の入力で描画したグラフを表示しておく
+        graph_slot = st.empty()
+        shown = sg.PIPELINE.latest(output, stage_memo) if has_points else None
+        show_graph(graph_slot, interactive, shown, timings)
+
+        fit_results_1, fit_results_2 = compute_stages(
+            "fits", ["fit_1", "fit_2"], stage_inputs, stage_sources, timings, "近似線を計算しています…"
+        )
+        min_x, max_x = stage_inputs.get('fit_range_x_min'), stage_inputs.get('fit_range_x_max')
+        if (stage_inputs.get('show_fitting_2') and has_points and fit_results_2 is None
+                and min_x is not None and max_x is not None and min_x < max_x):
+            st.sidebar.warning("指定範囲にデータ点がありません。")
+
+        # --- サイドバー（凡例設定 - フィッティング計算後にレンダリング） ---
+        stage_inputs.update(ui.render_sidebar_legend_settings(stage_inputs, fit_results_1, fit_results_2))
+
+        if plot_data is None:
+            return
+        if len(plot_data) == 0:
+            graph_slot.warning("グラフにプロットできる有効な数値データがありません。")
+            return
+
+        graph = compute_stages("render", outputs, stage_inputs, stage_sources, timings, "グラフを描画しています…")[-1]
+        if graph is not shown:
+            show_graph(graph_slot, interactive, graph, timings)
+        if interactive:
+            # ブラウザで描画し、matplotlib の figure はダウンロードボタンが押されたときだけ作る
+            sg.PIPELINE.discard("draw", stage_memo)
+            ranges = sg.PIPELINE.latest("axis_ranges", stage_memo)
+            fit_lines = sg.fit_lines(stage_inputs, fit_results_1, fit_results_2)
+
+            def export_source():
+                return pg.draw_graph(plot_data, stage_inputs, fit_lines, axis_ranges=ranges)[0]
+        else:
+            # ダウンロードボタンは画像を押されたときに生成するため、figure は描画し直すまでメモに保持する
+            # （置き換わった前回の figure は描画段階が破棄する）
+            export_source = sg.PIPELINE.latest("draw", stage_memo)
+        # 描画したデータと実際に使った設定（段階のキー）が同じなら、書き出した画像を再利用する
+        content_key = sg.PIPELINE.last_key(output, stage_memo)
+        with timings.stage("render_download_buttons"):
+            ui.render_download_buttons(export_source, cache_key=make_cache_key(content_key))
+
+
+@st.fragment
+def render_fit_section(stage_inputs, stage_sources, timings):
+    """
+    2本目の近似線・軸範囲の設定と、グラフ・フィット結果の表示。範囲や軸の設定を変えたときは
+    このフラグメントだけを再実行し、2本目のフィット・軸範囲と描画だけを計算し直す。
+    """
+    stage_inputs = dict(stage_inputs)
+    with fragment_timings(timings, "fit_section") as timings:
+        # --- サイドバー（2本目の近似直線設定 - 範囲入力など、フィッティング結果に依存しないUI） ---
+        stage_inputs.update(ui.render_sidebar_second_fit_settings(stage_inputs))
+        # --- サイドバー（軸範囲設定） ---
+        stage_inputs.update(ui.render_sidebar_axis_range_settings(stage_inputs))
+
+        # --- グラフ描画 ---
+        render_graph_section(stage_inputs, stage_sources, timings)
+        plot_data = run_stage("clean", stage_inputs, stage_sources, timings)[1]
+        if plot_data is None or len(plot_data) == 0:
+            return
+
+        # フィッティング結果表示
+        fit_results_1, fit_results_2 = compute_stages(
+            "fits", ["fit_1", "fit_2"], stage_inputs, stage_sources, timings, "近似線を計算しています…"
+        )
+        if stage_inputs.get("show_fitting") and fit_results_1:
+            # ブートストラップ法は時間がかかるため、フィット結果と設定が変わったときだけ計算し直す
+            bootstrap_result, = compute_stages(
+                "bootstrap", ["bootstrap"], stage_inputs, stage_sources, timings,
+                "ブートストラップ法で信頼区間を計算しています…"
+            )
+            if bootstrap_result is not None:
+                fit_results_1 = {**fit_results_1, "bootstrap": bootstrap_result}
+            ui.render_fitting_results_display(
+                fit_results_1.get("equation_latex"),
+                f"$R^2 = {fit_results_1.get('r_squared'):.4f}$" if fit_results_1.get('r_squared') is not None else "",
+                fit_results_1.get("slope_val") is not None,
+                stage_inputs.get("show_fitting")
+            )
+            ui.render_bootstrap_results(fit_results_1, stage_inputs["plot_type"])
+            ui.render_nonlinear_fit_details(fit_results_1)
+        if stage_inputs.get("show_fitting_2") and fit_results_2:
+            ui.render_fitting_results_display(
+                fit_results_2.get("equation_latex"),
+                f"$R^2 = {fit_results_2.get('r_squared'):.4f}$" if fit_results_2.get('r_squared') is not None else "",
+                fit_results_2.get("slope_val") is not None,
+                stage_inputs.get("show_fitting_2")
+            )
+            ui.render_nonlinear_fit_details(fit_results_2)
+
 
 # --- サイドバー設定の収集 ---
 # まず、すべてのサイドバーUI要素から設定値を取得し、graph_settingsを初期化
@@ -26,104 +179,59 @@ if not notification_was_shown:
     data_col, plot_col = st.columns([1, 2])
     with data_col:
         raw_data_str = ui.render_data_input_area()
-        df_orig, df_numeric, error_message = dh.parse_text_data(raw_data_str)
+        uploaded_file = ui.render_file_upload_area()
+        multi_y = ui.render_data_format_setting()
+        has_input = bool(raw_data_str) or uploaded_file is not None
+        # 段階のキーに含めない引数（データはキーのハッシュで表す）。
+        # 非線形最小二乗法は、前回の再実行で求めたパラメータ（近似線・モデルごと）を反復の初期値の候補にする
+        stage_sources = {"warm_starts": st.session_state.setdefault("nonlinear_warm_starts", {})}
+        if uploaded_file is not None:
+            # ファイルはバイト列のまま読み込み、テキストに変換しない
+            file_bytes = uploaded_file.getvalue()
+            data_key = dh.compute_file_key(file_bytes, uploaded_file.name)
+            stage_sources.update(file_bytes=file_bytes, file_name=uploaded_file.name)
+        else:
+            data_key = dh.compute_data_key(raw_data_str)
+            stage_sources["raw_data_str"] = raw_data_str
+        stage_inputs = {**graph_settings, "data_key": data_key, "multi_y": multi_y, "series_name": None}
+        df_orig, df_numeric, error_message = run_stage("parse", stage_inputs, stage_sources, timings)
         if error_message:
             st.warning(error_message)
         if df_orig is not None:
             st.write("読み込みデータプレビュー:")
             st.dataframe(df_orig.head(), height=200)
 
-    # --- サイドバー（2本目の近似直線設定 - 範囲入力など、フィッティング結果に依存しないUI） ---
-    second_fit_settings = ui.render_sidebar_second_fit_settings(graph_settings)
-    graph_settings.update(second_fit_settings)
-
-    # --- サイドバー（軸範囲設定） ---
-    axis_range_settings = ui.render_sidebar_axis_range_settings(graph_settings)
-    graph_settings.update(axis_range_settings)
-
-    # --- フィッティング計算（UI設定の収集後） ---
-    if df_numeric is not None and not df_numeric.empty:
-        df_plot_data = df_numeric.dropna()
-        if not df_plot_data.empty:
-            if graph_settings.get('show_fitting'):
-                fit_results_1 = fc.calculate_fitting_parameters_v3(
-                    df_plot_data['x'].values, df_plot_data['y'].values, graph_settings["plot_type"]
-                )
-            
-            if graph_settings.get('show_fitting_2'):
-                min_x = graph_settings.get('fit_range_x_min')
-                max_x = graph_settings.get('fit_range_x_max')
-                # UIで範囲が正しく設定されているか確認
-                if min_x is not None and max_x is not None and min_x < max_x:
-                    df_fit_range = df_plot_data[(df_plot_data['x'] >= min_x) & (df_plot_data['x'] <= max_x)]
-                    if not df_fit_range.empty:
-                        fit_results_2 = fc.calculate_fitting_parameters_v3(
-                            df_fit_range['x'].values,
-                            df_fit_range['y'].values,
-                            graph_settings["plot_type"]
-                        )
-                    else:
-                        st.sidebar.warning("指定範囲にデータ点がありません。")
-
-    # --- サイドバー（凡例設定 - フィッティング計算後にレンダリング） ---
-    legend_settings = ui.render_sidebar_legend_settings(graph_settings, fit_results_1, fit_results_2)
-    graph_settings.update(legend_settings)
-
-    # --- グラフ描画 ---
+        # 複数のY系列: 全系列をまとめてフィットし、グラフ以降の処理には選択した1系列を使う
+        if multi_y and df_numeric is not None:
+            stage_inputs["series_name"] = ui.render_series_selector(list(df_numeric.columns[1:]))
+
+    # --- サイドバー（ブートストラップ法の設定） ---
+    bootstrap_settings = ui.render_sidebar_bootstrap_settings(graph_settings)
+    stage_inputs.update({f"bootstrap_{name}": value for name, value in bootstrap_settings.items()})
+
+    df_orig, plot_data, _ = run_stage("clean", stage_inputs, stage_sources, timings)
+
     with plot_col:
-        st.subheader("グラフ表示")
-        if df_numeric is not None and not df_numeric.empty:
-            df_plot_data = df_numeric.dropna()
-            if df_plot_data.empty:
-                st.warning("グラフにプロットできる有効な数値データがありません。")
-            else:
-                fig, ax = pg.create_figure_and_axes(graph_settings)
-                pg.set_plot_scale(ax, graph_settings["plot_type"])
-                pg.plot_data_points(ax, df_plot_data, graph_settings)
-
-                final_xlim, final_ylim = pg.determine_final_axis_ranges(
-                    ax, graph_settings, df_plot_data['x'].values, df_plot_data['y'].values
+        render_fit_section(stage_inputs, stage_sources, timings)
+        if plot_data is not None:
+            if len(plot_data) > 0:
+                multi_fit_table, = compute_stages(
+                    "series", ["fit_all_series"], stage_inputs, stage_sources, timings, "全系列をフィットしています…"
                 )
+                if multi_fit_table is not None:
+                    ui.render_multi_fit_results_table(multi_fit_table)
+
+                with timings.stage("latex_table"):
+                    ui.render_data_table_latex_export(df_orig, graph_settings)
 
-                if graph_settings.get("show_fitting") and fit_results_1 and not fit_results_1.get("error_message"):
-                    pg.plot_fit_line_on_final_axes(
-                        ax, final_xlim, df_plot_data['x'].values, fit_results_1, 
-                        graph_settings["plot_type"], graph_settings, 
-                        legend_label=graph_settings.get("fit_legend_label", ""),
-                        line_style='--', color='red'
-                    )
-
-                if graph_settings.get("show_fitting_2") and fit_results_2 and not fit_results_2.get("error_message"):
-                    pg.plot_fit_line_on_final_axes(
-                        ax, final_xlim, df_plot_data['x'].values, fit_results_2, 
-                        graph_settings["plot_type"], graph_settings, 
-                        legend_label=graph_settings.get("fit_legend_label_2", ""),
-                        line_style=':', color='green'
-                    )
-
-                pg.apply_final_axes_and_legend(ax, final_xlim, final_ylim, graph_settings)
-                st.pyplot(fig)
-                ui.render_download_buttons(fig)
-
-                # フィッティング結果表示
-                if graph_settings.get("show_fitting") and fit_results_1:
-                    ui.render_fitting_results_display(
-                        fit_results_1.get("equation_latex"),
-                        f"$R^2 = {fit_results_1.get('r_squared'):.4f}$" if fit_results_1.get('r_squared') is not None else "",
-                        fit_results_1.get("slope_val") is not None,
-                        graph_settings.get("show_fitting")
-                    )
-                if graph_settings.get("show_fitting_2") and fit_results_2:
-                    ui.render_fitting_results_display(
-                        fit_results_2.get("equation_latex"),
-                        f"$R^2 = {fit_results_2.get('r_squared'):.4f}$" if fit_results_2.get('r_squared') is not None else "",
-                        fit_results_2.get("slope_val") is not None,
-                        graph_settings.get("show_fitting_2")
-                    )
-
-                ui.render_data_table_latex_export(df_orig, graph_settings)
-
-        elif raw_data_str and not error_message:
+        elif has_input and not error_message:
             st.warning("グラフを表示するには、まず有効なデータを入力してください。")
-        elif not raw_data_str:
-            st.info("左側のテキストエリアにデータを入力すると、ここにグラフが表示されます。")
\ No newline at end of file
+        elif not has_input:
+            st.info("左側のテキストエリアにデータを入力すると、ここにグラフが表示されます。")
+
+# --- 計測結果の記録と表示 ---
+rerun_summary = timings.finish(
+    parse_cache=dh.get_parse_cache_stats(), fit_cache=fc.get_fit_cache_stats(),
+    export_cache=pg.get_export_cache_stats(), mathtext_cache=pg.get_mathtext_cache_stats(),
+)
+ui.render_instrumentation_panel(rerun_summary)
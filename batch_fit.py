@@ -0,0 +1,11 @@
+# batch_fit.py
+"""
+複数のデータファイルをまとめてフィット・描画するコマンドライン（Streamlitは起動しない）。
+使い方は `python batch_fit.py --help` を参照。
+"""
+import sys
+
+from modules.batch import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# benchmarks/bench_background.py
+"""
+計算プール（modules.background）で段階を計算するときの、古い入力の計算の取り消しのベンチマークと動作確認。
+- 同じ入力の計算を投入し直すと、実行中の計算を引き継ぐこと
+- 入力を変えて投入し直すと、古い計算が始まる前なら取り消され、実行中なら段階の区切りで打ち切られ、
+  それまでに作った figure が破棄されること（最新の入力の結果だけがメモに反映される）
+- プールで計算した結果が、スクリプトのスレッドで計算した結果と同じであること
+- 計算が例外で終わった場合、collect がその例外を送出し、同じ入力で投入し直すと計算し直すこと
+を確認し、テキストエリアに続けて入力した（再実行のたびにデータが変わる）場合に、最後の入力の結果が
+得られるまでの時間を、すべての再実行をスクリプトのスレッドで計算した場合と比べる。
+
+実行例:
+    python benchmarks/bench_background.py --rows 20000 --edits 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STREAM_LOG_LEVEL", "WARNING")
+
+import modules.background as bg  # noqa: E402
+import modules.data_handler as dh  # noqa: E402
+import modules.stages as sg  # noqa: E402
+from modules.pipeline import Stage, StageCancelled, StagePipeline  # noqa: E402
+
+OUTPUTS = ["fit_1", "fit_2", "draw", "display_png"]
+
+
+def make_text(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(1.0, 100.0, n_rows)
+    y = 2.0 * x ** 1.5 * np.exp(rng.normal(0.0, 0.05, n_rows))
+    return "\n".join(f"{a:.6g} {b:.6g}" for a, b in zip(x, y))
+
+
+def make_inputs(raw_data_str):
+    return {
+        "x_label": "$x$", "y_label": "$y$", "tick_length": 5, "plot_type": "両対数", "show_legend": True,
+        "show_fitting": True, "fit_method": "最小二乗法", "fit_model": None, "show_error_bars": False,
+        "decimation_threshold": None, "data_key": dh.compute_data_key(raw_data_str), "multi_y": False,
+        "series_name": None, "show_fitting_2": True, "fit_range_x_min": 10.0, "fit_range_x_max": 40.0,
+        "data_legend_label": "測定値", "fit_legend_label": "近似曲線", "fit_legend_label_2": "範囲フィット",
+        "legend_fontsize": 15,
+    }
+
+
+def prepare(raw_data_str, memo):
+    """パースと整形はスクリプトのスレッドで行う（app.py と同じ）"""
+    inputs, sources = make_inputs(raw_data_str), {"raw_data_str": raw_data_str}
+    sg.PIPELINE.run("clean", inputs, memo, sources)
+    return inputs, sources
+
+
+def check_reuse_and_results(raw_data_str):
+    jobs, memo = bg.SessionJobs(), {}
+    inputs, sources = prepare(raw_data_str, memo)
+    job = jobs.submit("render", sg.PIPELINE, OUTPUTS, inputs, memo, sources)
+    assert jobs.submit("render", sg.PIPELINE, OUTPUTS, inputs, memo, sources) is job
+    job.future.result()
+    jobs.collect("render", job, sg.PIPELINE, memo)
+    assert jobs.submit("render", sg.PIPELINE, OUTPUTS, inputs, memo, sources) is None  # メモにある
+
+    inline = {}
+    prepare(raw_data_str, inline)
+    png = sg.PIPELINE.run("display_png", inputs, inline, sources)
+    assert png == memo["display_png"][1]
+    assert inline["fit_1"][1]["slope_val"] == memo["fit_1"][1]["slope_val"]
+
+
+def check_failed_job():
+    """失敗した計算を使い回さず、次の投入で計算し直すこと"""
+    calls = []
+
+    def flaky(settings):
+        calls.append(settings["value"])
+        if len(calls) == 1:
+            raise RuntimeError("first call fails")
+        return settings["value"] * 2
+
+    pipeline = StagePipeline([Stage("flaky", flaky, inputs=["value"])])
+    jobs, memo, inputs = bg.SessionJobs(), {}, {"value": 21}
+    job = jobs.submit("flaky", pipeline, ["flaky"], inputs, memo)
+    try:
+        jobs.collect("flaky", job, pipeline, memo)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("collect must raise the job's exception")
+    retry = jobs.submit("flaky", pipeline, ["flaky"], inputs, memo)
+    assert retry is not job, "a failed job must not be reused"
+    jobs.collect("flaky", retry, pipeline, memo)
+    assert pipeline.latest("flaky", memo) == 42 and len(calls) == 2
+
+
+def check_supersede(texts):
+    """続けて投入した計算のうち、最後のものだけが反映され、古い計算の figure は破棄されること"""
+    jobs, memo = bg.SessionJobs(), {}
+    submitted = []
+    for raw_data_str in texts:
+        inputs, sources = prepare(raw_data_str, memo)
+        submitted.append(jobs.submit("render", sg.PIPELINE, OUTPUTS, inputs, memo, sources))
+    last = submitted[-1]
+    last.future.result()
+    jobs.collect("render", last, sg.PIPELINE, memo)
+    assert sg.PIPELINE.is_current("display_png", inputs, memo)
+
+    outcome = {"not started": 0, "stopped": 0, "finished": 0}
+    for job in submitted[:-1]:
+        if job.future.cancelled():
+            outcome["not started"] += 1
+            continue
+        try:
+            computed, _ = job.future.result()
+            outcome["finished"] += 1
+        except StageCancelled:
+            outcome["stopped"] += 1
+            continue
+        fig = computed.get("draw", (None, None))[1]
+        assert fig is None or not fig.axes, "superseded figures must be released"
+    assert outcome["finished"] == 0, outcome
+    return outcome
+
+
+def time_inline(texts):
+    """すべての再実行をスクリプトのスレッドで最後まで計算した場合"""
+    memo = {}
+    start = time.perf_counter()
+    for raw_data_str in texts:
+        inputs, sources = prepare(raw_data_str, memo)
+        for name in OUTPUTS:
+            sg.PIPELINE.run(name, inputs, memo, sources)
+    return time.perf_counter() - start
+
+
+def time_background(texts, interval_s):
+    """interval_s ごとに入力が変わり、再実行のたびに計算を投入し直した場合（最後の結果が得られるまで）"""
+    jobs, memo = bg.SessionJobs(), {}
+    start = time.perf_counter()
+    for raw_data_str in texts:
+        inputs, sources = prepare(raw_data_str, memo)
+        job = jobs.submit("render", sg.PIPELINE, OUTPUTS, inputs, memo, sources)
+        time.sleep(interval_s)
+    job.future.result()
+    jobs.collect("render", job, sg.PIPELINE, memo)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--edits", type=int, default=5, help="続けて入力する回数")
+    parser.add_argument("--interval", type=float, default=0.1, help="入力の間隔（秒）")
+    args = parser.parse_args()
+
+    check_reuse_and_results(make_text(2000))
+    check_failed_job()
+    texts = [make_text(args.rows, seed=i) for i in range(args.edits)]
+    outcome = check_supersede(texts)
+    print(f"checks: OK (superseded jobs: {outcome})")
+
+    texts = [make_text(args.rows, seed=100 + i) for i in range(args.edits)]
+    inline = time_inline(texts)
+    texts = [make_text(args.rows, seed=200 + i) for i in range(args.edits)]
+    background = time_background(texts, args.interval)
+    print(f"workers={bg.COMPUTE_WORKERS} rows={args.rows} edits={args.edits} interval={args.interval:.2f}s")
+    print(f"  time until the last input's graph: inline {inline * 1e3:.0f} ms, pool {background * 1e3:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
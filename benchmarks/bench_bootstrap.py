@@ -0,0 +1,132 @@
+# benchmarks/bench_bootstrap.py
+"""
+ブートストラップ法による信頼区間のベンチマークと動作確認。
+- 同じシードで同じ結果になること（プロセスプールを使った場合も含む）
+- 誤差が一様なデータでは、再標本の標準偏差が解析的な標準誤差とほぼ一致すること
+- 計算時間の上限が守られること
+- プロセスプールを続けて使っても、共有メモリが残らないこと
+を確認し、点数と再標本数ごとの計算時間と、100万点での1プロセスとプロセスプールの計算時間の比を表示する
+（プールの速度向上には2コア以上が必要。1コアでは起動と受け渡しの分だけ遅くなる）。
+
+実行例:
+    python benchmarks/bench_bootstrap.py --rows 100 10000 1000000 --resamples 2000 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STREAM_LOG_LEVEL", "WARNING")
+# 1コアの環境でもプロセスプールの経路を確認できるよう、プールのプロセス数は2以上にする
+os.environ.setdefault("STREAM_BOOTSTRAP_WORKERS", str(max(2, os.cpu_count() or 1)))
+
+import modules.fitting_calculator as fc  # noqa: E402
+
+
+def make_data(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.0, 10.0, n_rows)
+    return x, 3.0 * x - 2.0 + rng.normal(0.0, 0.5, n_rows)
+
+
+def check_reproducible():
+    x, y = make_data(1000)
+    first = fc.bootstrap_fit_parameters(x, y, "通常", n_resamples=500, seed=42)
+    second = fc.bootstrap_fit_parameters(x, y, "通常", n_resamples=500, seed=42)
+    other = fc.bootstrap_fit_parameters(x, y, "通常", n_resamples=500, seed=43)
+    assert first["slope_ci"] == second["slope_ci"] and first["A_ci"] == second["A_ci"]
+    assert first["slope_ci"] != other["slope_ci"]
+
+    # プロセスプールで計算しても、再標本の塊ごとの乱数列が同じなので結果は一致する
+    x, y = make_data(fc.BOOTSTRAP_POOL_MIN_POINTS)
+    serial = fc.bootstrap_fit_parameters(x, y, "通常", n_resamples=200, seed=7, workers=1)
+    pooled = fc.bootstrap_fit_parameters(x, y, "通常", n_resamples=200, seed=7, workers=2)
+    assert serial["slope_ci"] == pooled["slope_ci"], (serial["slope_ci"], pooled["slope_ci"])
+
+
+def check_against_analytic():
+    x, y = make_data(2000)
+    _, slope_err, _, intercept_err, _ = fc.perform_linear_fit_with_uncertainty(x, y)
+    result = fc.bootstrap_fit_parameters(x, y, "通常", n_resamples=4000, seed=0)
+    assert abs(result["slope_se"] / slope_err - 1.0) < 0.1, (result["slope_se"], slope_err)
+    assert abs(result["intercept_se"] / intercept_err - 1.0) < 0.1, (result["intercept_se"], intercept_err)
+
+
+def check_time_budget():
+    x, y = make_data(1_000_000)
+    start = time.perf_counter()
+    result = fc.bootstrap_fit_parameters(x, y, "通常", n_resamples=100_000, seed=0, time_budget_s=0.5)
+    elapsed = time.perf_counter() - start
+    assert result["truncated"] and result["n_resamples"] > 0
+    assert elapsed < 1.5, elapsed
+
+
+def check_no_leaked_segments(timeout_s=30.0):
+    """
+    制限時間で打ち切った場合も含め、呼び出しごとに作った共有メモリを、実行中の塊が終わった後に消し、
+    プールのプロセスも開いたままにしないこと
+    """
+    if not os.path.isdir("/dev/shm"):
+        return
+
+    def segments():
+        return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+    before = segments()
+    x, y = make_data(fc.BOOTSTRAP_POOL_MIN_POINTS)
+    for budget in (None, 0.05):
+        fc.bootstrap_fit_parameters(x, y, "通常", n_resamples=200, seed=1, workers=2, time_budget_s=budget)
+    give_up = time.perf_counter() + timeout_s
+    while segments() - before and time.perf_counter() < give_up:
+        time.sleep(0.05)
+    assert not segments() - before, segments() - before
+    for pid in fc._get_bootstrap_pool()._processes:
+        with open(f"/proc/{pid}/maps") as f:
+            assert "psm_" not in f.read(), f"worker {pid} keeps a segment attached"
+
+
+def measure_pool_speedup(n_rows, n_resamples, workers):
+    """(1プロセスの時間, プール起動を含む1回目の時間, 起動済みのプールでの時間) を返す"""
+    x, y = make_data(n_rows)
+    times = []
+    for w in (1, workers, workers):
+        start = time.perf_counter()
+        fc.bootstrap_fit_parameters(x, y, "通常", n_resamples=n_resamples, seed=0, workers=w)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 10_000, 100_000])
+    parser.add_argument("--resamples", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    check_reproducible()
+    check_against_analytic()
+    check_time_budget()
+    check_no_leaked_segments()
+    print("checks: OK")
+
+    print(f"{'rows':>10} {'resamples':>10} {'time [ms]':>10} {'per resample [us]':>18}")
+    for n_rows in args.rows:
+        x, y = make_data(n_rows)
+        start = time.perf_counter()
+        result = fc.bootstrap_fit_parameters(x, y, "通常", n_resamples=args.resamples, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        print(f"{n_rows:>10} {result['n_resamples']:>10} {elapsed * 1e3:>10.1f} "
+              f"{elapsed / result['n_resamples'] * 1e6:>18.1f}")
+
+    workers = max(2, args.workers)
+    serial, first, reused = measure_pool_speedup(1_000_000, 200, workers)
+    print(f"1000000 rows x 200 resamples on {os.cpu_count()} CPU(s): 1 process {serial * 1e3:.0f} ms, "
+          f"pool of {fc.BOOTSTRAP_POOL_WORKERS} with workers={workers}: first call {first * 1e3:.0f} ms, "
+          f"reused {reused * 1e3:.0f} ms (speedup {serial / reused:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
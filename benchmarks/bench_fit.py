@@ -0,0 +1,142 @@
+# benchmarks/bench_fit.py
+"""
+線形フィットのベンチマークと、scikit-learn版との一致確認。
+perform_linear_fit_with_uncertainty（十分統計量による閉形式）と
+sklearn_fit（scikit-learn による従来の実装）を、
+点数の少ないデータ、xやyが一定のデータ、xに大きなオフセットがあるデータなどで照合し、
+4つのグラフ種類の変換後データに対して計算時間を比較する。
+
+実行例:
+    python benchmarks/bench_fit.py --rows 1000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.fitting_calculator as fc  # noqa: E402
+
+PLOT_TYPES = ["通常", "片対数 (Y軸対数)", "片対数 (X軸対数)", "両対数"]
+
+
+def regression_uncertainties(x, y, y_pred):
+    """従来の実装の、傾きと切片の不確かさ（包含係数1）"""
+    n = len(x)
+    if n <= 2:  # 自由度が0以下になるため計算不可
+        return np.nan, np.nan
+    residuals = y - y_pred
+    std_error_of_residuals = np.sqrt(np.sum(residuals**2) / (n - 2))
+    x_mean = np.mean(x)
+    sum_sq_x_dev = np.sum((x - x_mean)**2)
+    if sum_sq_x_dev == 0:  # 全てのxが同じ値の場合など
+        return np.nan, np.nan
+    return (std_error_of_residuals / np.sqrt(sum_sq_x_dev),
+            std_error_of_residuals * np.sqrt(1 / n + x_mean**2 / sum_sq_x_dev))
+
+
+def sklearn_fit(x, y, fit_intercept=True):
+    """
+    比較用: 従来の実装（scikit-learn の LinearRegression と r2_score）。
+    (傾き, 傾きの不確かさ, 切片, 切片の不確かさ, R^2) を返す。
+    """
+    from sklearn.linear_model import LinearRegression
+    from sklearn.metrics import r2_score
+
+    min_points = 2 if fit_intercept else 1
+    if len(x) < min_points or len(x) != len(y) or not (np.all(np.isfinite(x)) and np.all(np.isfinite(y))):
+        return None, np.nan, None, np.nan, None
+    model = LinearRegression(fit_intercept=fit_intercept)
+    model.fit(x.reshape(-1, 1), y)
+    y_pred = model.predict(x.reshape(-1, 1))
+    slope_err, intercept_err = np.nan, np.nan
+    if fit_intercept:
+        slope_err, intercept_err = regression_uncertainties(x, y, y_pred)
+    intercept = model.intercept_ if fit_intercept else 0.0
+    return model.coef_[0], slope_err, intercept, intercept_err, r2_score(y, y_pred)
+
+
+def make_data(n_rows, plot_type, seed=0):
+    """グラフ種類に応じたモデルからデータを生成し、フィットに使う変換後の (x, y) を返す"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.5, 50.0, n_rows)
+    noise = rng.normal(0.0, 0.05, n_rows)
+    if plot_type == "通常":
+        return x, 3.0 * x - 2.0 + noise
+    if plot_type == "片対数 (Y軸対数)":
+        return x, np.log(2.0 * np.exp(0.05 * x) * np.exp(noise))
+    if plot_type == "片対数 (X軸対数)":
+        return np.log(x), 1.5 * np.log(x) + 4.0 + noise
+    return np.log(x), np.log(0.7 * x**1.8 * np.exp(noise))
+
+
+def check_equivalence(x, y, fit_intercept=True, label=""):
+    expected = sklearn_fit(x, y, fit_intercept=fit_intercept)
+    actual = fc.perform_linear_fit_with_uncertainty(x, y, fit_intercept=fit_intercept)
+    for name, e, a in zip(["slope", "slope_err", "intercept", "intercept_err", "r_squared"], expected, actual):
+        if e is None or a is None:
+            assert e is None and a is None, f"{label} {name}: {e} != {a}"
+            continue
+        np.testing.assert_allclose(a, e, rtol=1e-7, atol=1e-9, equal_nan=True, err_msg=f"{label} {name}")
+
+
+def check_edge_cases():
+    """点数が少ない場合や、xまたはyが一定の場合、xに大きなオフセットがある場合の一致を確認する"""
+    rng = np.random.default_rng(1)
+    noisy_x = np.linspace(0.0, 10.0, 1000)
+    noisy_y = -0.3 * noisy_x + 5.0 + rng.normal(0.0, 0.2, 1000)
+    cases = {
+        "2 points": (np.array([1.0, 2.0]), np.array([3.0, 5.0])),
+        "3 points": (np.array([1.0, 2.0, 4.0]), np.array([3.0, 5.5, 8.0])),
+        "constant x": (np.full(5, 2.0), np.arange(5.0)),
+        "constant y": (np.arange(5.0), np.full(5, 2.0)),
+        "perfect line": (np.arange(10.0), 2.0 * np.arange(10.0) + 1.0),
+        "large offset": (1e8 + np.arange(100.0), 1e6 + 0.5 * np.arange(100.0)),
+        "noisy": (noisy_x, noisy_y),
+        "noisy, large x offset": (1e6 + noisy_x, noisy_y),
+        "noisy, large y offset": (noisy_x, 1e6 + noisy_y),
+        **{plot_type: make_data(500, plot_type, seed=2) for plot_type in PLOT_TYPES},
+    }
+    for label, (x, y) in cases.items():
+        check_equivalence(x, y, label=label)
+        check_equivalence(x, y, fit_intercept=False, label=f"{label} (no intercept)")
+    for label, (x, y) in {"1 point": (np.array([1.0]), np.array([2.0])),
+                          "nan": (np.array([1.0, np.nan, 3.0]), np.array([1.0, 2.0, 3.0]))}.items():
+        assert fc.perform_linear_fit_with_uncertainty(x, y)[0] is None, label
+        assert sklearn_fit(x, y)[0] is None, label
+
+
+def best_of(func, x, y, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(x, y)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 10_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    check_edge_cases()
+    print("edge cases: OK")
+
+    print(f"{'plot_type':<20} {'rows':>10} {'sklearn [ms]':>14} {'closed-form [ms]':>17} {'speedup':>8}")
+    for plot_type in PLOT_TYPES:
+        for n_rows in args.rows:
+            x, y = make_data(n_rows, plot_type)
+            check_equivalence(x, y, label=f"{plot_type} n={n_rows}")
+            legacy_s = best_of(sklearn_fit, x, y, args.repeat)
+            current_s = best_of(fc.perform_linear_fit_with_uncertainty, x, y, args.repeat)
+            print(f"{plot_type:<20} {n_rows:>10} {legacy_s * 1e3:>14.3f} {current_s * 1e3:>17.3f} "
+                  f"{legacy_s / current_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/bench_fit_cache.py
+"""
+セッション間で共有するフィット結果キャッシュのベンチマークと動作確認。
+- キャッシュした結果が、書き換えできない（辞書も配列も）こと
+- 有効期限とエントリ数の上限で古い結果が捨てられること
+- 範囲にデータ点が無い結果（None）もキャッシュされること
+を確認し、同じデータを貼り付けた多数のセッションがフィットする時間を、キャッシュの有無で比べる。
+
+実行例:
+    python benchmarks/bench_fit_cache.py --rows 10000 1000000 --sessions 30
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STREAM_LOG_LEVEL", "WARNING")
+
+import modules.fitting_calculator as fc  # noqa: E402
+from modules.cache import LRUCache  # noqa: E402
+from modules.dataset import Dataset  # noqa: E402
+
+PLOT_TYPES = ["通常", "片対数 (Y軸対数)", "片対数 (X軸対数)", "両対数"]
+
+
+def make_data(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.1, 100.0, n_rows)
+    return Dataset(x, 2.0 * x ** 1.5 * np.exp(rng.normal(0.0, 0.05, n_rows)))
+
+
+def check_immutable():
+    data = make_data(1000)
+    result = fc.cached_fit("immutable", "両対数", None,
+                           lambda: fc.calculate_fitting_parameters_v3(data.x, data.y, "両対数"))
+    try:
+        result["slope_val"] = 0.0
+        raise AssertionError("fit results must be read-only")
+    except TypeError:
+        pass
+    try:
+        result["x_transformed"][0] = 0.0
+        raise AssertionError("arrays in fit results must be read-only")
+    except ValueError:
+        pass
+    # 値を追加する場合は複製する。キャッシュの中身は変わらない
+    extended = {**result, "bootstrap": {"n_resamples": 1}}
+    again = fc.cached_fit("immutable", "両対数", None, lambda: None)
+    assert again is result and again["bootstrap"] is None and extended["bootstrap"] is not None
+
+
+def check_eviction():
+    now = [0.0]
+    cache = LRUCache(1 << 20, max_entries=3, ttl_s=10.0, clock=lambda: now[0])
+    for i in range(4):
+        cache.put(i, i)
+    assert cache.get(0) is None and cache.get(1) == 1, "max_entries"
+    now[0] = 11.0
+    assert cache.get(1) is None, "ttl"
+    cache.put("new", 1)
+    stats = cache.stats()
+    assert stats["entries"] == 1 and stats["expirations"] == 3, stats
+
+    data = make_data(100)
+    calls = []
+
+    def empty_range():
+        calls.append(1)
+        return fc.RangeFitIndex(data.x, data.y, "通常").fit(1e6, 2e6)
+
+    assert fc.cached_fit("none", "通常", (1e6, 2e6), empty_range) is None
+    assert fc.cached_fit("none", "通常", (1e6, 2e6), empty_range) is None
+    assert len(calls) == 1, "None results must be cached"
+
+
+def simulate_sessions(data, data_key, n_sessions, use_cache):
+    """n_sessions 個のセッションが同じデータを4種類のグラフでフィットする時間 [s]"""
+    start = time.perf_counter()
+    for _ in range(n_sessions):
+        for plot_type in PLOT_TYPES:
+            def compute():
+                return fc.calculate_fitting_parameters_v3(data.x, data.y, plot_type)
+            if use_cache:
+                fc.cached_fit(data_key, plot_type, None, compute)
+            else:
+                compute()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000])
+    parser.add_argument("--sessions", type=int, default=30)
+    args = parser.parse_args()
+
+    check_immutable()
+    check_eviction()
+    print("checks: OK")
+
+    print(f"{'rows':>10} {'sessions':>9} {'uncached [ms]':>14} {'cached [ms]':>12} {'hit ratio':>10}")
+    for n_rows in args.rows:
+        data = make_data(n_rows)
+        data_key = f"bench-{n_rows}"
+        uncached = simulate_sessions(data, data_key, args.sessions, use_cache=False)
+        before = fc.get_fit_cache_stats()
+        cached = simulate_sessions(data, data_key, args.sessions, use_cache=True)
+        after = fc.get_fit_cache_stats()
+        hits, misses = after["hits"] - before["hits"], after["misses"] - before["misses"]
+        print(f"{n_rows:>10} {args.sessions:>9} {uncached * 1e3:>14.1f} {cached * 1e3:>12.1f} "
+              f"{hits / (hits + misses):>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# benchmarks/bench_latex.py
+"""
+データテーブルのLaTeX出力のベンチマーク。
+現在の generate_latex_table（列ごとの文字列変換 + ジェネレーター）と、
+従来の実装（iterrows + セルごとの str()）を比較し、出力が一致することを確認する。
+
+実行例:
+    python benchmarks/bench_latex.py --rows 1000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.latex_table as lt  # noqa: E402
+
+
+def legacy_generate_latex_table(df, x_col_name='x', y_col_name='y', x_header='$x$', y_header='$y$'):
+    """比較用: 高速化前の generate_latex_table"""
+    if df is None or df.empty:
+        return ""
+    lines = [
+        "\\begin{tabular}{cc}",
+        "\\label{tab:table_label}",
+        "\\caption{string}",
+        "\\centering",
+        "\\hline\\hline",
+        f"{x_header} & {y_header} \\\\",
+        "\\hline"
+    ]
+    for index, row in df.iterrows():
+        lines.append(f"{str(row[x_col_name])} & {str(row[y_col_name])} \\\\")
+    lines.extend(["\\hline\\hline", "\\end{tabular}"])
+    return "\n".join(lines)
+
+
+def make_frame(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.0, 100.0, n_rows)
+    return pd.DataFrame({"x": x, "y": 2.0 * x + rng.normal(0.0, 1.0, n_rows)})
+
+
+def check_edge_cases():
+    """整数列との混在、文字列、欠損値、空のデータで従来の出力と一致することを確認する"""
+    cases = {
+        "int and float": pd.DataFrame({"x": [1, 2, 3], "y": [0.5, 1e-5, 1e16]}),
+        "int only": pd.DataFrame({"x": [1, 2, 3], "y": [4, 5, 6]}),
+        "with error column": pd.DataFrame({"x": [1, 2], "y": [0.1, 0.2], "y_error": [1, 2]}),
+        "strings": pd.DataFrame({"x": ["1", "a"], "y": [1.5, 2.0]}),
+        "nan": pd.DataFrame({"x": [1.0, np.nan], "y": [np.nan, -0.0]}),
+        "empty": pd.DataFrame({"x": [], "y": []}),
+    }
+    for label, df in cases.items():
+        assert lt.generate_latex_table(df) == legacy_generate_latex_table(df), label
+
+
+def check_layouts():
+    """longtable と分割出力が、行を欠かさず重複なく含むことを確認する"""
+    df = make_frame(25)
+    row_count = len(df)
+    longtable = lt.generate_latex_table(df, longtable=True)
+    assert longtable.startswith("\\begin{longtable}") and longtable.endswith("\\end{longtable}")
+    split = lt.generate_latex_table(df, rows_per_table=10)
+    assert split.count("\\begin{tabular}") == 3 and split.count("\\end{tabular}") == 3
+    for text in (longtable, split):
+        data_rows = [line for line in text.splitlines() if line.endswith("\\\\") and "$x$" not in line
+                     and "\\label" not in line]
+        assert len(data_rows) == row_count, (len(data_rows), row_count)
+
+
+def best_of(func, arg, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    check_edge_cases()
+    check_layouts()
+    print("edge cases: OK")
+
+    print(f"{'rows':>10} {'legacy [ms]':>12} {'current [ms]':>13} {'speedup':>8}")
+    for n_rows in args.rows:
+        df = make_frame(n_rows)
+        assert lt.generate_latex_table(df) == legacy_generate_latex_table(df), n_rows
+        legacy_s = best_of(legacy_generate_latex_table, df, 1)
+        current_s = best_of(lt.generate_latex_table, df, args.repeat)
+        print(f"{n_rows:>10} {legacy_s * 1e3:>12.1f} {current_s * 1e3:>13.1f} {legacy_s / current_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# benchmarks/bench_multi_fit.py
+"""
+複数のY系列の一括フィットのベンチマーク。
+fit_multiple_series（行列演算1回）と、系列ごとに calculate_fitting_parameters_v3 を
+呼ぶ場合を比較し、4つのグラフ種類で結果が一致することを確認する。
+
+実行例:
+    python benchmarks/bench_multi_fit.py --rows 1000 100000 --series 50
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.fitting_calculator as fc  # noqa: E402
+
+PLOT_TYPES = ["通常", "片対数 (Y軸対数)", "片対数 (X軸対数)", "両対数"]
+COMPARED = [("slope", "slope_val"), ("slope_err", "slope_err"), ("intercept", "intercept_val"),
+            ("intercept_err", "intercept_err"), ("A", "A_val"), ("A_err", "A_err"),
+            ("B", "B_val"), ("B_err", "B_err"), ("r_squared", "r_squared")]
+
+
+def make_data(n_rows, n_series, seed=0):
+    """べき関数に雑音を加えたY系列を作る（一部に NaN と負の値を混ぜる）"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.5, 50.0, n_rows)
+    exponents = rng.uniform(0.5, 2.0, n_series)
+    y = 0.7 * x[:, np.newaxis] ** exponents * np.exp(rng.normal(0.0, 0.05, (n_rows, n_series)))
+    y[rng.random((n_rows, n_series)) < 0.01] = np.nan
+    y[rng.random((n_rows, n_series)) < 0.01] *= -1
+    return x, y
+
+
+def loop_fit(x, y, plot_type):
+    """比較用: 系列ごとに NaN を除いて calculate_fitting_parameters_v3 を呼ぶ"""
+    results = []
+    for j in range(y.shape[1]):
+        mask = np.isfinite(x) & np.isfinite(y[:, j])
+        results.append(fc.calculate_fitting_parameters_v3(x[mask], y[mask, j], plot_type))
+    return results
+
+
+def check_equivalence(x, y, plot_type, label):
+    table = fc.fit_multiple_series(x, y, plot_type)
+    for j, expected in enumerate(loop_fit(x, y, plot_type)):
+        row = table.iloc[j]
+        assert row["error"] == expected["error_message"], f"{label} series {j}: {row['error']}"
+        if expected["error_message"]:
+            continue
+        assert row["equation"] == expected["equation_text"], f"{label} series {j}"
+        for column, key in COMPARED:
+            np.testing.assert_allclose(row[column], expected[key], rtol=1e-9, atol=1e-12, equal_nan=True,
+                                       err_msg=f"{label} series {j} {column}")
+
+
+def check_edge_cases():
+    """全点が負・1点のみ・全点 NaN・一定値の系列を含む場合"""
+    x = np.array([1.0, 2.0, 3.0, 4.0])
+    y = np.column_stack([
+        [-1.0, -2.0, -3.0, -4.0],
+        [np.nan, np.nan, 5.0, np.nan],
+        [np.nan] * 4,
+        [2.0, 2.0, 2.0, 2.0],
+        [1.0, 2.0, 2.9, 4.2],
+    ])
+    for plot_type in PLOT_TYPES:
+        table = fc.fit_multiple_series(x, y, plot_type)
+        for j in range(y.shape[1]):
+            mask = np.isfinite(y[:, j])
+            if not mask.any():  # app.py では NaN だけの系列はフィットしない
+                assert table.iloc[j]["error"] is not None
+                continue
+            expected = fc.calculate_fitting_parameters_v3(x[mask], y[mask, j], plot_type)
+            assert table.iloc[j]["error"] == expected["error_message"], (plot_type, j)
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--series", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    check_edge_cases()
+    print("edge cases: OK")
+
+    print(f"{'plot_type':<20} {'rows':>8} {'series':>7} {'loop [ms]':>10} {'batched [ms]':>13} {'speedup':>8}")
+    for plot_type in PLOT_TYPES:
+        for n_rows in args.rows:
+            x, y = make_data(n_rows, args.series)
+            check_equivalence(x, y, plot_type, f"{plot_type} n={n_rows}")
+            loop_s = best_of(lambda: loop_fit(x, y, plot_type), args.repeat)
+            batched_s = best_of(lambda: fc.fit_multiple_series(x, y, plot_type), args.repeat)
+            print(f"{plot_type:<20} {n_rows:>8} {args.series:>7} {loop_s * 1e3:>10.1f} "
+                  f"{batched_s * 1e3:>13.1f} {loop_s / batched_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# benchmarks/bench_nonlinear_fit.py
+"""
+元の空間での非線形最小二乗法（modules.nonlinear_fit）のベンチマークと動作確認。
+- 各モデルの解析的なヤコビアンが数値微分と一致すること
+- パラメータと共分散が scipy.optimize.curve_fit と一致すること（scipy がある場合）
+- y に加わる誤差が一定のとき、対数変換した直線フィットより A, B の偏りが小さいこと
+- 前回のパラメータから始めると、一部の点を直したデータが2回の反復で収束すること
+- 範囲フィット・複数系列のフィットが、点を切り出して calculate_nonlinear_fit に渡した結果と一致すること
+を確認し、点数ごとの計算時間と反復回数を、対数変換した直線フィットと比べる。
+
+実行例:
+    python benchmarks/bench_nonlinear_fit.py --rows 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STREAM_LOG_LEVEL", "WARNING")
+
+import modules.fitting_calculator as fc  # noqa: E402
+import modules.nonlinear_fit as nf  # noqa: E402
+import modules.plot_generator as pg  # noqa: E402
+
+NONLINEAR = fc.NONLINEAR_FIT_METHOD
+# モデルごとの真のパラメータと x の範囲
+CASES = {
+    "直線": ([3.0, 1.5], (0.0, 10.0)),
+    "指数関数": ([2.0, 0.3], (0.0, 10.0)),
+    "対数関数": ([1.0, 2.5], (0.1, 10.0)),
+    "べき関数": ([2.0, 1.5], (0.1, 10.0)),
+    "2次多項式": ([1.0, -2.0, 0.5], (-5.0, 5.0)),
+    "3次多項式": ([1.0, -2.0, 0.5, 0.1], (-5.0, 5.0)),
+}
+
+
+def make_data(model_name, n_rows, noise=0.5, seed=0):
+    """真のモデルの値に、一定の大きさの正規分布の誤差を加えたデータ"""
+    params, (low, high) = CASES[model_name]
+    rng = np.random.default_rng(seed)
+    x = np.sort(rng.uniform(low, high, n_rows))
+    return x, nf.MODELS[model_name].predict(x, params) + rng.normal(0.0, noise, n_rows)
+
+
+def check_jacobians():
+    for name, (params, _) in CASES.items():
+        model = nf.MODELS[name]
+        x, _ = make_data(name, 50)
+        analytic = model.jacobian(x, np.array(params))
+        for k in range(len(params)):
+            h = 1e-6 * max(abs(params[k]), 1.0)
+            plus, minus = np.array(params, dtype=float), np.array(params, dtype=float)
+            plus[k] += h
+            minus[k] -= h
+            numeric = (model.predict(x, plus) - model.predict(x, minus)) / (2 * h)
+            assert np.allclose(analytic[:, k], numeric, rtol=1e-6, atol=1e-6), (name, k)
+
+
+def check_against_scipy():
+    try:
+        from scipy.optimize import curve_fit
+    except ImportError:
+        return False
+    for name, (params, _) in CASES.items():
+        model = nf.MODELS[name]
+        x, y = make_data(name, 2000, seed=1)
+        result = fc.calculate_nonlinear_fit(x, y, "通常", name)
+        reference, reference_cov = curve_fit(lambda x, *p: model.function(x, np.array(p)), x, y, p0=params)
+        assert np.allclose(result["params"], reference, rtol=1e-6, atol=1e-9), name
+        assert np.allclose(result["covariance"], reference_cov, rtol=1e-4, atol=1e-12), name
+    return True
+
+
+def edited(y, fraction=0.01, seed=5):
+    """再実行で一部の点だけ値を直したデータ"""
+    y = y.copy()
+    step = int(round(1 / fraction))
+    y[::step] += np.random.default_rng(seed).normal(0.0, 0.5, len(y[::step]))
+    return y
+
+
+def check_bias(n_trials=200):
+    """指数関数の B（y の誤差一定）の偏り: (対数変換した直線フィット, 非線形最小二乗法)"""
+    linearized, nonlinear = [], []
+    for seed in range(n_trials):
+        x, y = make_data("指数関数", 200, noise=1.0, seed=seed)
+        linearized.append(fc.calculate_fitting_parameters_v3(x, y, "片対数 (Y軸対数)")["B_val"])
+        nonlinear.append(fc.calculate_fitting_parameters_v3(x, y, "片対数 (Y軸対数)", NONLINEAR)["B_val"])
+    true_b = CASES["指数関数"][0][1]
+    bias = abs(np.mean(linearized) - true_b), abs(np.mean(nonlinear) - true_b)
+    assert bias[1] < 0.2 * bias[0], bias
+    return bias
+
+
+def check_warm_start():
+    for name in CASES:
+        x, y = make_data(name, 5000, seed=2)
+        previous = fc.calculate_nonlinear_fit(x, y, "通常", name)
+        y_next = edited(y)
+        cold = fc.calculate_nonlinear_fit(x, y_next, "通常", name)
+        warm = fc.calculate_nonlinear_fit(x, y_next, "通常", name, warm_start=previous["params"])
+        assert np.allclose(warm["params"], cold["params"], rtol=1e-6, atol=1e-9), name
+        assert warm["n_iterations"] <= 2, (name, warm["n_iterations"])
+        # 同じデータの再実行は1回の反復で収束を確かめるだけ
+        again = fc.calculate_nonlinear_fit(x, y_next, "通常", name, warm_start=warm["params"])
+        assert again["n_iterations"] == 1, (name, again["n_iterations"])
+
+
+def check_ranges_and_series():
+    x, y = make_data("べき関数", 3000, seed=4)
+    x = np.concatenate([x, [-1.0]])  # べき関数の定義域の外の点は除かれる
+    y = np.concatenate([y, [5.0]])
+    full = fc.calculate_fitting_parameters_v3(x, y, "両対数", NONLINEAR)
+    assert full["model"] == "べき関数" and full["valid_indices"].sum() == 3000 and full["equation_latex"]
+
+    index = fc.RangeFitIndex(x, y, "両対数")
+    in_range = (x >= 2.0) & (x <= 7.0)
+    direct = fc.calculate_nonlinear_fit(x[in_range], y[in_range], "両対数")
+    ranged = index.fit(2.0, 7.0, NONLINEAR)
+    for key in ("A_val", "A_err", "B_val", "B_err", "r_squared"):
+        assert np.isclose(ranged[key], direct[key], rtol=1e-9), key
+
+    table = fc.fit_multiple_series(x, np.column_stack([y, -y]), "両対数", method=NONLINEAR)
+    assert np.isclose(table["B"][0], full["B_val"], rtol=1e-9)
+    assert np.isclose(table["A"][1], -full["A_val"], rtol=1e-9)
+
+    # 多項式は A, B を持たず、近似線はモデルから計算する
+    poly = fc.calculate_fitting_parameters_v3(x[:-1], y[:-1], "通常", NONLINEAR, model="2次多項式")
+    assert poly["A_val"] is None and np.isnan(poly["slope_val"])
+    line = pg.compute_fit_line(poly, "通常", (0.0, 10.0), x)
+    assert np.allclose(line[1], np.polynomial.polynomial.polyval(line[0], poly["params"]))
+
+    # モデルが違う結果は共有キャッシュで別のエントリになる
+    results = {m: fc.cached_fit("nonlinear-check", "通常", None,
+                                lambda m=m: fc.calculate_fitting_parameters_v3(x, y, "通常", NONLINEAR, m),
+                                method=NONLINEAR, model=m)
+               for m in ("直線", "2次多項式")}
+    assert results["直線"]["model"] == "直線" and results["2次多項式"]["model"] == "2次多項式"
+
+
+def time_fit(x, y, method, warm_start=None):
+    start = time.perf_counter()
+    result = fc.calculate_fitting_parameters_v3(x, y, "片対数 (Y軸対数)", method, warm_start=warm_start)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    check_jacobians()
+    with_scipy = check_against_scipy()
+    bias = check_bias()
+    check_warm_start()
+    check_ranges_and_series()
+    print("checks: OK" + ("" if with_scipy else " (scipy not installed; curve_fit comparison skipped)"))
+    print(f"bias of B (exponential, constant y noise): linearized {bias[0]:.4f}, nonlinear {bias[1]:.4f}")
+
+    print(f"{'rows':>10} {'linearized [ms]':>16} {'cold [ms]':>10} {'iters':>6} {'warm [ms]':>10} {'iters':>6}")
+    for n_rows in args.rows:
+        x, y = make_data("指数関数", n_rows)
+        linearized, _ = time_fit(x, y, fc.DEFAULT_FIT_METHOD)
+        cold, result = time_fit(x, y, NONLINEAR)
+        warm, warm_result = time_fit(x, edited(y), NONLINEAR, warm_start=result["params"])
+        print(f"{n_rows:>10} {linearized * 1e3:>16.1f} {cold * 1e3:>10.1f} {result['n_iterations']:>6} "
+              f"{warm * 1e3:>10.1f} {warm_result['n_iterations']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# benchmarks/bench_parse.py
+"""
+テキストデータ読み込みのベンチマーク。
+現在の parse_text_data と、従来の実装（正規表現区切りの read_csv + apply(pd.to_numeric)）を比較する。
+計測の前に、数値以外の値（16進数、真偽値、日付・時刻、欠損値の表記など）、行の途中のコメント、
+タブとスペースの混在を含む入力も高速経路で読み込み、結果が従来の実装と同じ
+（数値データでは NaN、元データでは入力した文字列のまま）であることを確認する。
+
+実行例:
+    python benchmarks/bench_parse.py --rows 100000 1000000 3000000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.data_handler as dh  # noqa: E402
+
+
+def legacy_parse_text_data(raw_data_str):
+    """比較用: 高速化前の parse_text_data"""
+    lines = raw_data_str.strip().split('\n')
+    num_columns = 0
+    for line in lines:
+        if not line.strip().startswith('#'):
+            num_columns = len(line.split())
+            break
+    names = ['x', 'y']
+    if num_columns == 3:
+        names.append('y_error')
+    df_orig = pd.read_csv(
+        io.StringIO(raw_data_str), sep=r'\s+', header=None,
+        names=names, comment='#'
+    )
+    df_numeric = df_orig.apply(pd.to_numeric, errors='coerce')
+    return df_orig, df_numeric, None
+
+
+# 高速経路で数値や日付として読まれやすいが、従来の実装では数値にしない値
+EDGE_TOKENS = ["0x10", "0X1F", "true", "false", "True", "FALSE", "2024-01-15", "12:30:00", "2024-01-15T12:30:00",
+               "abc", "NA", "nan", "None", "inf", "-inf", "1e3"]
+# 高速経路で読み込む、数値以外の部分を含む入力
+OTHER_TEXTS = [
+    "# x y\n1 2\n# 途中のコメント\n3 4\n5 6 # 行末のコメント\n",
+    "1\t2\n3 4\n5\t6",
+    "1 2\r\n3 4\r\n",
+]
+# 区切りが不規則なため pandas の読み込みに切り替える入力（結果は同じになること）
+FALLBACK_TEXTS = ["1  2\n3 4", "1 2 \n3 4", "1 2\n \n3 4", "1 2 0.1\n3  4 0.2", "1\t\t2\n3\t4"]
+
+
+def edge_case_texts():
+    """列全体がその値の場合と、数値の列に混ざっている場合"""
+    for token in EDGE_TOKENS:
+        yield f"1 {token}\n2 {token}\n3 {token}"
+        yield f"1 2.5\n2 {token}\n3 4.5"
+        yield f"{token} 1\n{token} 2"
+    yield from OTHER_TEXTS
+
+
+def check_edge_cases():
+    for text in [*edge_case_texts(), *FALLBACK_TEXTS]:
+        names = dh.data_column_names(dh.detect_num_columns(text))
+        fast = dh.read_numeric_table_fast(text, names) is not None
+        assert fast == (text not in FALLBACK_TEXTS), f"{text!r}: fast path {fast}"
+        legacy_orig, legacy_numeric, _ = legacy_parse_text_data(text)
+        current_orig, current_numeric, _ = dh.parse_text_data(text)
+        pd.testing.assert_frame_equal(current_numeric, legacy_numeric, check_dtype=False, obj=repr(text))
+        # 元データは入力した表記のまま（pandas は true を True にするため、大文字小文字は区別しない）
+        pd.testing.assert_frame_equal(dh.as_frame(current_orig).astype(str).apply(lambda c: c.str.lower()),
+                                      legacy_orig.astype(str).apply(lambda c: c.str.lower()), obj=repr(text))
+        pd.testing.assert_frame_equal(current_orig.head(2).astype(str).apply(lambda c: c.str.lower()),
+                                      legacy_orig.head(2).astype(str).apply(lambda c: c.str.lower()))
+
+
+def make_text(n_rows, with_error=False, seed=0):
+    """貼り付けデータを模したスペース区切りテキストを生成する"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.0, 100.0, n_rows)
+    y = 2.0 * x + 1.0 + rng.normal(0.0, 1.0, n_rows)
+    columns = [x, y]
+    if with_error:
+        columns.append(np.abs(rng.normal(0.0, 0.1, n_rows)))
+    df = pd.DataFrame({f"c{i}": c for i, c in enumerate(columns)})
+    body = df.to_csv(sep=' ', header=False, index=False, float_format='%.6g')
+    return "# x y\n" + body
+
+
+def best_of(func, arg, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000, 1_000_000, 3_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--with-error", action="store_true", help="3列目（Y軸誤差）を含める")
+    args = parser.parse_args()
+
+    check_edge_cases()
+    print("edge cases: OK")
+    print(f"{'rows':>10} {'MB':>8} {'legacy [s]':>12} {'current [s]':>12} {'speedup':>8}")
+    for n_rows in args.rows:
+        text = make_text(n_rows, with_error=args.with_error)
+
+        # 結果が一致することを確認してから計測する
+        _, legacy_numeric, _ = legacy_parse_text_data(text)
+        _, current_numeric, _ = dh.parse_text_data(text)
+        np.testing.assert_allclose(
+            current_numeric.to_numpy(dtype=float), legacy_numeric.to_numpy(dtype=float)
+        )
+
+        legacy_s = best_of(legacy_parse_text_data, text, args.repeat)
+        current_s = best_of(dh.parse_text_data, text, args.repeat)
+        print(f"{n_rows:>10} {len(text) / 1e6:>8.1f} {legacy_s:>12.4f} {current_s:>12.4f} {legacy_s / current_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# benchmarks/bench_robust_fit.py
+"""
+外れ値に強いフィット（Theil–Sen 推定・Huber 推定）のベンチマークと動作確認。
+- 組の傾きの順位統計量の選択が、すべての組を列挙して整列した結果と一致すること（x の重複を含む）
+- 傾きと Sen の信頼区間が scipy.stats.theilslopes と一致すること（scipy がある場合）
+- 約1割の点に外れ値を加えたとき、最小二乗法より真の値に近いこと
+- 範囲フィットと複数系列のフィットが、点を切り出して calculate_fitting_parameters_v3 に渡した結果と一致すること
+を確認し、点数ごとの計算時間を最小二乗法と比べる。
+
+実行例:
+    python benchmarks/bench_robust_fit.py --rows 10000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STREAM_LOG_LEVEL", "WARNING")
+
+import modules.fitting_calculator as fc  # noqa: E402
+import modules.robust_fit as rf  # noqa: E402
+
+ROBUST_METHODS = [m for m in fc.FIT_METHODS if m != fc.DEFAULT_FIT_METHOD]
+
+
+def make_data(n_rows, outlier_fraction=0.1, seed=0):
+    """y = 1.5 x + 3 に、x の大きい側の一部の点だけ大きく上にずれた外れ値を加えたデータ"""
+    rng = np.random.default_rng(seed)
+    x = np.sort(rng.uniform(0.0, 10.0, n_rows))
+    y = 1.5 * x + 3.0 + rng.normal(0.0, 0.5, n_rows)
+    bad = (rng.random(n_rows) < 2 * outlier_fraction) & (x > 5.0)
+    y[bad] += rng.uniform(20.0, 200.0, np.count_nonzero(bad))
+    return x, y
+
+
+def check_selection():
+    rng = np.random.default_rng(1)
+    for trial in range(30):
+        n = int(rng.integers(3, 500))
+        x = np.round(rng.normal(size=n), 1) if trial % 3 == 0 else rng.normal(size=n)  # x の重複
+        y = np.round(rng.normal(size=n), 1) if trial % 2 else 2 * x + rng.standard_cauchy(n)
+        i, j = np.triu_indices(n, 1)
+        dx = x[j] - x[i]
+        expected = np.sort((y[j] - y[i])[dx != 0] / dx[dx != 0])
+        pairs = rf.PairSlopes(x, y)
+        pairs._all_slopes = None  # 点数が少なくても、組を列挙しない選択を使う
+        assert pairs.n_pairs == len(expected), trial
+        for k in {1, len(expected), (len(expected) + 1) // 2, len(expected) // 3 + 1}:
+            assert np.isclose(pairs.select(k), expected[k - 1], rtol=1e-9, atol=1e-12), (trial, k)
+
+
+def check_against_scipy():
+    try:
+        from scipy import stats
+    except ImportError:
+        return False
+    x, y = make_data(3000, seed=2)
+    slope, slope_err, *_ = rf.theil_sen_fit(x, y)
+    reference = stats.theilslopes(y, x, alpha=0.3173)  # 包含係数1（約68%）の区間
+    assert np.isclose(slope, reference.slope, rtol=1e-12)
+    assert np.isclose(slope_err, (reference.high_slope - reference.low_slope) / 2, rtol=0.02)
+    return True
+
+
+def check_outliers_and_ranges():
+    x, y = make_data(5000, seed=3)
+    ols = fc.calculate_fitting_parameters_v3(x, y, "通常")
+    for method in ROBUST_METHODS:
+        robust = fc.calculate_fitting_parameters_v3(x, y, "通常", method)
+        assert robust["fit_method"] == method and robust["equation_latex"]
+        assert abs(robust["slope_val"] - 1.5) < 0.1 * abs(ols["slope_val"] - 1.5), method
+
+        # 範囲フィットは、範囲の点を切り出して全体のフィットと同じ関数に渡した結果と一致する
+        index = fc.RangeFitIndex(x, y, "両対数")
+        in_range = (x >= 2.0) & (x <= 7.0)
+        direct = fc.calculate_fitting_parameters_v3(x[in_range], y[in_range], "両対数", method)
+        ranged = index.fit(2.0, 7.0, method)
+        for key in ("slope_val", "slope_err", "intercept_val", "intercept_err", "r_squared"):
+            assert np.isclose(ranged[key], direct[key], rtol=1e-9), (method, key)
+
+        table = fc.fit_multiple_series(x, np.column_stack([y, -y]), "通常", method=method)
+        assert np.isclose(table["slope"][0], robust["slope_val"], rtol=1e-12)
+        assert np.isclose(table["slope"][1], -robust["slope_val"], rtol=1e-9)
+
+    # 手法が違う結果は共有キャッシュで別のエントリになる
+    results = {m: fc.cached_fit("robust-check", "通常", None,
+                                lambda m=m: fc.calculate_fitting_parameters_v3(x, y, "通常", m), method=m)
+               for m in fc.FIT_METHODS}
+    assert len({r["slope_val"] for r in results.values()}) == len(fc.FIT_METHODS)
+
+
+def time_fit(x, y, method):
+    start = time.perf_counter()
+    result = fc.calculate_fitting_parameters_v3(x, y, "通常", method)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    check_selection()
+    with_scipy = check_against_scipy()
+    check_outliers_and_ranges()
+    print("checks: OK" + ("" if with_scipy else " (scipy not installed; theilslopes comparison skipped)"))
+
+    methods = list(fc.FIT_METHODS)
+    print(f"{'rows':>10} " + " ".join(f"{m + ' [ms]':>18} {'slope':>8}" for m in methods))
+    for n_rows in args.rows:
+        x, y = make_data(n_rows)
+        cells = []
+        for method in methods:
+            elapsed, result = time_fit(x, y, method)
+            cells.append(f"{elapsed * 1e3:>18.1f} {result['slope_val']:>8.4f}")
+        print(f"{n_rows:>10} " + " ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# benchmarks/bench_shared_cache.py
+"""
+複数のプロセスで共有するキャッシュ（modules.shared_cache）の動作確認とベンチマーク。
+sqlite / files のそれぞれについて
+- 上限を超えたら最も長く使われていないものから追い出し、期限切れのものは返さないこと
+- 読み込みのたびに最後に使った時刻を書き直さず、files では上限に近づくまでディレクトリを走査しないこと
+- 共有キャッシュから読んだ値は、プロセス内でも共有キャッシュの残りの期限までしか使わないこと
+- 複数のプロセスが同時に読み書きしても、エラーにならず、読めた値は書いた値と同じで、
+  （files では次の走査の後に）合計サイズが上限以下であること
+- 別のプロセス（別のレプリカ）でパース・フィット・書き出しをした結果を、計算せずに使えること
+を確認し、新しいプロセスで同じデータをパース・フィットし、画像を書き出す時間を、共有キャッシュの有無で比べる。
+
+実行例:
+    python benchmarks/bench_shared_cache.py --rows 200000 --processes 4
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STREAM_LOG_LEVEL", "WARNING")
+
+import modules.shared_cache as shc  # noqa: E402
+
+BACKEND_PATHS = {"sqlite": "cache.sqlite", "files": "cache"}
+
+
+def make_text(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(1.0, 100.0, n_rows)
+    y = 2.0 * x ** 1.5 * np.exp(rng.normal(0.0, 0.05, n_rows))
+    return "\n".join(f"{a:.6g} {b:.6g}" for a, b in zip(x, y))
+
+
+def payload(key, size):
+    """key から決まる内容のバイト列（読めた値が書いた値と同じかを確かめる）"""
+    return (key.encode() * (size // len(key) + 1))[:size]
+
+
+def check_eviction_and_expiry(backend, directory):
+    # 読み込みの順序で追い出しを確かめるため、最後に使った時刻は読み込みのたびに書き直す
+    store = shc.open_store(os.path.join(directory, "lru-" + BACKEND_PATHS[backend]), backend, max_bytes=3000,
+                           access_interval_s=0.0)
+    for key in "abc":
+        store.put(key, payload(key, 1000))
+        time.sleep(0.01)  # files は更新時刻で順序を決める
+    assert store.get("a") == (payload("a", 1000), None)
+    time.sleep(0.01)
+    store.put("d", payload("d", 1000))
+    assert store.get("b") is None, "the least recently used entry must be evicted"
+    assert all(store.get(key) == (payload(key, 1000), None) for key in "acd")
+    assert store.usage() == (3, 3000)
+    assert store.put("big", payload("big", 4000)) == 0 and store.get("big") is None
+
+    put_at = time.time()
+    store.put("short", b"x", ttl_s=0.05)
+    data, expires = store.get("short")
+    assert data == b"x" and abs(expires - (put_at + 0.05)) < 0.01, expires
+    time.sleep(0.1)
+    assert store.get("short") is None
+
+
+def check_throttled_writes(backend, directory):
+    """既定の間隔では、読み込みで最後に使った時刻を書き直さず、files では上限を超えるまで走査しないこと"""
+    path = os.path.join(directory, "throttle-" + BACKEND_PATHS[backend])
+    store = shc.open_store(path, backend, max_bytes=3000)
+    store.put("a", payload("a", 1000))
+    if backend == "sqlite":
+        changes = store._connection().total_changes
+        assert store.get("a") is not None and store._connection().total_changes == changes, "get must not write"
+        return
+    mtime = os.stat(store._file("a")).st_mtime
+    time.sleep(0.01)
+    assert store.get("a") is not None and os.stat(store._file("a")).st_mtime == mtime, "get must not touch the file"
+
+    scans = []
+    entries = store._entries
+    store._entries = lambda: scans.append(1) or entries()
+    store.put("b", payload("b", 1000))
+    store.put("c", payload("c", 1000))
+    assert not scans, "puts under the limit must not scan the directory"
+    store.put("d", payload("d", 1000))
+    assert len(scans) == 1 and store.usage()[1] == 3000, (scans, store.usage())
+
+
+def check_remaining_ttl(backend, directory, ttl_s=0.4):
+    """別のプロセスが保存した値をプロセス内に置いても、保存した時点からの期限を過ぎたら使わないこと"""
+    from modules.cache import LRUCache
+
+    store = shc.open_store(os.path.join(directory, "ttl-" + BACKEND_PATHS[backend]), backend, max_bytes=10_000)
+    writer = shc.SharedCache(LRUCache(10_000, ttl_s=ttl_s), "ttl", store=store)
+    reader = shc.SharedCache(LRUCache(10_000, ttl_s=ttl_s), "ttl", store=store)
+    writer.put("key", "value")
+    time.sleep(ttl_s / 2)
+    assert reader.get("key") == "value" and reader.shared_hits == 1
+    time.sleep(ttl_s * 0.6)  # 保存してから ttl_s を過ぎた（プロセス内に置いてからは ttl_s 未満）
+    assert reader.local.get("key") is None, "the local copy must not outlive the shared entry"
+    assert reader.get("key") is None
+
+
+def _hammer(backend, path, max_bytes, worker, n_ops, queue):
+    """別のプロセスで、共有の鍵の集合に対して読み書きを繰り返す"""
+    store = shc.open_store(path, backend, max_bytes)
+    rng = np.random.default_rng(worker)
+    wrong = hits = 0
+    for _ in range(n_ops):
+        key = f"k{rng.integers(64)}"
+        size = 1000 + 97 * int(key[1:])  # 鍵ごとに決まった大きさ
+        if rng.random() < 0.5:
+            store.put(key, payload(key, size))
+        else:
+            entry = store.get(key)
+            if entry is not None:
+                hits += 1
+                wrong += entry[0] != payload(key, size)
+    queue.put((wrong, hits))
+
+
+def check_concurrent_processes(backend, directory, n_processes, n_ops=400, max_bytes=100_000):
+    path = os.path.join(directory, "concurrent-" + BACKEND_PATHS[backend])
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_hammer, args=(backend, path, max_bytes, i, n_ops, queue))
+             for i in range(n_processes)]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    results = [queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+        assert p.exitcode == 0, f"worker failed ({backend})"
+    elapsed = time.perf_counter() - start
+    assert sum(wrong for wrong, _ in results) == 0, "reads must return what was written"
+    # files ではプロセスごとに走査するまで他のプロセスの書き込みを数えないため、新しいプロセスの最初の書き込み
+    # （最初に走査する）の後で確かめる
+    store = shc.open_store(path, backend, max_bytes)
+    store.put("k0", payload("k0", 1000))
+    entries, total = store.usage()
+    assert total <= max_bytes, (backend, total)
+    return n_processes * n_ops / elapsed, sum(hits for _, hits in results), entries
+
+
+def _replica(backend, path, raw_data_str, queue):
+    """新しいプロセス（別のレプリカ）でパース・フィット・書き出しをする"""
+    os.environ.update(STREAM_SHARED_CACHE_BACKEND=backend, STREAM_SHARED_CACHE_PATH=path)
+    if not path:
+        del os.environ["STREAM_SHARED_CACHE_PATH"]
+    import modules.data_handler as dh
+    import modules.fitting_calculator as fc
+    import modules.plot_generator as pg
+    from modules.dataset import Dataset
+    import pandas  # noqa: F401  読み込み時間を含めない
+
+    start = time.perf_counter()
+    data_key = dh.compute_data_key(raw_data_str)
+    _, df_numeric, _ = dh.parse_text_data_cached(raw_data_str, data_key)
+    plot_data = Dataset.from_frame(df_numeric).valid()
+    result = fc.cached_fit(data_key, "両対数", None,
+                           lambda: fc.calculate_fitting_parameters_v3(plot_data.x, plot_data.y, "両対数"))
+    fitted = time.perf_counter()
+    settings = {"plot_type": "両対数", "x_label": "$x$", "y_label": "$y$", "show_legend": False}
+    png = pg.export_figure_bytes(lambda: pg.draw_graph(plot_data, settings)[0], "png", cache_key=data_key)
+    elapsed = (fitted - start, time.perf_counter() - fitted)
+    stats = {name: get() for name, get in [("parse", dh.get_parse_cache_stats), ("fit", fc.get_fit_cache_stats),
+                                           ("export", pg.get_export_cache_stats)]}
+    queue.put((elapsed, result["slope_val"], len(png), stats))
+
+
+def run_replica(backend, path, raw_data_str):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    p = ctx.Process(target=_replica, args=(backend, path, raw_data_str, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+
+def check_across_replicas(backend, directory, raw_data_str):
+    """1つ目のプロセスの結果を、2つ目のプロセスが共有キャッシュから読むこと。(計算した時間, 読んだ時間) を返す"""
+    path = os.path.join(directory, "replicas-" + BACKEND_PATHS[backend])
+    first = run_replica(backend, path, raw_data_str)
+    second = run_replica(backend, path, raw_data_str)
+    for name in ("parse", "fit", "export"):
+        assert first[3][name]["shared_hits"] == 0, (backend, name, first[3])
+        assert second[3][name]["shared_hits"] == 1 and second[3][name]["shared_errors"] == 0, (backend, name)
+    assert first[1] == second[1] and first[2] == second[2], "shared results must match the computed ones"
+    return first[0], second[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--processes", type=int, default=4, help="同時に読み書きするプロセス数")
+    args = parser.parse_args()
+
+    raw_data_str = make_text(args.rows)
+    directory = tempfile.mkdtemp(prefix="shared_cache_")
+    try:
+        (fit_s, export_s) = run_replica("sqlite", "", raw_data_str)[0]
+        print(f"rows={args.rows}: in a new process without the shared cache: "
+              f"parse + fit {fit_s * 1e3:.0f} ms, PNG export {export_s * 1e3:.0f} ms")
+        for backend in shc.BACKENDS:
+            check_eviction_and_expiry(backend, directory)
+            check_throttled_writes(backend, directory)
+            check_remaining_ttl(backend, directory)
+            ops_per_s, hits, entries = check_concurrent_processes(backend, directory, args.processes)
+            computed, shared = check_across_replicas(backend, directory, raw_data_str)
+            print(f"{backend}: checks OK")
+            print(f"  {args.processes} processes: {ops_per_s:.0f} ops/s ({hits} hits, {entries} entries left)")
+            for label, c, s in zip(["parse + fit", "PNG export"], computed, shared):
+                print(f"  {label} in a new process: computed {c * 1e3:.0f} ms, from the shared cache {s * 1e3:.0f} ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# benchmarks/bench_stage_pipeline.py
+"""
+再実行の処理段階（modules.stages）のメモ化のベンチマークと動作確認。
+- 設定を1つ変えた再実行で、その設定を宣言した段階と後段だけが計算し直されること
+  （凡例の文字サイズ・目盛りの長さは描画と書き出しだけ、2本目の範囲は2本目のフィットと描画・書き出しだけ）
+- 軸範囲を先に求めて描画した画像と Vega-Lite の仕様が、draw_graph / build_vega_lite_spec が
+  軸範囲を計算した場合と同じであること
+- 宣言した前段が後に宣言されていない、名前が重複しているパイプラインは作れないこと
+を確認し、設定の変更ごとの再実行時間を、毎回すべての段階を実行した場合（パースとフィットのキャッシュは有効）と比べる。
+
+実行例:
+    python benchmarks/bench_stage_pipeline.py --rows 2000 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STREAM_LOG_LEVEL", "WARNING")
+
+import modules.data_handler as dh  # noqa: E402
+import modules.plot_generator as pg  # noqa: E402
+import modules.stages as sg  # noqa: E402
+import modules.vega_chart as vc  # noqa: E402
+from modules.instrumentation import RerunTimings  # noqa: E402
+from modules.pipeline import Stage, StagePipeline  # noqa: E402
+
+# app.py が再実行ごとに必要とする段階（表示に使う結果）
+OUTPUTS = ["fit_all_series", "fit_1", "bootstrap", "fit_2", "display_png"]
+FIT_AND_DRAW = {"transform", "fit_1", "fit_2", "axis_ranges", "draw", "display_png"}
+
+# (説明, 変更する設定, 計算し直すはずの段階)
+CHANGES = [
+    ("no change", {}, set()),
+    ("legend font size", {"legend_fontsize": 18}, {"draw", "display_png"}),
+    ("tick length", {"tick_length": 8}, {"draw", "display_png"}),
+    ("axis label", {"x_label": "時間 $t$ [s]"}, {"draw", "display_png"}),
+    ("second fit range", {"fit_range_x_min": 3.0}, {"fit_2", "draw", "display_png"}),
+    ("manual axis range", {"manual_x_axis": True, "x_axis_min": 0.0, "x_axis_max": 50.0},
+     {"axis_ranges", "draw", "display_png"}),
+    ("bootstrap", {"bootstrap_enabled": True, "bootstrap_n_resamples": 500, "bootstrap_confidence": 0.95,
+                   "bootstrap_seed": 0, "bootstrap_time_budget_s": 2.0}, {"bootstrap"}),
+    ("plot type", {"plot_type": "両対数"}, FIT_AND_DRAW | {"bootstrap", "fit_all_series"}),
+]
+
+
+def make_text(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(1.0, 100.0, n_rows)
+    y = 2.0 * x ** 1.5 * np.exp(rng.normal(0.0, 0.05, n_rows))
+    return "\n".join(f"{a:.6g} {b:.6g} {0.05 * b:.3g}" for a, b in zip(x, y))
+
+
+def base_inputs(raw_data_str):
+    """app.py の stage_inputs と同じ項目（サイドバーの既定値）"""
+    return {
+        "x_label": "$x$", "y_label": "$y$", "tick_length": 5, "plot_type": "通常", "show_legend": True,
+        "show_fitting": True, "fit_method": "最小二乗法", "fit_model": None, "show_error_bars": True,
+        "decimation_threshold": None, "data_key": dh.compute_data_key(raw_data_str), "multi_y": False,
+        "series_name": None, "bootstrap_enabled": False, "show_fitting_2": True,
+        "fit_range_x_min": 10.0, "fit_range_x_max": 40.0, "axis_range_mode": "自動",
+        "force_origin_visible": False, "manual_x_axis": False, "manual_y_axis": False,
+        "data_legend_label": "測定値", "fit_legend_label": "近似曲線", "fit_legend_label_2": "範囲フィット",
+        "legend_fontsize": 15,
+    }
+
+
+def rerun(inputs, memo, sources):
+    """app.py の1回の再実行で必要な段階を実行し、(計算した段階, 経過時間) を返す"""
+    timings = RerunTimings()
+    start = time.perf_counter()
+    for name in OUTPUTS:
+        sg.PIPELINE.run(name, inputs, memo, sources, timings)
+    return {record["stage"] for record in timings.stages}, time.perf_counter() - start
+
+
+def check_recomputed_stages(raw_data_str):
+    inputs, memo, sources = base_inputs(raw_data_str), {}, {"raw_data_str": raw_data_str, "warm_starts": {}}
+    ran, _ = rerun(inputs, memo, sources)
+    assert ran == set(sg.PIPELINE.stages) - {"chart_spec"}, ran
+    for label, change, expected in CHANGES:
+        inputs.update(change)
+        ran, _ = rerun(inputs, memo, sources)
+        assert ran == expected, (label, ran)
+    # データを変えるとすべての段階を計算し直す
+    other = make_text(500, seed=1)
+    inputs["data_key"], sources["raw_data_str"] = dh.compute_data_key(other), other
+    ran, _ = rerun(inputs, memo, sources)
+    assert ran == set(sg.PIPELINE.stages) - {"chart_spec"}, ran
+
+
+def check_same_output(raw_data_str):
+    inputs, memo, sources = base_inputs(raw_data_str), {}, {"raw_data_str": raw_data_str}
+    for plot_type in ["通常", "両対数"]:
+        for manual in (False, True):
+            inputs.update(plot_type=plot_type, manual_y_axis=manual, y_axis_min=-5.0, y_axis_max=500.0)
+            png = sg.PIPELINE.run("display_png", inputs, memo, sources)
+            spec = sg.PIPELINE.run("chart_spec", inputs, memo, sources)
+            plot_data = memo["clean"][1][1]
+            lines = sg.fit_lines(inputs, memo["fit_1"][1], memo["fit_2"][1])
+            fig, _ = pg.draw_graph(plot_data, inputs, lines)
+            assert pg.display_png_bytes(fig) == png, (plot_type, manual)
+            pg.release_figure(fig)
+            expected = vc.build_vega_lite_spec(plot_data, inputs, lines)
+            assert expected.keys() == spec.keys() and expected["layer"] == spec["layer"], (plot_type, manual)
+            assert all(expected["datasets"][k].equals(v) for k, v in spec["datasets"].items()), (plot_type, manual)
+
+
+def check_declaration():
+    for stages in ([Stage("b", None, depends=("a",)), Stage("a", None)], [Stage("a", None), Stage("a", None)]):
+        try:
+            StagePipeline(stages)
+            raise AssertionError("invalid pipelines must be rejected")
+        except ValueError:
+            pass
+
+
+def time_changes(raw_data_str, memoized):
+    """CHANGES を順に適用した再実行ごとの経過時間。memoized=False では再実行ごとにメモを空にする"""
+    inputs, memo, sources = base_inputs(raw_data_str), {}, {"raw_data_str": raw_data_str, "warm_starts": {}}
+    rerun(inputs, memo, sources)
+    elapsed = []
+    for _, change, _ in CHANGES:
+        inputs.update(change)
+        if not memoized:
+            for name in list(memo):
+                sg.PIPELINE.discard(name, memo)
+        elapsed.append(rerun(inputs, memo, sources)[1])
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[2_000, 20_000])
+    args = parser.parse_args()
+
+    check_declaration()
+    check_recomputed_stages(make_text(2000))
+    check_same_output(make_text(2000))
+    print("checks: OK")
+
+    for n_rows in args.rows:
+        raw_data_str = make_text(n_rows)
+        every_stage = time_changes(raw_data_str, memoized=False)
+        memoized = time_changes(raw_data_str, memoized=True)
+        print(f"rows={n_rows}")
+        print(f"  {'change':<20} {'all stages [ms]':>16} {'memoized [ms]':>14}")
+        for (label, _, _), full, memo in zip(CHANGES, every_stage, memoized):
+            print(f"  {label:<20} {full * 1e3:>16.1f} {memo * 1e3:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# benchmarks/bench_startup.py
+"""
+起動時（コールドスタート）のインポート時間と常駐メモリのベンチマーク。
+対象ごとに新しいPythonプロセスを起動してインポートし、所要時間・最大RSS・
+読み込まれた重い依存ライブラリを表示する。
+
+--budget-ms / --budget-mb を指定すると、app.py と同じモジュール群の読み込みが
+予算を超えた場合に終了コード1で終了する（Streamlitワーカーを増やす際の起動予算の監視用）。
+
+実行例:
+    python benchmarks/bench_startup.py --repeat 5 --budget-ms 1500 --budget-mb 150
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app.py の先頭で読み込むモジュール
+APP_IMPORTS = [
+    "streamlit",
+    "modules.ui_components",
+    "modules.constants",
+    "modules.data_handler",
+    "modules.fitting_calculator",
+    "modules.plot_generator",
+    "modules.stages",
+    "modules.background",
+    "modules.vega_chart",
+]
+
+TARGETS = {
+    "app": APP_IMPORTS,
+    "streamlit": ["streamlit"],
+    "modules.data_handler": ["modules.data_handler"],
+    "modules.fitting_calculator": ["modules.fitting_calculator"],
+    "modules.plot_generator": ["modules.plot_generator"],
+    "modules.ui_components": ["modules.ui_components"],
+    "modules.stages": ["modules.stages"],
+}
+
+# 起動時には読み込まれていないことが望ましい依存ライブラリ
+HEAVY_MODULES = ["sklearn", "scipy", "matplotlib", "matplotlib.pyplot", "matplotlib_fontja", "pandas", "pyarrow"]
+
+CHILD_CODE = """
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+for name in {modules!r}:
+    importlib.import_module(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure(modules):
+    """新しいプロセスでモジュールを読み込み、計測結果を返す"""
+    code = CHILD_CODE.format(modules=modules, heavy=HEAVY_MODULES)
+    completed = subprocess.run(
+        [sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument("--budget-ms", type=float, default=None, help="app の読み込み時間の上限 [ms]")
+    parser.add_argument("--budget-mb", type=float, default=None, help="app の読み込み後の最大RSSの上限 [MB]")
+    args = parser.parse_args()
+
+    print(f"{'target':<28} {'import [ms]':>12} {'max RSS [MB]':>13}  heavy modules loaded")
+    app_result = None
+    for target in args.targets:
+        runs = [measure(TARGETS[target]) for _ in range(args.repeat)]
+        import_ms = statistics.median(r["seconds"] for r in runs) * 1e3
+        rss_mb = statistics.median(r["max_rss_mb"] for r in runs)
+        print(f"{target:<28} {import_ms:>12.0f} {rss_mb:>13.1f}  {', '.join(runs[0]['heavy']) or '-'}")
+        if target == "app":
+            app_result = (import_ms, rss_mb)
+
+    if app_result is None:
+        return
+    failures = []
+    if args.budget_ms is not None and app_result[0] > args.budget_ms:
+        failures.append(f"import time {app_result[0]:.0f} ms > budget {args.budget_ms:.0f} ms")
+    if args.budget_mb is not None and app_result[1] > args.budget_mb:
+        failures.append(f"max RSS {app_result[1]:.1f} MB > budget {args.budget_mb:.1f} MB")
+    if failures:
+        print("COLD-START BUDGET EXCEEDED: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
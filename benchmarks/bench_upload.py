@@ -0,0 +1,96 @@
+# benchmarks/bench_upload.py
+"""
+ファイルアップロードからの読み込みのベンチマーク。
+同じデータを CSV / TSV / Excel / Parquet / 空白区切りテキストにして read_uploaded_file で読み込み、
+テキストエリアに貼り付けた場合（parse_text_data）と同じ数値になることを確認して、読み込み時間を比較する。
+
+実行例:
+    python benchmarks/bench_upload.py --rows 10000 1000000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.data_handler as dh  # noqa: E402
+
+# Excel は行ごとに読み込むため、この点数までに限る
+EXCEL_MAX_ROWS = 100_000
+
+
+def make_frame(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.0, 100.0, n_rows)
+    y = 2.0 * x + 1.0 + rng.normal(0.0, 1.0, n_rows)
+    return pd.DataFrame({"x": x, "y": y, "y_error": np.abs(rng.normal(0.0, 0.1, n_rows))})
+
+
+def encode_files(df, with_excel=True):
+    """ファイル名とバイト列の組を返す（見出し行あり・なしを混ぜる）"""
+    files = {
+        "data.csv": ("# comment\n" + df.to_csv(index=False)).encode(),
+        "data.tsv": df.to_csv(sep="\t", index=False, header=False).encode(),
+        "data.txt": ("# x y err\n" + df.to_csv(sep=" ", index=False, header=False)).encode(),
+    }
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    files["data.parquet"] = buffer.getvalue()
+    if with_excel:
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False)
+        files["data.xlsx"] = buffer.getvalue()
+    return files
+
+
+def check_edge_cases():
+    """列の多いファイル、欠損値、複数のY列、未対応の形式"""
+    wide = "x,y,e,extra\n1,2,0.1,9\n2,,0.2,9\n3,6,0.3,9\n".encode()
+    _, df_numeric, err = dh.read_uploaded_file(wide, "wide.csv")
+    assert err is None and list(df_numeric.columns) == ["x", "y"], (err, df_numeric)
+    assert np.isnan(df_numeric["y"].iloc[1])
+    _, df_numeric, err = dh.read_uploaded_file(wide, "wide.csv", multi_y=True)
+    assert list(df_numeric.columns) == ["x", "y1", "y2", "y3"], df_numeric.columns
+    _, _, err = dh.read_uploaded_file(b"1 2\n", "data.json")
+    assert err is not None
+    _, _, err = dh.read_uploaded_file(b"", "empty.csv")
+    assert err is not None
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    check_edge_cases()
+    print("edge cases: OK")
+
+    print(f"{'file':<14} {'rows':>10} {'size [MB]':>10} {'read [ms]':>10}")
+    for n_rows in args.rows:
+        df = make_frame(n_rows)
+        for filename, data in encode_files(df, with_excel=n_rows <= EXCEL_MAX_ROWS).items():
+            _, df_numeric, err = dh.read_uploaded_file(data, filename)
+            assert err is None, (filename, err)
+            np.testing.assert_allclose(df_numeric[["x", "y", "y_error"]].to_numpy(), df.to_numpy(), rtol=1e-12,
+                                       err_msg=filename)
+            seconds = best_of(lambda: dh.read_uploaded_file(data, filename), args.repeat)
+            print(f"{filename:<14} {n_rows:>10} {len(data) / 1e6:>10.1f} {seconds * 1e3:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+# benchmarks/load_test.py
+"""
+app.py の同時接続の負荷試験。Streamlit のサーバーを起動し、ブラウザの代わりに WebSocket のクライアント
+（Streamlit が使う websockets と protobuf のメッセージ）で多数のセッションを同時に操作する。
+AppTest は再実行のたびにプロセス全体の Runtime を差し替えるため、同時に動かすセッションには使えない。
+
+各セッション（ユーザー）は次の操作を順に行う。
+- 更新のお知らせを閉じる（表示された場合）
+- データを貼り付ける（--shared-data を指定しない限り、ユーザーごとに違うデータ）
+- フィッティングを有効にする
+- グラフ種類を切り替える（両対数 → 通常）
+- 2本目の近似線を有効にし、範囲の最大値を少しずつ動かす（ドラッグに相当する連続した変更）
+- PNG をダウンロードする
+操作ごとに、再実行を要求してから終わるまで（ダウンロードは画像を受け取るまで）の時間を測る。
+ユーザー数ごとにサーバーを起動し直し、操作ごとの遅延のパーセンタイル、1秒あたりの操作数、
+サーバーの常駐メモリ（RSS、ウォームアップ後・ピーク・全員の操作後）を表示する。
+アプリの例外やタイムアウトがあった場合は終了コード1で終了する。
+
+実行例:
+    python benchmarks/load_test.py --users 1 5 10 20 --rows 2000 --think-time 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+
+import numpy as np
+from websockets.asyncio.client import connect
+
+from streamlit.proto.BackMsg_pb2 import BackMsg, BackendOperationRequest, DeferredFileRequestPayload
+from streamlit.proto.ClientState_pb2 import ClientState
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+RESULTS_PATH = os.path.join(REPO_ROOT, "benchmarks", "results", "load_test.json")
+
+# 操作の名前（表示順）
+INTERACTIONS = ["connect", "dismiss_notice", "paste_data", "toggle_fitting", "switch_plot_type",
+                "enable_second_fit", "drag_fit_range", "download_png"]
+PERCENTILES = [50, 90, 99]
+FINISHED = {ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+            ForwardMsg.FINISHED_WITH_COMPILE_ERROR}
+
+# 操作する部品（キーを指定した部品はキー、それ以外はラベルで探す）
+NOTICE_BUTTON = "OK、内容を確認しました！"
+DATA_INPUT = "ここにデータを貼り付けてください (スペース区切り、左列: X軸, 右列: Y軸)"
+FITTING_CHECKBOX = "フィッティングを行う"
+PLOT_TYPE_SELECTBOX = "グラフ種類"
+SECOND_FIT_CHECKBOX = "範囲を指定して2本目の近似線を追加"
+FIT_RANGE_MIN_KEY = "fit_range_min"
+FIT_RANGE_MAX_KEY = "fit_range_max"
+PNG_DOWNLOAD_BUTTON = "PNGでダウンロード"
+# localStorage を読む部品。ブラウザは表示されるとすぐに保存済みの値を返すため、その代わりに空の値を返す
+LOCAL_STORAGE_COMPONENT = "st_local_storage"
+
+
+def make_text(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(1.0, 100.0, n_rows)
+    y = 2.0 * x ** 1.5 * np.exp(rng.normal(0.0, 0.05, n_rows))
+    return "\n".join(f"{a:.6g} {b:.6g}" for a, b in zip(x, y))
+
+
+def process_rss_mb(pid):
+    """プロセスの常駐メモリ [MB]（/proc が無い環境では None）"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class AppServer:
+    """app.py を動かす Streamlit のサーバー（別プロセス）"""
+
+    def __init__(self, port, env=None):
+        self.port = port
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.ws_url = f"ws://127.0.0.1:{port}/_stcore/stream"
+        self._env = {**os.environ, "STREAM_LOG_LEVEL": "WARNING", **(env or {})}
+        self.process = None
+
+    def start(self, timeout_s=60.0):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.headless=true",
+             f"--server.port={self.port}", "--server.address=127.0.0.1", "--browser.gatherUsageStats=false",
+             "--server.fileWatcherType=none", "--server.runOnSave=false"],
+            cwd=REPO_ROOT, env=self._env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + timeout_s
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"サーバーが終了しました（終了コード {self.process.returncode}）。")
+            try:
+                with urllib.request.urlopen(f"{self.base_url}/_stcore/health", timeout=1.0) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError("サーバーが起動しませんでした。")
+
+    def rss_mb(self):
+        return process_rss_mb(self.process.pid)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class SimulatedUser:
+    """
+    1つのブラウザのタブに相当するセッション。受け取った差分から部品の ID と値の種類を覚え、
+    部品の値を変えるたびに、ブラウザと同じく変更した部品すべての値を付けて再実行を要求する。
+    フラグメントの中の部品を変えた場合は、そのフラグメントだけの再実行を要求する。
+    """
+
+    def __init__(self, server, user_id, raw_data_str, think_time_s, drag_steps, timeout_s):
+        self.server = server
+        self.user_id = user_id
+        self.raw_data_str = raw_data_str
+        self.think_time_s = think_time_s
+        self.drag_steps = drag_steps
+        self.timeout_s = timeout_s
+        self.latencies = {name: [] for name in INTERACTIONS}
+        self.errors = []
+        self._widgets = {}  # 名前（キーまたはラベル）-> (ID, 部品の種類, フラグメントの ID, proto)
+        self._values = {}  # 名前 -> (値の種類, 値)
+        self._finished = None
+        self._operations = {}
+        self._pending = set()
+        self._session_id = ""
+        self._ws = None
+        self._reader = None
+
+    # --- 受信 ---
+
+    async def _read(self):
+        async for data in self._ws:
+            msg = ForwardMsg()
+            msg.ParseFromString(data)
+            kind = msg.WhichOneof("type")
+            if kind == "delta":
+                self._on_delta(msg.delta)
+            elif kind == "new_session" and msg.new_session.HasField("initialize"):
+                self._session_id = msg.new_session.initialize.session_id
+            elif kind == "script_finished":
+                if msg.script_finished in FINISHED and self._finished is not None and not self._finished.done():
+                    self._finished.set_result(msg.script_finished)
+            elif kind == "backend_operation_response":
+                future = self._operations.pop(msg.backend_operation_response.request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(msg.backend_operation_response)
+
+    def _on_delta(self, delta):
+        if delta.WhichOneof("type") != "new_element":
+            return
+        element = delta.new_element
+        kind = element.WhichOneof("type")
+        if kind == "exception":
+            self.errors.append(f"{element.exception.type}: {element.exception.message}")
+            return
+        proto = getattr(element, kind)
+        if kind == "component_instance" and proto.component_name.endswith(LOCAL_STORAGE_COMPONENT):
+            self._answer_local_storage(proto)
+        widget_id = getattr(proto, "id", "") if "id" in proto.DESCRIPTOR.fields_by_name else ""
+        if not widget_id.startswith("$$ID"):
+            return
+        label = getattr(proto, "label", "")
+        entry = (widget_id, kind, delta.fragment_id, proto)
+        self._widgets[label] = entry
+        # キーを指定した部品の ID は「-キー」で終わる
+        self._widgets[widget_id.rsplit("-", 1)[-1]] = entry
+
+    def _answer_local_storage(self, proto):
+        """初めての訪問者として、localStorage が空であることを返す（部品の値を付けて再実行を要求する）"""
+        name = proto.id.rsplit("-", 1)[-1]
+        if name in self._values:
+            return
+        self._widgets[name] = (proto.id, "component_instance", "", proto)
+        self._values[name] = ("json_value", "{}")
+        task = asyncio.ensure_future(self._send(BackMsg(rerun_script=self._client_state())))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    # --- 送信 ---
+
+    async def _send(self, back_msg):
+        await self._ws.send(back_msg.SerializeToString())
+
+    def _client_state(self, fragment_id="", trigger=None):
+        state = ClientState(query_string="", page_script_hash="", fragment_id=fragment_id)
+        for name, (value_type, value) in self._values.items():
+            widget = self._widgets.get(name)
+            if widget is None:
+                continue
+            widget_state = state.widget_states.widgets.add(id=widget[0])
+            setattr(widget_state, value_type, value)
+        if trigger is not None:
+            state.widget_states.widgets.add(id=self._widgets[trigger][0], trigger_value=True)
+        return state
+
+    async def _rerun(self, fragment_id="", trigger=None):
+        """再実行を要求し、スクリプト（またはフラグメント）の実行が終わるまで待つ"""
+        self._finished = asyncio.get_running_loop().create_future()
+        await self._send(BackMsg(rerun_script=self._client_state(fragment_id, trigger)))
+        await asyncio.wait_for(self._finished, self.timeout_s)
+
+    async def _set(self, name, value_type, value):
+        """部品の値を変えたときの再実行（フラグメントの中の部品ならフラグメントだけ）"""
+        self._values[name] = (value_type, value)
+        await self._rerun(fragment_id=self._widgets[name][2])
+
+    async def _click(self, name):
+        await self._rerun(fragment_id=self._widgets[name][2], trigger=name)
+
+    async def _download(self, name):
+        """遅延生成のダウンロードボタンを押す（画像を生成させて受け取り、ボタンの再実行を待つ）"""
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._operations[request_id] = future
+        file_id = self._widgets[name][3].deferred_file_id
+        await self._send(BackMsg(backend_operation_request=BackendOperationRequest(
+            request_id=request_id, session_id=self._session_id,
+            deferred_file=DeferredFileRequestPayload(file_id=file_id),
+        )))
+        response = await asyncio.wait_for(future, self.timeout_s)
+        if response.error_msg:
+            raise RuntimeError(response.error_msg)
+        url = response.deferred_file.url
+        data = await asyncio.to_thread(self._fetch, url)
+        if not data.startswith(b"\x89PNG"):
+            raise RuntimeError("ダウンロードした画像が PNG ではありません。")
+        await self._click(name)
+
+    def _fetch(self, url):
+        if url.startswith("/"):
+            url = self.server.base_url + url
+        with urllib.request.urlopen(url, timeout=self.timeout_s) as response:
+            return response.read()
+
+    async def _measure(self, name, action):
+        start = time.perf_counter()
+        try:
+            await action
+        except Exception as e:
+            self.errors.append(f"{name}: {e!r}")
+            raise
+        self.latencies[name].append(time.perf_counter() - start)
+
+    # --- 操作の手順 ---
+
+    async def _connect(self):
+        self._ws = await connect(self.server.ws_url, subprotocols=["streamlit"], max_size=None)
+        self._reader = asyncio.create_task(self._read())
+        await self._rerun()  # ブラウザは接続するとすぐに再実行を要求する
+
+    async def run(self):
+        try:
+            await self._measure("connect", self._connect())
+            if NOTICE_BUTTON in self._widgets:  # サーバーを起動してから最初のセッションにだけ表示される
+                await self._measure("dismiss_notice", self._click(NOTICE_BUTTON))
+            await asyncio.sleep(self.think_time_s)
+            await self._measure("paste_data", self._set(DATA_INPUT, "string_value", self.raw_data_str))
+            await asyncio.sleep(self.think_time_s)
+            await self._measure("toggle_fitting", self._set(FITTING_CHECKBOX, "bool_value", True))
+            for plot_type in ["両対数", "通常"]:
+                await asyncio.sleep(self.think_time_s)
+                await self._measure("switch_plot_type", self._set(PLOT_TYPE_SELECTBOX, "string_value", plot_type))
+            await asyncio.sleep(self.think_time_s)
+            await self._measure("enable_second_fit", self._set(SECOND_FIT_CHECKBOX, "bool_value", True))
+            await self._measure("drag_fit_range", self._set(FIT_RANGE_MIN_KEY, "double_value", 10.0))
+            for step in range(self.drag_steps):  # 間を空けずに続けて変える
+                await self._measure("drag_fit_range",
+                                    self._set(FIT_RANGE_MAX_KEY, "double_value", 40.0 + 5.0 * step))
+            await asyncio.sleep(self.think_time_s)
+            await self._measure("download_png", self._download(PNG_DOWNLOAD_BUTTON))
+        except Exception:
+            pass  # 記録済み。このユーザーの残りの操作はしない
+
+    async def close(self):
+        if self._ws is not None:
+            await self._ws.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+
+async def sample_rss(server, samples, stop):
+    while not stop.is_set():
+        rss = server.rss_mb()
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(0.2)
+
+
+async def run_users(server, texts, args):
+    """全ユーザーを ramp 秒かけて開始し、全員の操作が終わるまで待つ。(ユーザー, 経過時間, RSS の標本) を返す"""
+    users = [SimulatedUser(server, i, text, args.think_time, args.drag_steps, args.timeout)
+             for i, text in enumerate(texts)]
+    samples, stop = [], asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(server, samples, stop))
+
+    async def start(user, delay):
+        await asyncio.sleep(delay)
+        await user.run()
+
+    delay = args.ramp / len(users) if users else 0.0
+    started = time.perf_counter()
+    await asyncio.gather(*(start(user, i * delay) for i, user in enumerate(users)))
+    elapsed = time.perf_counter() - started
+    end_rss = server.rss_mb()  # 全員が接続したままの RSS
+    stop.set()
+    await sampler
+    await asyncio.gather(*(user.close() for user in users))
+    return users, elapsed, samples, end_rss
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+def run_level(n_users, args):
+    """n_users 人の負荷をかけた結果（操作ごとの遅延・スループット・RSS）を返す"""
+    server = AppServer(free_port())
+    server.start()
+    try:
+        # 最初の描画の読み込み（matplotlib など）を含めないよう、1人分の操作で温めておく
+        warmup, _, _, _ = asyncio.run(run_users(server, [make_text(args.rows, seed=10_000)], args))
+        base_rss = server.rss_mb()
+        texts = [make_text(args.rows, seed=0 if args.shared_data else i) for i in range(n_users)]
+        users, elapsed, samples, end_rss = asyncio.run(run_users(server, texts, args))
+    finally:
+        server.stop()
+
+    latencies = {name: [t for user in users for t in user.latencies[name]] for name in INTERACTIONS}
+    n_ops = sum(len(values) for values in latencies.values())
+    return {
+        "users": n_users,
+        "interactions": n_ops,
+        "errors": [f"user {user.user_id}: {error}" for user in users for error in user.errors]
+                  + [f"warmup: {error}" for user in warmup for error in user.errors],
+        "elapsed_s": elapsed,
+        "throughput_ops_s": n_ops / elapsed if elapsed > 0 else 0.0,
+        "rss_base_mb": base_rss,
+        "rss_peak_mb": max(samples) if samples else None,
+        "rss_end_mb": end_rss,
+        "latency_ms": {
+            name: {f"p{q}": percentile(values, q) * 1e3 for q in PERCENTILES} | {"n": len(values)}
+            for name, values in latencies.items()
+        },
+    }
+
+
+def print_report(results):
+    def mb(value):
+        return f"{value:.0f}" if value is not None else "-"
+
+    print(f"{'users':>5} {'ops':>6} {'errors':>6} {'ops/s':>7} {'RSS base':>9} {'peak':>6} {'end':>6}  [MB]")
+    for r in results:
+        print(f"{r['users']:>5} {r['interactions']:>6} {len(r['errors']):>6} {r['throughput_ops_s']:>7.2f} "
+              f"{mb(r['rss_base_mb']):>9} {mb(r['rss_peak_mb']):>6} {mb(r['rss_end_mb']):>6}")
+    print()
+    header = " ".join(f"{'p' + str(q):>7}" for q in PERCENTILES)
+    for r in results:
+        print(f"users={r['users']} latency [ms]")
+        print(f"  {'interaction':<18} {'n':>4} {header}")
+        for name in INTERACTIONS:
+            stats = r["latency_ms"][name]
+            if not stats["n"]:
+                continue
+            values = " ".join(f"{stats['p' + str(q)]:>7.0f}" for q in PERCENTILES)
+            print(f"  {name:<18} {stats['n']:>4} {values}")
+    for r in results:
+        for error in r["errors"][:5]:
+            print(f"error (users={r['users']}): {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 5, 10, 20], help="同時に操作するユーザー数")
+    parser.add_argument("--rows", type=int, default=2_000, help="貼り付けるデータの行数")
+    parser.add_argument("--think-time", type=float, default=0.5, help="操作の間隔 [秒]")
+    parser.add_argument("--drag-steps", type=int, default=5, help="範囲の最大値を続けて変える回数")
+    parser.add_argument("--ramp", type=float, default=0.0, help="全員が操作を始めるまでの時間 [秒]（0 で一斉に開始）")
+    parser.add_argument("--shared-data", action="store_true", help="全員が同じデータを貼り付ける")
+    parser.add_argument("--timeout", type=float, default=120.0, help="1回の操作のタイムアウト [秒]")
+    parser.add_argument("--save", action="store_true", help=f"結果を {os.path.relpath(RESULTS_PATH, REPO_ROOT)} に保存する")
+    args = parser.parse_args()
+
+    results = []
+    for n_users in args.users:
+        results.append(run_level(n_users, args))
+        r = results[-1]
+        print(f"users={n_users}: {r['interactions']} interactions in {r['elapsed_s']:.1f} s, "
+              f"{len(r['errors'])} errors", flush=True)
+    print()
+    print_report(results)
+    if args.save:
+        os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+        with open(RESULTS_PATH, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    if any(r["errors"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
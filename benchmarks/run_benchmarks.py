@@ -0,0 +1,243 @@
+# benchmarks/run_benchmarks.py
+"""
+読み込み・フィッティング・軸範囲計算・描画・書き出しのベンチマークスイート。
+Streamlitのサーバーを起動せずに、データ点数 1e2 〜 1e7 の各処理時間を計測する。
+
+結果は benchmarks/results/latest.json に保存し、benchmarks/baseline.json と比較する。
+基準値より threshold（既定 50%）以上遅くなった項目があれば終了コード1で終了する。
+
+実行例:
+    python benchmarks/run_benchmarks.py                     # 比較のみ
+    python benchmarks/run_benchmarks.py --max-rows 100000   # 小さいサイズだけ
+    python benchmarks/run_benchmarks.py --save-baseline     # 基準値を更新
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+# 書き出しごとの構造化ログで計測結果が読みにくくならないようにする
+os.environ.setdefault("STREAM_LOG_LEVEL", "WARNING")
+
+import matplotlib  # noqa: E402
+
+matplotlib.use("Agg")
+
+import modules.data_handler as dh  # noqa: E402
+import modules.fitting_calculator as fc  # noqa: E402
+import modules.latex_table as lt  # noqa: E402
+import modules.plot_generator as pg  # noqa: E402
+import modules.vega_chart as vc  # noqa: E402
+from modules.dataset import Dataset  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_PATH = os.path.join(BENCH_DIR, "results", "latest.json")
+
+DEFAULT_SIZES = [100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+PLOT_TYPES = ["通常", "片対数 (Y軸対数)", "片対数 (X軸対数)", "両対数"]
+
+# 基準値と比べるとき、この時間 [ms] 未満の差は計測誤差として扱う
+NOISE_FLOOR_MS = 2.0
+
+
+def make_dataset(n_rows, seed=0):
+    """すべてのグラフ種類でフィットできる正の値のデータと、その貼り付けテキストを生成する"""
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.1, 100.0, n_rows)
+    y = 2.0 * np.exp(0.02 * x) * np.exp(rng.normal(0.0, 0.05, n_rows))
+    y_error = 0.05 * y
+    df = pd.DataFrame({"x": x, "y": y, "y_error": y_error})
+    text = "# x y y_error\n" + df.to_csv(sep=" ", header=False, index=False, float_format="%.6g")
+    return {"x": x, "y": y, "df": df, "dataset": Dataset.from_frame(df), "text": text}
+
+
+def graph_settings(plot_type="通常"):
+    """UIの既定値に相当する設定"""
+    return {
+        "x_label": "$x$", "y_label": "$y$", "tick_length": 5, "plot_type": plot_type,
+        "show_legend": True, "show_fitting": True, "show_error_bars": False,
+        "data_legend_label": "測定値", "legend_fontsize": 15,
+        "force_origin_visible": False, "manual_x_axis": False, "manual_y_axis": False,
+        "decimation_threshold": pg.DEFAULT_DECIMATION_THRESHOLD,
+    }
+
+
+def build_figure(data, plot_type):
+    """app.py と同じ手順で、データ点と近似線を描画した figure を作る"""
+    settings = graph_settings(plot_type)
+    fit_results = fc.calculate_fitting_parameters_v3(data["x"], data["y"], plot_type)
+    fig, ax = pg.draw_graph(data["dataset"], settings, [(fit_results, fit_results["equation_latex"], "--", "red")])
+    return fig, ax, fit_results
+
+
+def case_parse(data):
+    return lambda: dh.parse_text_data(data["text"])
+
+
+def case_fit(plot_type):
+    def make(data):
+        return lambda: fc.calculate_fitting_parameters_v3(data["x"], data["y"], plot_type)
+    return make
+
+
+def case_axis_ranges(data):
+    fig, ax = pg.create_figure_and_axes(graph_settings())
+    settings = graph_settings()
+    return lambda: pg.determine_final_axis_ranges(ax, settings, data["x"], data["y"])
+
+
+def case_fit_line(data):
+    fig, ax, fit_results = build_figure(data, "通常")
+    settings = graph_settings()
+    xlim = ax.get_xlim()
+
+    def run():
+        pg.plot_fit_line_on_final_axes(
+            ax, xlim, data["x"], fit_results, "通常", settings, legend_label="fit", line_style="--", color="red"
+        )
+        ax.lines[-1].remove()
+    return run
+
+
+def case_draw(data):
+    def run():
+        fig, _, _ = build_figure(data, "通常")
+        fig.canvas.draw()
+    return run
+
+
+def case_vega_lite_spec(data):
+    settings = graph_settings()
+    fit_results = fc.calculate_fitting_parameters_v3(data["x"], data["y"], "通常")
+    fit_lines = [(fit_results, fit_results["equation_latex"], "--", "red")]
+    return lambda: vc.build_vega_lite_spec(data["dataset"], settings, fit_lines)
+
+
+def case_latex_table(data):
+    return lambda: lt.generate_latex_table(data["df"])
+
+
+def case_export(fmt):
+    def make(data):
+        fig, _, _ = build_figure(data, "通常")
+        return lambda: pg.export_figure_bytes(fig, fmt)
+    return make
+
+
+# (名前, 計測関数を作る関数, 計測する最大点数)
+CASES = [
+    ("parse_text_data", case_parse, 10_000_000),
+    *[(f"fit[{plot_type}]", case_fit(plot_type), 10_000_000) for plot_type in PLOT_TYPES],
+    ("determine_final_axis_ranges", case_axis_ranges, 10_000_000),
+    ("plot_fit_line_on_final_axes", case_fit_line, 10_000_000),
+    ("draw_figure", case_draw, 10_000_000),
+    ("vega_lite_spec", case_vega_lite_spec, 10_000_000),
+    ("generate_latex_table", case_latex_table, 1_000_000),
+    ("export_png", case_export("png"), 10_000_000),
+    ("export_svg", case_export("svg"), 10_000_000),
+]
+
+
+def time_callable(func, repeat):
+    """最短時間 [ms] を返す（最初の1回はウォームアップとして捨てる）"""
+    func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1e3
+
+
+def environment_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "matplotlib": matplotlib.__version__,
+    }
+
+
+def compare(results, baseline, threshold):
+    """基準値と比べて遅くなった項目の一覧を返す"""
+    regressions = []
+    for key, ms in results.items():
+        base_ms = baseline.get(key)
+        if base_ms is None:
+            continue
+        if ms > base_ms * (1.0 + threshold) and ms - base_ms > NOISE_FLOOR_MS:
+            regressions.append((key, base_ms, ms))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--max-rows", type=int, default=None, help="この点数を超えるサイズを省略する")
+    parser.add_argument("--cases", nargs="+", default=None, help="実行する項目名（前方一致）")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.5, help="許容する遅化の割合（0.5 = 50%%）")
+    parser.add_argument("--save-baseline", action="store_true", help="結果を基準値として保存する")
+    args = parser.parse_args()
+
+    sizes = [n for n in args.sizes if args.max_rows is None or n <= args.max_rows]
+    cases = [c for c in CASES if args.cases is None or any(c[0].startswith(p) for p in args.cases)]
+
+    results = {}
+    print(f"{'case':<32} {'rows':>10} {'time [ms]':>12}")
+    for n_rows in sizes:
+        data = make_dataset(n_rows)
+        for name, make_case, max_rows in cases:
+            if n_rows > max_rows:
+                continue
+            repeat = args.repeat if n_rows <= 1_000_000 else 1
+            ms = time_callable(make_case(data), repeat)
+            results[f"{name}@{n_rows}"] = round(ms, 3)
+            print(f"{name:<32} {n_rows:>10} {ms:>12.3f}")
+        del data
+
+    report = {"environment": environment_info(), "results": results}
+    os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+    with open(RESULTS_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        baseline_results = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, encoding="utf-8") as f:
+                baseline_results = json.load(f)["results"]
+        baseline_results.update(results)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment_info(), "results": baseline_results}, f, ensure_ascii=False, indent=2)
+        print(f"baseline saved: {BASELINE_PATH}")
+        return
+
+    if not os.path.exists(BASELINE_PATH):
+        print("baseline not found; run with --save-baseline to create one")
+        return
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["environment"] != environment_info():
+        print("warning: baseline was recorded in a different environment")
+    regressions = compare(results, baseline["results"], args.threshold)
+    if regressions:
+        print(f"PERFORMANCE REGRESSION (> {args.threshold:.0%} slower than baseline):")
+        for key, base_ms, ms in regressions:
+            print(f"  {key}: {base_ms:.3f} ms -> {ms:.3f} ms ({ms / base_ms:.2f}x)")
+        sys.exit(1)
+    print("no regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
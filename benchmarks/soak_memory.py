@@ -0,0 +1,108 @@
+# benchmarks/soak_memory.py
+"""
+メモリの耐久テスト。Streamlitのサーバーを起動せずに AppTest でアプリを何度も再実行し、
+常駐メモリ（RSS）が増え続けないことと、pyplot の figure 管理に figure が残らないことを確認する。
+
+再実行ごとにグラフ種類と凡例の文字サイズを切り替え、毎回グラフを描き直させる。
+RSS は再実行ごとに測り、アロケーターによる一時的な増減をならすため、ウォームアップ直後と最後の
+それぞれ1割の区間の中央値を比べる。増加が --budget-mb を超えた場合は終了コード1で終了する。
+
+実行例:
+    python benchmarks/soak_memory.py --reruns 2000 --rows 20000 --budget-mb 30
+"""
+import argparse
+import gc
+import os
+import resource
+import statistics
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault("STREAM_LOG_LEVEL", "WARNING")
+
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+PLOT_TYPES = ["通常", "片対数 (Y軸対数)", "片対数 (X軸対数)", "両対数"]
+
+
+def current_rss_mb():
+    """現在の常駐メモリ [MB]（/proc が無い環境では最大RSSで代用する）"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_text(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0.1, 100.0, n_rows)
+    y = 2.0 * np.exp(0.02 * x) * np.exp(rng.normal(0.0, 0.05, n_rows))
+    return "\n".join(f"{a:.6g} {b:.6g}" for a, b in zip(x, y))
+
+
+def pyplot_figure_count():
+    """pyplot の figure 管理に登録されている figure の数（pyplot が読み込まれていなければ0）"""
+    pylab_helpers = sys.modules.get("matplotlib._pylab_helpers")
+    return 0 if pylab_helpers is None else len(pylab_helpers.Gcf.figs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=300)
+    parser.add_argument("--rows", type=int, default=5_000)
+    parser.add_argument("--warmup", type=int, default=30, help="基準のRSSを測る前の再実行回数")
+    parser.add_argument("--budget-mb", type=float, default=30.0, help="ウォームアップ後に許容するRSSの増加 [MB]")
+    parser.add_argument("--report-every", type=int, default=50)
+    args = parser.parse_args()
+
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    # 初回のお知らせ表示を省略する（LocalStorage に既読のバージョンがある状態にする）
+    from modules.constants import APP_VERSION
+    at.session_state["storage_init"] = {"app_last_seen_version": APP_VERSION}
+    at.run()
+    at.text_area[0].input(make_text(args.rows)).run()
+    next(c for c in at.sidebar.checkbox if c.label.startswith("フィッティングを行う")).check().run()
+
+    samples = []
+    start = time.perf_counter()
+    print(f"{'rerun':>6} {'RSS [MB]':>9} {'pyplot figs':>12} {'s/rerun':>8}")
+    for i in range(1, args.reruns + 1):
+        at.sidebar.selectbox[0].select(PLOT_TYPES[i % len(PLOT_TYPES)])
+        at.sidebar.slider[-1].set_value(15 + i % 6)
+        at.run()
+        if at.exception:
+            print(f"exception at rerun {i}: {at.exception}")
+            sys.exit(1)
+
+        rss = current_rss_mb()
+        if i > args.warmup:
+            samples.append(rss)
+        if i % args.report_every == 0 or i == args.reruns:
+            print(f"{i:>6} {rss:>9.1f} {pyplot_figure_count():>12} {(time.perf_counter() - start) / i:>8.2f}")
+
+    gc.collect()
+    failures = []
+    if pyplot_figure_count():
+        failures.append(f"{pyplot_figure_count()} figures left in pyplot")
+    if len(samples) >= 2:
+        window = max(1, len(samples) // 10)
+        baseline = statistics.median(samples[:window])
+        final = statistics.median(samples[-window:])
+        print(f"RSS median: {baseline:.1f} MB after warmup -> {final:.1f} MB at end ({final - baseline:+.1f} MB)")
+        if final - baseline > args.budget_mb:
+            failures.append(f"RSS grew {final - baseline:.1f} MB > budget {args.budget_mb:.1f} MB")
+    if failures:
+        print("MEMORY SOAK FAILED: " + "; ".join(failures))
+        sys.exit(1)
+    print("memory soak: OK")
+
+
+if __name__ == "__main__":
+    main()
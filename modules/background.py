@@ -0,0 +1,143 @@
+# modules/background.py
+"""
+フィットと描画の段階を、Streamlit のスクリプトのスレッドではなく、プロセス全体で共有する
+上限付きのスレッドプールで計算する。
+セッションごとに計算の種類（スロット）ごとの世代を持ち、入力が変わった計算を投入するたびに世代を進める。
+古い世代の計算は、始まっていなければ取り消し、実行中なら次の段階に進む前に打ち切る。
+終わっていても結果は使わずに破棄する。
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.instrumentation import RerunTimings, log_event
+from modules.pipeline import StageCancelled
+
+# 計算に使うスレッド数（すべてのセッションで共有）。環境変数 STREAM_COMPUTE_WORKERS で変更できる
+COMPUTE_WORKERS = int(os.environ.get("STREAM_COMPUTE_WORKERS", min(4, os.cpu_count() or 1)))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=COMPUTE_WORKERS, thread_name_prefix="stage")
+        return _executor
+
+
+def _run_stages(pipeline, names, inputs, base, sources, cancelled, trace_allocations):
+    """
+    プールのスレッドで、メモの写し base から names の段階を計算する。
+    (計算後のメモ, 計測した段階) を返す。打ち切った場合は、それまでに計算した結果を破棄する。
+    """
+    memo = dict(base)
+    timings = RerunTimings(trace_allocations=trace_allocations)
+    try:
+        for name in names:
+            pipeline.run(name, inputs, memo, sources, timings, cancelled=cancelled, release=False)
+        if cancelled():  # 最後の段階の計算中に置き換えられた
+            raise StageCancelled(names[-1])
+    except StageCancelled as exc:
+        pipeline.release_computed(memo, base)
+        log_event("stage_job_cancelled", stage=str(exc), stages=names)
+        raise
+    return memo, timings.stages
+
+
+def _failed(future):
+    """計算が例外で終わったか（打ち切りは除く）"""
+    return future.done() and not isinstance(future.exception(), (type(None), StageCancelled))
+
+
+class StageJob:
+    """投入した1回の計算（段階のキーの組、世代、Future、投入したときのメモの写し）"""
+
+    __slots__ = ("key", "generation", "future", "base")
+
+    def __init__(self, key, generation, future, base):
+        self.key = key
+        self.generation = generation
+        self.future = future
+        self.base = base
+
+
+class SessionJobs:
+    """
+    セッションごとの計算の投入口。スロットごとに最新の世代の計算だけを残す。
+    同じ入力の計算が実行中なら投入し直さずに引き継ぐため、計算中の再実行が打ち切られても、
+    次の再実行が同じ計算を待つことができる。
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def generation(self, slot):
+        with self._lock:
+            return self._generations.get(slot, 0)
+
+    def submit(self, slot, pipeline, names, inputs, memo, sources=None, trace_allocations=False):
+        """
+        names の段階をプールで計算する StageJob を返す。すべての段階がメモにある場合は None。
+        同じキーの計算が投入済みならそれを返し、違う場合は古い計算を取り消して次の世代で投入する。
+        """
+        if all(pipeline.is_current(name, inputs, memo) for name in names):
+            self.cancel(slot, pipeline)
+            return None
+        key = tuple(pipeline.key(name, inputs) for name in names)
+        with self._lock:
+            job = self._jobs.get(slot)
+            if job is not None and job.key == key and not job.future.cancelled() and not _failed(job.future):
+                return job
+        self.cancel(slot, pipeline)
+        with self._lock:
+            generation = self._generations.get(slot, 0) + 1
+            self._generations[slot] = generation
+            base = dict(memo)
+
+            def cancelled():
+                return self.generation(slot) != generation
+
+            future = _get_executor().submit(
+                _run_stages, pipeline, list(names), dict(inputs), base, sources, cancelled, trace_allocations
+            )
+            job = StageJob(key, generation, future, base)
+            self._jobs[slot] = job
+        return job
+
+    def collect(self, slot, job, pipeline, memo, timings=None):
+        """
+        終わった計算の結果を memo に反映する。計算した段階の計測を timings に加える。
+        計算中に例外が起きた場合はそれを送出する（失敗した計算は残さず、次の投入で計算し直す）。
+        """
+        try:
+            computed, stages = job.future.result()
+        except StageCancelled:
+            raise
+        except Exception as e:
+            log_event("stage_job_failed", level=logging.ERROR, slot=slot, error=repr(e))
+            raise
+        finally:
+            with self._lock:
+                if self._jobs.get(slot) is job:
+                    del self._jobs[slot]
+        pipeline.merge(memo, computed, job.base)
+        if timings is not None:
+            timings.stages.extend({**record, "worker": True} for record in stages)
+
+    def cancel(self, slot, pipeline):
+        """slot の計算を取り消す（実行中なら次の段階に進む前に打ち切り、終わっていれば結果を破棄する）"""
+        with self._lock:
+            job = self._jobs.pop(slot, None)
+            if job is None:
+                return
+            self._generations[slot] = self._generations.get(slot, 0) + 1
+        if job.future.cancel():
+            log_event("stage_job_cancelled", slot=slot, started=False)
+        elif job.future.done() and job.future.exception() is None:
+            pipeline.release_computed(job.future.result()[0], job.base)
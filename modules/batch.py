@@ -0,0 +1,221 @@
+# modules/batch.py
+"""
+Streamlitを使わずに、複数のデータファイルをまとめてフィット・描画するコマンドライン処理。
+ファイルごとの処理はプロセスプールで並列に実行し、終わったものから順に結果を書き出す。
+
+実行例:
+    python batch_fit.py "data/*.txt" --plot-type 両対数 --out batch_output --format parquet
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import modules.data_handler as dh
+import modules.fitting_calculator as fc
+import modules.nonlinear_fit as nf
+import modules.plot_generator as pg
+from modules.dataset import Dataset
+
+PLOT_TYPES = ["通常", "片対数 (Y軸対数)", "片対数 (X軸対数)", "両対数"]
+
+# 結果の表の列（A, B は指数・べき関数の係数と指数部）
+RESULT_COLUMNS = [
+    "file", "plot_type", "n_points",
+    "slope", "slope_err", "intercept", "intercept_err",
+    "A", "A_err", "B", "B_err", "r_squared",
+    "equation", "figure", "error", "elapsed_ms",
+]
+
+
+def default_graph_settings(plot_type="通常", x_label="X軸", y_label="Y軸", show_error_bars=False,
+                           fit_method=fc.DEFAULT_FIT_METHOD, fit_model=None):
+    """UIの既定値に相当するグラフ設定"""
+    return {
+        "x_label": x_label, "y_label": y_label, "tick_length": 5, "plot_type": plot_type,
+        "show_legend": True, "show_fitting": True, "fit_method": fit_method, "fit_model": fit_model,
+        "show_error_bars": show_error_bars,
+        "decimation_threshold": pg.DEFAULT_DECIMATION_THRESHOLD,
+        "data_legend_label": "測定値", "legend_fontsize": 15,
+    }
+
+
+def collect_input_files(inputs, pattern="*.txt"):
+    """ディレクトリ（pattern に一致するファイル）またはglobパターンから、入力ファイルの一覧を作る"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(glob.glob(os.path.join(item, pattern))))
+        else:
+            paths.extend(sorted(glob.glob(item, recursive=True)))
+    # 重複を除き、指定された順序を保つ
+    return [p for p in dict.fromkeys(paths) if os.path.isfile(p)]
+
+
+def assign_figure_paths(paths, figure_dir, figure_format):
+    """ファイル名（拡張子なし）から出力画像のパスを決める。名前が重複する場合は連番を付ける"""
+    used = set()
+    figure_paths = {}
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        name, suffix = stem, 1
+        while name in used:
+            suffix += 1
+            name = f"{stem}_{suffix}"
+        used.add(name)
+        figure_paths[path] = os.path.join(figure_dir, f"{name}.{figure_format}")
+    return figure_paths
+
+
+def process_file(path, graph_settings, figure_path=None, dtype=np.float64):
+    """
+    1つのデータファイルを読み込んでフィットし、figure_path が指定されていればグラフを保存する。
+    dtype=np.float32 の場合は数値データを単精度で保持する（大きなファイル向け）。
+    プロセスプールのワーカーで実行するため、例外は送出せず結果の辞書の error に格納する。
+    """
+    start = time.perf_counter()
+    row = dict.fromkeys(RESULT_COLUMNS)
+    row.update({"file": path, "plot_type": graph_settings["plot_type"]})
+    try:
+        with open(path, encoding="utf-8") as f:
+            raw_data_str = f.read()
+        _, df_numeric, error_message = dh.parse_text_data(raw_data_str)
+        if error_message or df_numeric is None:
+            row["error"] = error_message or "データがありません。"
+            return row
+        plot_data = Dataset.from_frame(df_numeric, dtype=dtype).valid()
+        row["n_points"] = len(plot_data)
+        if len(plot_data) == 0:
+            row["error"] = "有効な数値データがありません。"
+            return row
+
+        fit_results = fc.calculate_fitting_parameters_v3(
+            plot_data.x, plot_data.y, graph_settings["plot_type"],
+            graph_settings.get("fit_method", fc.DEFAULT_FIT_METHOD), model=graph_settings.get("fit_model")
+        )
+        row.update({
+            "slope": fit_results["slope_val"], "slope_err": fit_results["slope_err"],
+            "intercept": fit_results["intercept_val"], "intercept_err": fit_results["intercept_err"],
+            "A": fit_results["A_val"], "A_err": fit_results["A_err"],
+            "B": fit_results["B_val"], "B_err": fit_results["B_err"],
+            "r_squared": fit_results["r_squared"], "equation": fit_results["equation_text"],
+            "error": fit_results["error_message"],
+        })
+
+        if figure_path is not None:
+            fig, _ = pg.draw_graph(
+                plot_data, graph_settings, [(fit_results, fit_results["equation_latex"], '--', 'red')]
+            )
+            try:
+                fig.savefig(figure_path, **pg.EXPORT_FORMATS[os.path.splitext(figure_path)[1][1:]])
+            finally:
+                pg.release_figure(fig)
+            row["figure"] = figure_path
+    except Exception as e:  # 1つのファイルの失敗で一括処理全体を止めない
+        row["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        row["elapsed_ms"] = round((time.perf_counter() - start) * 1e3, 3)
+    return row
+
+
+def iter_batch_results(paths, graph_settings, figure_paths=None, workers=None, dtype=np.float64):
+    """
+    ファイルごとの結果の辞書を、処理が終わった順に返すジェネレーター。
+    workers=1 の場合はプロセスプールを使わずに順に処理する。
+    """
+    figure_paths = figure_paths or {}
+    if workers == 1:
+        for path in paths:
+            yield process_file(path, graph_settings, figure_paths.get(path), dtype)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(process_file, path, graph_settings, figure_paths.get(path), dtype) for path in paths
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def write_results(rows, output_path):
+    """
+    結果を CSV または Parquet（拡張子で判定）に書き出し、書き出した行を順に返す。
+    CSV は1行ずつ追記するため、処理途中でも終わった分の結果を確認できる。
+    """
+    if output_path.endswith(".parquet"):
+        import pandas as pd
+
+        collected = []
+        for row in rows:
+            collected.append(row)
+            yield row
+        pd.DataFrame(collected, columns=RESULT_COLUMNS).to_parquet(output_path, index=False)
+        return
+
+    with open(output_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            f.flush()
+            yield row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="複数のデータファイルをまとめてフィット・描画し、結果を1つの表に書き出します。"
+    )
+    parser.add_argument("inputs", nargs="+", help="データファイルのディレクトリまたはglobパターン")
+    parser.add_argument("--pattern", default="*.txt", help="ディレクトリを指定した場合に対象とするファイル名のパターン")
+    parser.add_argument("--plot-type", default="通常", choices=PLOT_TYPES)
+    parser.add_argument("--fit-method", default=fc.DEFAULT_FIT_METHOD, choices=fc.FIT_METHOD_NAMES,
+                        help="外れ値を含むデータでは Theil–Sen 推定または Huber 推定を指定する")
+    parser.add_argument("--fit-model", default=None, choices=list(nf.MODELS),
+                        help="非線形最小二乗法でフィットするモデル（省略時はグラフ種類に合わせる）")
+    parser.add_argument("--out", default="batch_output", help="出力先ディレクトリ")
+    parser.add_argument("--format", default="csv", choices=["csv", "parquet"], help="結果の表の形式")
+    parser.add_argument("--figure-format", default="png", choices=list(pg.EXPORT_FORMATS))
+    parser.add_argument("--no-figures", action="store_true", help="グラフを保存しない")
+    parser.add_argument("--x-label", default="X軸")
+    parser.add_argument("--y-label", default="Y軸")
+    parser.add_argument("--error-bars", action="store_true", help="3列目を誤差としてエラーバーを描画する")
+    parser.add_argument("--float32", action="store_true", help="数値データを単精度で保持してメモリ使用量を減らす")
+    parser.add_argument("--workers", type=int, default=None, help="並列プロセス数（既定はCPUコア数）")
+    args = parser.parse_args(argv)
+
+    paths = collect_input_files(args.inputs, args.pattern)
+    if not paths:
+        parser.error("入力ファイルが見つかりません。")
+
+    os.makedirs(args.out, exist_ok=True)
+    figure_paths = None
+    if not args.no_figures:
+        figure_dir = os.path.join(args.out, "figures")
+        os.makedirs(figure_dir, exist_ok=True)
+        figure_paths = assign_figure_paths(paths, figure_dir, args.figure_format)
+
+    graph_settings = default_graph_settings(
+        args.plot_type, args.x_label, args.y_label, args.error_bars, fit_method=args.fit_method, fit_model=args.fit_model
+    )
+    output_path = os.path.join(args.out, f"fit_results.{args.format}")
+
+    start = time.perf_counter()
+    n_failed = 0
+    results = iter_batch_results(
+        paths, graph_settings, figure_paths, workers=args.workers, dtype=np.float32 if args.float32 else np.float64
+    )
+    for i, row in enumerate(write_results(results, output_path), start=1):
+        status = "ok" if row["error"] is None else f"error: {row['error']}"
+        n_failed += row["error"] is not None
+        print(f"[{i}/{len(paths)}] {row['file']} ({row['elapsed_ms']:.0f} ms) {status}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(paths)} files ({n_failed} failed) in {elapsed:.1f} s -> {output_path}", file=sys.stderr
+    )
+    return 1 if n_failed else 0
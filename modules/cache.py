@@ -0,0 +1,136 @@
+# modules/cache.py
+import hashlib
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
+
+def bytes_digest(data):
+    """バイト列の内容からキャッシュキー用のハッシュ値（16進文字列）を計算する"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def text_digest(text):
+    """文字列の内容からキャッシュキー用のハッシュ値（16進文字列）を計算する"""
+    return bytes_digest(text.encode("utf-8"))
+
+
+def make_cache_key(*parts):
+    """
+    設定の辞書などJSONで表せる値の組から、キャッシュキー用のハッシュ値を計算する。
+    辞書はキーの順序に依存しない。JSONにできない値は repr で表す。
+    """
+    serialized = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=repr)
+    return text_digest(serialized)
+
+
+def estimate_nbytes(value):
+    """キャッシュに載せる値のおおよそのメモリ使用量（バイト）を見積もる"""
+    if value is None:
+        return 0
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(v) for v in value)
+    if isinstance(value, Mapping):  # フィット結果などの辞書
+        return sum(estimate_nbytes(v) for v in value.values())
+    if hasattr(value, "memory_usage"):  # pandas.DataFrame
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if hasattr(value, "nbytes"):  # numpy.ndarray
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    合計バイト数で上限を設けたスレッドセーフなLRUキャッシュ。
+    max_entries でエントリ数の上限を、ttl_s で格納してからの有効期限（秒）を追加で指定できる。
+    Streamlitのセッション間で共有されるため、格納した値を呼び出し側で書き換えないこと。
+    """
+
+    def __init__(self, max_bytes, sizeof=estimate_nbytes, max_entries=None, ttl_s=None, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._sizeof = sizeof
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (value, nbytes, expires_at)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+
+    def _expired(self, entry, now):
+        return entry[2] is not None and now >= entry[2]
+
+    def _remove(self, key):
+        self._total_bytes -= self._entries.pop(key)[1]
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, self._clock()):
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, ttl_s=None):
+        """key に value を格納する。ttl_s を渡すと、このエントリの有効期限を ttl_s 秒（ただし self.ttl_s 以下）にする"""
+        if ttl_s is None:
+            ttl_s = self.ttl_s
+        elif self.ttl_s is not None:
+            ttl_s = min(ttl_s, self.ttl_s)
+        nbytes = self._sizeof(value)
+        with self._lock:
+            now = self._clock()
+            if key in self._entries:
+                self._remove(key)
+            # 最も長く使われていないものから、期限切れのエントリを先に捨てる
+            while self._entries:
+                oldest_key, oldest = next(iter(self._entries.items()))
+                if not self._expired(oldest, now):
+                    break
+                self._remove(oldest_key)
+                self.expirations += 1
+            if nbytes > self.max_bytes:  # 単体で上限を超えるものは保持しない
+                return
+            expires_at = now + ttl_s if ttl_s is not None else None
+            self._entries[key] = (value, nbytes, expires_at)
+            self._total_bytes += nbytes
+            while self._total_bytes > self.max_bytes or (
+                self.max_entries is not None and len(self._entries) > self.max_entries
+            ):
+                _, (_, evicted_bytes, _) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def stats(self):
+        """ヒット数・ミス数・期限切れ数・エントリ数・使用バイト数を返す"""
+        with self._lock:
+            return {
+                "hits": self.hits, "misses": self.misses, "expirations": self.expirations,
+                "entries": len(self._entries), "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes, "max_entries": self.max_entries, "ttl_s": self.ttl_s,
+            }
@@ -1,7 +1,11 @@
 # modules/constants.py
+import logging
+
 import streamlit as st
 from streamlit_local_storage import LocalStorage  # ライブラリをインポート
 
+from modules.instrumentation import log_event
+
 # --- アプリのバージョン情報 ---
 APP_VERSION = "v0.1.4"  # アプリを更新するたびにここを変更
 
@@ -26,9 +30,6 @@ RELEASE_NOTES_HISTORY = load_release_notes()
 
 def get_latest_release_notes_summary():
     """最新バージョンのリリースノートの要約を取得する"""
-    print(f"--- DEBUG: get_latest_release_notes_summary ---")
-    print(f"DEBUG: APP_VERSION = '{APP_VERSION}' (length: {len(APP_VERSION)})")
-
     # APP_VERSION が既に "v" を含んでいるので、プレフィックス生成時には "v" を追加しない
     if APP_VERSION.startswith('v'):
         version_identifier_for_prefix = APP_VERSION
@@ -37,7 +38,8 @@ def get_latest_release_notes_summary():
 
     version_line_prefix_to_find = f"- **{version_identifier_for_prefix}" # 修正点
 
-    print(f"DEBUG: version_line_prefix_to_find = '{version_line_prefix_to_find}' (length: {len(version_line_prefix_to_find)})")
+    log_event("release_notes_lookup", level=logging.DEBUG,
+              app_version=APP_VERSION, prefix=version_line_prefix_to_find)
     try:
         lines = RELEASE_NOTES_HISTORY.strip().split('\n')
 
@@ -85,7 +87,7 @@ def get_latest_release_notes_summary():
         return "\n".join(summary_lines)
 
     except Exception as e:
-        print(f"Error in get_latest_release_notes_summary: {e}")
+        log_event("release_notes_error", level=logging.ERROR, error=str(e))
         return "最新の更新情報を取得中にエラーが発生しました。"
 
 
@@ -1,30 +1,273 @@
 # modules/data_handler.py
-import pandas as pd
+# pandas / pyarrow は読み込みに時間がかかるため、データが入力されてから各関数内で読み込む
+import numpy as np
 import io
+import re
 
+from modules.cache import LRUCache, bytes_digest, text_digest
+from modules.shared_cache import SharedCache
 
-def parse_text_data(raw_data_str):
+# パース結果キャッシュの上限（合計バイト数）
+PARSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# 共有キャッシュ（modules.shared_cache）が有効なら、他のプロセスがパースした結果も使う
+_parse_cache = SharedCache(LRUCache(PARSE_CACHE_MAX_BYTES), "parse")
+
+_WHITESPACE_BYTES = b' \t\r\n'
+
+
+def detect_num_columns(raw_data_str):
+    """コメント行・空行を除いた最初のデータ行の列数を返す（全体を分割しない）"""
+    pos = 0
+    length = len(raw_data_str)
+    while pos < length:
+        end = raw_data_str.find('\n', pos)
+        if end == -1:
+            end = length
+        stripped = raw_data_str[pos:end].strip()
+        if stripped and not stripped.startswith('#'):
+            return len(stripped.split())
+        pos = end + 1
+    return 0
+
+
+def _data_body_bounds(data):
+    """
+    先頭の空行・コメント行と末尾の空白を除いた、データ本体のバイト範囲 (start, end) を返す。
+    本体を切り出してコピーしないよう、位置だけを求める。
+    """
+    start, end = 0, len(data)
+    while start < end:
+        if data[start] in _WHITESPACE_BYTES:
+            start += 1
+        elif data[start] == ord('#'):
+            newline = data.find(b'\n', start)
+            start = end if newline == -1 else newline + 1
+        else:
+            break
+    while end > start and data[end - 1] in _WHITESPACE_BYTES:
+        end -= 1
+    return start, end
+
+
+# 行の途中にも書けるコメント（# から行末まで、直前の空白を含む）
+_COMMENT_PATTERN = re.compile(rb'[ \t]*#[^\r\n]*')
+# 欠損値として読む表記（pandas.read_csv の既定から空欄を除いたもの）。
+# 空欄は連続した区切り文字や行頭・行末の区切り文字で生じ、列がずれるため欠損値にしない
+_NA_TOKENS = [
+    "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+# pandas.read_csv が真偽値として読む表記（列全体がこれらなら、数値データでは 1.0 / 0.0 になる）
+_TRUE_TOKENS = ["True", "TRUE", "true"]
+_FALSE_TOKENS = ["False", "FALSE", "false"]
+
+
+def _strip_comments(body):
+    """コメントを取り除いたバイト列を返す（pandas の comment='#' と同じく、# から行末までを無視する）"""
+    return _COMMENT_PATTERN.sub(b'', body)
+
+
+class LazyOriginalFrame:
+    """
+    元の値を保持したDataFrameを、必要になったときに Arrow の表から作る。
+    プレビュー（head）では先頭の行だけを変換し、LaTeX の表などで全体が必要なら to_frame() で作る。
+    列の選択（df[[...]]）と rename は Arrow の表のまま行う（select_series で使う）。
+    """
+
+    __slots__ = ("_table", "_frame")
+
+    def __init__(self, table):
+        self._table = table
+        self._frame = None
+
+    def __reduce__(self):  # 作ったDataFrameは保存しない
+        return LazyOriginalFrame, (self._table,)
+
+    def __len__(self):
+        return self._table.num_rows
+
+    @property
+    def empty(self):
+        return self._table.num_rows == 0 or self._table.num_columns == 0
+
+    @property
+    def columns(self):
+        return list(self._table.column_names)
+
+    @property
+    def nbytes(self):
+        return self._table.nbytes
+
+    def __getitem__(self, names):
+        if isinstance(names, str):
+            return self.to_frame()[names]
+        return LazyOriginalFrame(self._table.select(list(names)))
+
+    def rename(self, columns):
+        return LazyOriginalFrame(self._table.rename_columns([columns.get(name, name) for name in self.columns]))
+
+    def head(self, n=5):
+        if self._frame is not None:
+            return self._frame.head(n)
+        return _arrow_to_original_frame(self._table.slice(0, n))
+
+    def to_frame(self):
+        if self._frame is None:
+            self._frame = _arrow_to_original_frame(self._table)
+        return self._frame
+
+
+def as_frame(df):
+    """parse_text_data の df_orig を pandas.DataFrame として返す（LazyOriginalFrame なら全体を作る）"""
+    return df.to_frame() if isinstance(df, LazyOriginalFrame) else df
+
+
+def _arrow_to_original_frame(table):
+    """文字列の列の欠損値は、pandas の読み込みと同じく None ではなく NaN にする"""
+    import pyarrow as pa
+
+    df = table.to_pandas()
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_string(column.type) and column.null_count:
+            df[name] = df[name].where(df[name].notna(), np.nan)
+    return df
+
+
+def read_numeric_table_fast(raw_data_str, names):
+    """
+    空白区切りのテキストを一度だけトークナイズし、列ごとの連続した配列として読み込む（ArrowのCSVリーダー）。
+    数値として読めない値（文字列・真偽値・日付・16進数など）は NaN にし、NA などの欠損値の表記も NaN にする。
+    コメント（#）は取り除き、タブとスペースが混在していれば区切りをスペースに揃える。
+    元の値を保持したDataFrameは LazyOriginalFrame として、必要になるまで作らない。
+    連続した空白や行頭・行末の空白（空欄になる）、列数が揃っていないなど、高速経路で扱えない入力の場合は None を返す
+    （呼び出し側で pandas の読み込みに切り替える）。
+
+    戻り値: (LazyOriginalFrame, float64の数値DataFrame) または None
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+
+    data = raw_data_str.encode('utf-8')
+    start, end = _data_body_bounds(data)
+    if start >= end:
+        return None
+    # コメントやタブを置き換える場合だけ本体をコピーし、それ以外は位置 (start, end) だけで扱う
+    if data.find(b'#', start, end) != -1:
+        data = _strip_comments(data[start:end])
+        start, end = _data_body_bounds(data)
+        if start >= end:
+            return None
+    has_tab = data.find(b'\t', start, end) != -1
+    if has_tab and data.find(b' ', start, end) != -1:
+        data, start, end = data[start:end].replace(b'\t', b' '), 0, end - start
+        has_tab = False
+    delimiter = '\t' if has_tab else ' '
+    body = pa.py_buffer(data).slice(start, end - start)
+
+    def read(column_types=None):
+        return pa_csv.read_csv(
+            body,
+            read_options=pa_csv.ReadOptions(column_names=names, use_threads=True),
+            parse_options=pa_csv.ParseOptions(delimiter=delimiter),
+            convert_options=pa_csv.ConvertOptions(column_types=column_types, null_values=_NA_TOKENS,
+                                                  strings_can_be_null=True),
+        )
+
+    def is_number(column_type):
+        return pa.types.is_int64(column_type) or pa.types.is_float64(column_type) or pa.types.is_null(column_type)
+
+    try:
+        table = read()
+        # Arrow は 0x10 のような16進数を int64 として読むため、x を含む場合は整数の列も文字列として読み直す
+        has_hex = data.find(b'x', start, end) != -1 or data.find(b'X', start, end) != -1
+        text_columns = [
+            field.name for field in table.schema
+            if not is_number(field.type) or (has_hex and pa.types.is_int64(field.type))
+        ]
+        if text_columns:
+            table = read({name: pa.string() for name in text_columns})
+    except (pa.ArrowInvalid, ValueError):
+        return None
+    # 区切りが不規則な行は、列数が合わずに読み込みに失敗するか、空欄の文字列になる
+    if table.num_rows == 0 or any(pc.any(pc.equal(table[name], "")).as_py() for name in text_columns):
+        return None
+
+    numeric_columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        if name in text_columns and pc.all(pc.is_in(column, pa.array(_TRUE_TOKENS + _FALSE_TOKENS))).as_py():
+            numeric_columns[name] = pc.is_in(column, pa.array(_TRUE_TOKENS)).to_numpy(zero_copy_only=False) * 1.0
+        elif name in text_columns:
+            numeric_columns[name] = pd.to_numeric(column.to_pandas(), errors='coerce').to_numpy(dtype=np.float64)
+        else:
+            numeric_columns[name] = pc.cast(column, pa.float64()).to_numpy(zero_copy_only=False)
+    return LazyOriginalFrame(table), pd.DataFrame(numeric_columns, copy=False)
+
+
+def _with_numeric_frame(df_orig):
+    """
+    元の値を保持したDataFrameから、float64の数値DataFrameを作って (df_orig, df_numeric) を返す。
+    数値以外を含む列のみ、変換できない値を NaN にする。
+    """
+    import pandas as pd
+
+    numeric_columns = {}
+    for name in df_orig.columns:
+        column = df_orig[name]
+        if pd.api.types.is_float_dtype(column.dtype) or pd.api.types.is_integer_dtype(column.dtype):
+            numeric_columns[name] = column.to_numpy(dtype=np.float64)
+        else:
+            numeric_columns[name] = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64)
+
+    if all(dtype == np.float64 for dtype in df_orig.dtypes):
+        # すべて浮動小数点数として読めた場合は、元データと数値データで同じDataFrameを共有する
+        return df_orig, df_orig
+    return df_orig, pd.DataFrame(numeric_columns)
+
+
+def data_column_names(num_columns, multi_y=False):
+    """
+    列数に応じた列名を返す。
+    通常は x, y（3列の場合は y_error を追加）、multi_y=True の場合は x, y1, y2, ... とする。
+    """
+    if multi_y:
+        return ['x'] + [f'y{i}' for i in range(1, max(num_columns, 2))]
+    names = ['x', 'y']
+    if num_columns == 3:
+        names.append('y_error')
+    return names
+
+
+def select_series(df, series_name):
+    """複数のy列を持つDataFrameから、1つの系列を x, y の2列のDataFrameとして取り出す"""
+    return df[['x', series_name]].rename(columns={series_name: 'y'})
+
+
+def parse_text_data(raw_data_str, multi_y=False):
     """
     テキストデータをパースし、元の文字列を保持したDataFrameと、
-    数値計算用のDataFrameを返す。
+    数値計算用のDataFrameを返す。高速経路で読み込んだ場合、元の文字列を保持したDataFrameは
+    LazyOriginalFrame（表示や LaTeX の表で必要になったときに作る。as_frame で DataFrame にする）になる。
+    multi_y=True の場合は、1列目をx、2列目以降をそれぞれyの系列（y1, y2, ...）として読み込む。
     """
     if not raw_data_str.strip():
         return None, None, "データが入力されていません。"
 
+    import pandas as pd
+
     try:
-        # データを行に分割し、各行の列数をチェック
-        lines = raw_data_str.strip().split('\n')
-        num_columns = 0
-        if lines:
-            # コメント行を除外して最初のデータ行の列数を取得
-            for line in lines:
-                if not line.strip().startswith('#'):
-                    num_columns = len(line.split())
-                    break
-        
-        names = ['x', 'y']
-        if num_columns == 3:
-            names.append('y_error')
+        # コメント行を除外して最初のデータ行の列数を取得
+        num_columns = detect_num_columns(raw_data_str)
+
+        names = data_column_names(num_columns, multi_y)
+
+        # 規則的な空白区切りの数値データは高速経路で読み込む
+        fast_result = read_numeric_table_fast(raw_data_str, names)
+        if fast_result is not None:
+            df_orig, df_numeric = fast_result
+            return df_orig, df_numeric, None
 
         # まずは dtype を指定せずに、文字列として読み込む
         df_orig = pd.read_csv(
@@ -33,13 +276,196 @@ def parse_text_data(raw_data_str):
         )
         if df_orig.empty:
             return None, None, "データが読み込めませんでした。入力内容を確認してください。"
-        
+
         # 計算用の数値データフレームを作成
         # to_numeric を使い、数値に変換できないものは NaN (Not a Number) にする
         df_numeric = df_orig.apply(pd.to_numeric, errors='coerce')
 
     except Exception as e:
         return None, None, f"データ読み込み中に予期せぬエラーが発生しました: {e}"
-    
+
     # 元のデータフレームと、数値計算用のデータフレーム、エラーメッセージなしを返す
-    return df_orig, df_numeric, None
\ No newline at end of file
+    return df_orig, df_numeric, None
+
+
+# アップロードできるファイルの拡張子
+UPLOAD_FILE_TYPES = ["csv", "tsv", "txt", "dat", "xlsx", "xlsm", "parquet"]
+
+
+def _file_extension(filename):
+    return filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+
+
+def _is_number(field):
+    try:
+        float(field)
+    except ValueError:
+        return False
+    return True
+
+
+def _read_delimited_file(data, extension, multi_y):
+    """
+    CSV/TSV のバイト列を、ArrowのCSVリーダー（マルチスレッド）で文字列に変換せずに読み込む。
+    先頭のコメント行を除き、1行目に数値以外があれば見出し行として読み飛ばす。
+    読み込む列は x, y（, y_error）に使う先頭の列だけに絞る。
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    start, end = _data_body_bounds(data)
+    if start >= end:
+        return None, None, "データが読み込めませんでした。ファイルの内容を確認してください。"
+    first_line_end = data.find(b'\n', start, end)
+    first_line = data[start:end if first_line_end == -1 else first_line_end].decode('utf-8', errors='replace')
+
+    if extension == 'tsv' or ('\t' in first_line and ',' not in first_line):
+        delimiter = '\t'
+    else:
+        delimiter = ','
+    fields = [field.strip() for field in first_line.split(delimiter)]
+    has_header = not all(_is_number(field) for field in fields if field)
+
+    names = data_column_names(len(fields), multi_y)
+    column_names = [f"c{i}" for i in range(len(fields))]
+    try:
+        table = pa_csv.read_csv(
+            pa.py_buffer(data).slice(start, end - start),
+            read_options=pa_csv.ReadOptions(
+                column_names=column_names, skip_rows=1 if has_header else 0, use_threads=True
+            ),
+            parse_options=pa_csv.ParseOptions(delimiter=delimiter),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=column_names[:len(names)], strings_can_be_null=True
+            ),
+        )
+    except (pa.ArrowInvalid, ValueError) as e:
+        return None, None, f"ファイルの読み込み中にエラーが発生しました: {e}"
+    if table.num_rows == 0 or table.num_columns < 2:
+        return None, None, "2列以上の数値データが必要です。"
+    return (*_with_numeric_frame(table.rename_columns(names[:table.num_columns]).to_pandas()), None)
+
+
+def _read_excel_file(data, multi_y):
+    """
+    Excelファイルの最初のシートを、openpyxlの読み取り専用モードで1行ずつ読み込む。
+    先頭の見出し行（1列目が数値でない行）は読み飛ばす。
+    """
+    import openpyxl
+    import pandas as pd
+
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        columns = None
+        for row in rows:
+            if columns is None:
+                first = row[0] if row else None
+                if first is None or isinstance(first, str) and not _is_number(first):
+                    continue  # 見出し行・空行・コメント
+                width = len(row)
+                while width > 0 and row[width - 1] is None:
+                    width -= 1
+                names = data_column_names(width, multi_y)
+                columns = [[] for _ in names]
+            if all(value is None for value in row):
+                break  # 空行でデータの終わりとする
+            for i, column in enumerate(columns):
+                column.append(row[i] if i < len(row) else None)
+    finally:
+        workbook.close()
+
+    if columns is None or len(columns) < 2:
+        return None, None, "2列以上の数値データが必要です。"
+    df_orig = pd.DataFrame(dict(zip(names, columns)))
+    return (*_with_numeric_frame(df_orig.infer_objects()), None)
+
+
+def _read_parquet_file(data, multi_y):
+    """Parquetファイルから、x, y（, y_error）に使う先頭の列だけを読み込む（列の射影）"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(pa.BufferReader(data))
+    schema_names = parquet_file.schema_arrow.names
+    names = data_column_names(len(schema_names), multi_y)
+    if len(schema_names) < 2:
+        return None, None, "2列以上の数値データが必要です。"
+    table = parquet_file.read(columns=schema_names[:len(names)], use_threads=True)
+    return (*_with_numeric_frame(table.rename_columns(names).to_pandas()), None)
+
+
+def read_uploaded_file(data, filename, multi_y=False):
+    """
+    アップロードされたファイル（バイト列）を拡張子に応じて読み込み、parse_text_data と同じ
+    (元の値を保持したDataFrame, 数値DataFrame, エラーメッセージ) を返す。
+    CSV/TSV は Arrow、Excel は openpyxl の読み取り専用モード、Parquet は必要な列だけを読み込む。
+    空白区切りのテキスト（.txt, .dat）は parse_text_data で読み込む。
+    """
+    extension = _file_extension(filename)
+    try:
+        if extension in ('csv', 'tsv'):
+            return _read_delimited_file(data, extension, multi_y)
+        if extension in ('xlsx', 'xlsm'):
+            return _read_excel_file(data, multi_y)
+        if extension == 'parquet':
+            return _read_parquet_file(data, multi_y)
+        if extension in ('txt', 'dat'):
+            return parse_text_data(data.decode('utf-8'), multi_y)
+    except Exception as e:
+        return None, None, f"ファイルの読み込み中にエラーが発生しました: {e}"
+    return None, None, f"対応していないファイル形式です: .{extension}"
+
+
+def compute_file_key(data, filename):
+    """アップロードされたファイルの内容と形式を表すキー（ハッシュ値）を返す"""
+    return f"{_file_extension(filename)}:{bytes_digest(data)}"
+
+
+def read_uploaded_file_cached(data, filename, data_key=None, multi_y=False):
+    """read_uploaded_file の結果を、ファイルの内容と形式をキーにしてキャッシュする"""
+    if data_key is None:
+        data_key = compute_file_key(data, filename)
+    cache_key = (data_key, multi_y)
+
+    cached = _parse_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    result = read_uploaded_file(data, filename, multi_y)
+    _parse_cache.put(cache_key, result)
+    return result
+
+
+def compute_data_key(raw_data_str):
+    """入力テキストの内容を表すキー（ハッシュ値）を返す。空の場合は None"""
+    if not raw_data_str.strip():
+        return None
+    return text_digest(raw_data_str)
+
+
+def parse_text_data_cached(raw_data_str, data_key=None, multi_y=False):
+    """
+    parse_text_data の結果を、テキストのハッシュと列構成をキーにしてキャッシュする。
+    Streamlitの再実行で同じテキストが渡された場合はパースを省略する。
+    返すDataFrameはセッション間で共有されるため、呼び出し側で書き換えないこと。
+    """
+    if not raw_data_str.strip():
+        return parse_text_data(raw_data_str, multi_y)
+
+    if data_key is None:
+        data_key = text_digest(raw_data_str)
+    cache_key = (data_key, detect_num_columns(raw_data_str), multi_y)
+
+    cached = _parse_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    result = parse_text_data(raw_data_str, multi_y)
+    _parse_cache.put(cache_key, result)
+    return result
+
+
+def get_parse_cache_stats():
+    """パースキャッシュのヒット数・ミス数などを返す"""
+    return _parse_cache.stats()
@@ -1,125 +1,207 @@
-
 # modules/fitting_calculator.py
+import os
+import pickle
+import threading
+import time
+from types import MappingProxyType
+
 import numpy as np
-from scipy import stats
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import r2_score
 
-def calculate_regression_uncertainties(x_numeric, y_numeric, slope, intercept, y_pred):
+import modules.nonlinear_fit as nf
+import modules.robust_fit as rf
+from modules.background import COMPUTE_WORKERS
+from modules.cache import LRUCache
+from modules.instrumentation import log_event
+from modules.shared_cache import SharedCache
 
-    n = len(x_numeric)
-    if n <= 2: # 自由度が0以下になるため計算不可
-        return np.nan, np.nan
+# グラフ種類（近似式の形）
+PLOT_TYPES = ("通常", "片対数 (Y軸対数)", "片対数 (X軸対数)", "両対数")
 
-    t_value = 1.0  # 包含係数を1に設定
-    residuals = y_numeric - y_pred
-    # 標準誤差 (RMSE / sqrt(n-2) ではない。残差平方和 / (n-2) の平方根)
-    std_error_of_residuals = np.sqrt(np.sum(residuals**2) / (n - 2))
-    
-    x_mean = np.mean(x_numeric)
-    sum_sq_x_dev = np.sum((x_numeric - x_mean)**2)
+# 対数変換に必要な正の値が無い場合のエラーメッセージ
+POSITIVE_DATA_ERROR_MESSAGES = {
+    "片対数 (Y軸対数)": "Y軸対数のため、正のYデータが必要です。",
+    "片対数 (X軸対数)": "X軸対数のため、正のXデータが必要です。",
+    "両対数": "両対数のため、正のXおよびYデータが必要です。",
+}
 
-    if sum_sq_x_dev == 0: # 全てのxが同じ値の場合など
-        return np.nan, np.nan
+# 範囲フィットで累積和を使わず直接計算する点数の上限（狭い範囲での桁落ちを避ける）
+RANGE_FIT_DIRECT_MAX_POINTS = 4096
 
-    slope_uncertainty = t_value * std_error_of_residuals / np.sqrt(sum_sq_x_dev)
-    intercept_uncertainty = t_value * std_error_of_residuals * np.sqrt(1/n + x_mean**2 / sum_sq_x_dev)
-    
-    return slope_uncertainty, intercept_uncertainty
+# ブートストラップ法の既定の再標本数
+BOOTSTRAP_DEFAULT_RESAMPLES = 2000
+# 1回にまとめて計算する再標本の要素数（再標本数 × 点数）の上限。メモリ使用量を抑えるため分割する
+BOOTSTRAP_CHUNK_ELEMENTS = 1 << 22
+# この点数以上の場合、workers に応じてプロセスプールで分割して計算する
+BOOTSTRAP_POOL_MIN_POINTS = 100_000
+# ブートストラップ用のプロセスプールのプロセス数（すべてのセッションで共有）。既定は計算プールのスレッド数と同じ。
+# 環境変数 STREAM_BOOTSTRAP_WORKERS で変更できる
+BOOTSTRAP_POOL_WORKERS = int(os.environ.get("STREAM_BOOTSTRAP_WORKERS", COMPUTE_WORKERS))
 
+# セッション間で共有するフィット結果キャッシュの上限（エントリ数・合計バイト数）と有効期限（秒）
+FIT_CACHE_MAX_ENTRIES = 512
+FIT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+FIT_CACHE_TTL_S = 30 * 60
 
-def perform_linear_fit_sklearn_with_uncertainty(x_numeric, y_numeric, fit_intercept=True):
-    """
-    scikit-learnで線形フィットを行い、傾き、切片、R^2、および不確かさを返す。
-    """
-    print(f"\n--- DEBUG: Entering perform_linear_fit_sklearn_with_uncertainty ---")
-    print(f"DEBUG: x_numeric (first 5): {x_numeric[:5]}, type: {type(x_numeric)}, dtype: {getattr(x_numeric, 'dtype', 'N/A')}, shape: {getattr(x_numeric, 'shape', 'N/A')}")
-    print(f"DEBUG: y_numeric (first 5): {y_numeric[:5]}, type: {type(y_numeric)}, dtype: {getattr(y_numeric, 'dtype', 'N/A')}, shape: {getattr(y_numeric, 'shape', 'N/A')}")
-    print(f"DEBUG: fit_intercept: {fit_intercept}")
+_MISSING = object()
 
-    min_points = 2 if fit_intercept else 1
-    if len(x_numeric) < min_points or len(y_numeric) < min_points or len(x_numeric) != len(y_numeric):
-        print(f"DEBUG: Condition fail: Not enough data points or mismatched length. len(x)={len(x_numeric)}, len(y)={len(y_numeric)}")
-        return None, np.nan, None, np.nan, None
+_bootstrap_pool = None
+_bootstrap_pool_lock = threading.Lock()
 
-    if np.any(np.isnan(x_numeric)) or np.any(np.isinf(x_numeric)) or \
-       np.any(np.isnan(y_numeric)) or np.any(np.isinf(y_numeric)):
-        print(f"DEBUG: Condition fail: NaN or Inf found in input data.")
-        return None, np.nan, None, np.nan, None
 
-    try:
-        model = LinearRegression(fit_intercept=fit_intercept)
-        X_fit = x_numeric.reshape(-1, 1)
-        print(f"DEBUG: X_fit for model.fit (shape): {X_fit.shape}")
-        model.fit(X_fit, y_numeric)
-        print(f"DEBUG: Model fitting successful.")
-
-        slope = model.coef_[0]
-        intercept = model.intercept_ if fit_intercept else 0.0
-        print(f"DEBUG: slope: {slope}, intercept: {intercept}")
-        
-        y_pred = model.predict(X_fit)
-        r_squared = r2_score(y_numeric, y_pred)
-        print(f"DEBUG: r_squared: {r_squared}")
-        
-        slope_err, intercept_err = np.nan, np.nan 
-        if fit_intercept:
-            print(f"DEBUG: Calculating uncertainties...")
-            slope_err, intercept_err = calculate_regression_uncertainties(x_numeric, y_numeric, slope, intercept, y_pred)
-            print(f"DEBUG: slope_err: {slope_err}, intercept_err: {intercept_err}")
-        else:
-            print(f"DEBUG: Skipping uncertainties calculation (fit_intercept=False).")
+def _dump_fit_results(fit_results):
+    return pickle.dumps(dict(fit_results) if fit_results is not None else None)
 
 
-    except Exception as e:
-        print(f"DEBUG: Exception during sklearn fitting or uncertainty calculation: {e}")
-        import traceback
-        traceback.print_exc() # 詳細なトレースバックを出力
-        return None, np.nan, None, np.nan, None
+def _load_fit_results(data):
+    return freeze_fit_results(pickle.loads(data))
+
+
+# 共有キャッシュ（modules.shared_cache）が有効なら、他のプロセスで計算した結果も使う
+_fit_cache = SharedCache(
+    LRUCache(FIT_CACHE_MAX_BYTES, max_entries=FIT_CACHE_MAX_ENTRIES, ttl_s=FIT_CACHE_TTL_S), "fit",
+    dumps=_dump_fit_results, loads=_load_fit_results,
+)
+
+
+def _ols_from_centered_sums(n, x_mean, y_mean, sxx, sxy, syy):
+    """
+    平均まわりの平方和・積和 (Sxx, Sxy, Syy) から、切片ありの最小二乗直線の
+    傾き、傾きの不確かさ、切片、切片の不確かさ、R^2 を計算する。
+    不確かさは残差の標準誤差 sqrt(残差平方和 / (n-2)) から求める（包含係数1）。
+    """
+    if sxx > 0:
+        slope = sxy / sxx
+    else:  # 全てのxが同じ値の場合（scikit-learnと同様に傾き0とする）
+        slope = 0.0
+    intercept = y_mean - slope * x_mean
+    ss_res = max(syy - slope * sxy, 0.0)  # 残差平方和
+
+    if syy > 0:
+        r_squared = 1.0 - ss_res / syy
+    else:  # Yが一定の場合（r2_scoreと同様）
+        r_squared = 1.0 if ss_res == 0 else 0.0
+
+    slope_err, intercept_err = np.nan, np.nan
+    if n > 2 and sxx > 0:
+        std_error_of_residuals = np.sqrt(ss_res / (n - 2))
+        slope_err = std_error_of_residuals / np.sqrt(sxx)
+        intercept_err = std_error_of_residuals * np.sqrt(1 / n + x_mean**2 / sxx)
 
-    print(f"DEBUG: Returning from perform_linear_fit_sklearn_with_uncertainty: slope={slope}, slope_err={slope_err}, intercept={intercept}, intercept_err={intercept_err}, r_squared={r_squared}")
     return slope, slope_err, intercept, intercept_err, r_squared
 
 
-def calculate_fitting_parameters_v3(x_data_orig, y_data_orig, plot_type): # fit_origin は一旦削除
+def perform_linear_fit_with_uncertainty(x_numeric, y_numeric, fit_intercept=True):
     """
-    scikit-learnと提示された不確かさ計算を用いてフィッティング計算を行う。
+    十分統計量（平均と、平均まわりの平方和・積和）から閉形式で線形フィットを行い、
+    傾き、傾きの不確かさ、切片、切片の不確かさ、R^2 を返す。
+    scikit-learn の LinearRegression と同じ結果を、より少ない走査で求める（benchmarks/bench_fit.py で照合する）。
     """
-    x_transformed_np = x_data_orig.copy()
-    y_transformed_np = y_data_orig.copy()
-    valid_indices = np.ones(len(x_data_orig), dtype=bool)
+    x_numeric = np.asarray(x_numeric, dtype=float)
+    y_numeric = np.asarray(y_numeric, dtype=float)
+
+    min_points = 2 if fit_intercept else 1
+    if len(x_numeric) < min_points or len(x_numeric) != len(y_numeric):
+        return None, np.nan, None, np.nan, None
+
+    n = len(x_numeric)
+    x_mean = x_numeric.mean()
+    y_mean = y_numeric.mean()
+    if not (np.isfinite(x_mean) and np.isfinite(y_mean)):  # NaN/Infを含む
+        return None, np.nan, None, np.nan, None
 
-    fit_results = {
+    # 平均を引いてから積和を取ることで、桁落ちを抑える
+    x_dev = x_numeric - x_mean
+    y_dev = y_numeric - y_mean
+    sxx = float(x_dev @ x_dev)
+    sxy = float(x_dev @ y_dev)
+    syy = float(y_dev @ y_dev)
+
+    if fit_intercept:
+        return _ols_from_centered_sums(n, x_mean, y_mean, sxx, sxy, syy)
+
+    # 原点を通る直線: 傾き = Σxy / Σx^2、R^2 は平均まわりの全平方和に対して評価する
+    sum_xx = float(x_numeric @ x_numeric)
+    slope = float(x_numeric @ y_numeric) / sum_xx if sum_xx > 0 else 0.0
+    residuals = y_numeric - slope * x_numeric
+    ss_res = float(residuals @ residuals)
+    if syy > 0:
+        r_squared = 1.0 - ss_res / syy
+    else:
+        r_squared = 1.0 if ss_res == 0 else 0.0
+    return slope, np.nan, 0.0, np.nan, r_squared
+
+
+# フィット手法（UIの表示名 → 変換後の空間で直線フィットを行う関数）。
+# いずれも (傾き, 傾きの不確かさ, 切片, 切片の不確かさ, R^2) を返す
+FIT_METHODS = {
+    "最小二乗法": perform_linear_fit_with_uncertainty,
+    "Theil–Sen 推定": rf.theil_sen_fit,
+    "Huber 推定": rf.huber_fit,
+}
+DEFAULT_FIT_METHOD = "最小二乗法"
+# 変換せずに元の空間でモデルをフィットする手法（modules.nonlinear_fit）
+NONLINEAR_FIT_METHOD = "非線形最小二乗法"
+# UIで選べる手法の一覧
+FIT_METHOD_NAMES = [*FIT_METHODS, NONLINEAR_FIT_METHOD]
+
+
+def new_fit_results():
+    """フィッティング結果を格納する辞書を初期値で作成する"""
+    return {
         "slope_val": None, "slope_err": np.nan,
         "intercept_val": None, "intercept_err": np.nan,
         "A_val": None, "A_err": np.nan, # 指数/べき関数の係数とその誤差
         "B_val": None, "B_err": np.nan, # 指数/べき関数の指数部とその誤差
         "r_squared": None, "equation_latex": "", "equation_text": "",
         "x_transformed": None, "y_transformed": None,
-        "valid_indices": None, "error_message": None
+        "valid_indices": None, "error_message": None,
+        "fit_method": None,  # FIT_METHOD_NAMES の値
+        # 非線形最小二乗法の結果（モデル名、パラメータとその不確かさ・共分散行列、反復回数）
+        "model": None, "param_names": None, "params": None, "param_errors": None, "covariance": None,
+        "n_iterations": None,
+        "bootstrap": None,  # bootstrap_fit_parameters の結果（有効にした場合のみ）
     }
 
+
+def calculate_fitting_parameters_v3(x_data_orig, y_data_orig, plot_type, method=DEFAULT_FIT_METHOD,
+                                    model=None, warm_start=None): # fit_origin は一旦削除
+    """
+    十分統計量による閉形式の最小二乗法と、提示された不確かさ計算を用いてフィッティング計算を行う。
+    method に FIT_METHODS の外れ値に強い手法を指定した場合は、同じ変換後の空間でその手法でフィットする。
+    NONLINEAR_FIT_METHOD の場合は calculate_nonlinear_fit で元の空間で model をフィットする。
+    """
+    if method == NONLINEAR_FIT_METHOD:
+        return calculate_nonlinear_fit(x_data_orig, y_data_orig, plot_type, model, warm_start)
+
+    # 入力配列は書き換えないため複製しない（Dataset の配列は読み取り専用のビュー）
+    x_transformed_np = x_data_orig
+    y_transformed_np = y_data_orig
+    valid_indices = np.ones(len(x_data_orig), dtype=bool)
+
+    fit_results = new_fit_results()
+    fit_results["fit_method"] = method
+
     # データの対数変換
     if plot_type == "通常":
         pass
     elif plot_type == "片対数 (Y軸対数)":
         valid_indices = y_data_orig > 0
         if not np.any(valid_indices):
-            fit_results["error_message"] = "Y軸対数のため、正のYデータが必要です。"
+            fit_results["error_message"] = POSITIVE_DATA_ERROR_MESSAGES[plot_type]
             return fit_results
         y_transformed_np = np.log(y_data_orig[valid_indices])
         x_transformed_np = x_data_orig[valid_indices]
     elif plot_type == "片対数 (X軸対数)":
         valid_indices = x_data_orig > 0
         if not np.any(valid_indices):
-            fit_results["error_message"] = "X軸対数のため、正のXデータが必要です。"
+            fit_results["error_message"] = POSITIVE_DATA_ERROR_MESSAGES[plot_type]
             return fit_results
         x_transformed_np = np.log(x_data_orig[valid_indices])
         y_transformed_np = y_data_orig[valid_indices]
     elif plot_type == "両対数":
         valid_indices = (x_data_orig > 0) & (y_data_orig > 0)
         if not np.any(valid_indices):
-            fit_results["error_message"] = "両対数のため、正のXおよびYデータが必要です。"
+            fit_results["error_message"] = POSITIVE_DATA_ERROR_MESSAGES[plot_type]
             return fit_results
         x_transformed_np = np.log(x_data_orig[valid_indices])
         y_transformed_np = np.log(y_data_orig[valid_indices])
@@ -134,73 +216,608 @@ def calculate_fitting_parameters_v3(x_data_orig, y_data_orig, plot_type): # fit_
         return fit_results
 
     # フィット実行 (切片ありをデフォルトとする)
-    s_val, s_err, i_val, i_err, r_sq = \
-        perform_linear_fit_sklearn_with_uncertainty(x_transformed_np, y_transformed_np, fit_intercept=True)
+    s_val, s_err, i_val, i_err, r_sq = FIT_METHODS[method](x_transformed_np, y_transformed_np)
 
     if s_val is None: # ここで s_val が None になっているか確認
         if not fit_results["error_message"]: # 他のエラーがなければ
             fit_results["error_message"] = "フィット計算に失敗しました。"
-        print(f"DEBUG: s_val is None, returning with error message.")
         return fit_results
-    
 
+    return apply_linear_fit_parameters(fit_results, s_val, s_err, i_val, i_err, r_sq, plot_type)
+
+
+def apply_linear_fit_parameters(fit_results, s_val, s_err, i_val, i_err, r_sq, plot_type):
+    """
+    変換後の空間での傾き・切片（とその不確かさ）、R^2 を結果辞書に格納し、
+    グラフ種類に応じた A, B と近似式の文字列を設定する。
+    """
     fit_results.update({
         "slope_val": s_val, "slope_err": s_err,
         "intercept_val": i_val, "intercept_err": i_err,
         "r_squared": r_sq
     })
-    
-    # ±記号の後の誤差は、値が存在する場合のみ表示 (有効数字は仮)
-    s_e_str = f" \pm {s_err:.3f}" if not np.isnan(s_err) else ""
-    i_e_str = f" \pm {i_err:.3f}" if not np.isnan(i_err) else ""
 
-
-    if plot_type == "通常":
-        fit_results.update({
-            "B_val": s_val, "B_err": s_err, "A_val": i_val, "A_err": i_err,
-            "equation_text": f"y = ({s_val:.3f}{s_e_str})x + ({i_val:.3f}{i_e_str})",
-            "equation_latex": rf"$y = ({s_val:.3f}{s_e_str})x + ({i_val:.3f}{i_e_str})$"
-        })
-    elif plot_type == "片対数 (Y軸対数)": # intercept = ln(A), slope = B
+    if plot_type in ("片対数 (Y軸対数)", "両対数"): # intercept = ln(A), slope = B
         A_v = np.exp(i_val)
         # 誤差伝播: δA = A * δ(lnA) = A * i_err
         A_e = A_v * i_err if not np.isnan(i_err) else np.nan
-        B_v, B_e = s_val, s_err
-        
-        A_e_str = f" \pm {A_e:.1e}" if not np.isnan(A_e) else ""
-        B_e_str = f" \pm {B_e:.2f}" if not np.isnan(B_e) else ""
+    else: # 通常: y = Bx + A、片対数 (X軸対数): y = B ln(x) + A
+        A_v, A_e = i_val, i_err
+    B_v, B_e = s_val, s_err
 
+    if plot_type in PLOT_TYPES:
+        equation_text, equation_latex = format_ab_equation(A_v, A_e, B_v, B_e, plot_type)
         fit_results.update({
             "A_val": A_v, "A_err": A_e, "B_val": B_v, "B_err": B_e,
-            "equation_text": f"y = ({A_v:.2e}{A_e_str}) exp(({B_v:.2f}{B_e_str})x)",
-            "equation_latex": rf"$y = ({A_v:.2e}{A_e_str}) e^{{({B_v:.2f}{B_e_str})x}}$"
+            "equation_text": equation_text, "equation_latex": equation_latex
         })
-    elif plot_type == "片対数 (X軸対数)": # intercept = A (切片), slope = B (ln(x)の係数)
-        A_v, A_e = i_val, i_err
-        B_v, B_e = s_val, s_err
+    return fit_results
+
+
 
+def format_ab_equation(A_v, A_e, B_v, B_e, plot_type):
+    """グラフ種類に応じた形の近似式の (文字列, LaTeX) を、A, B とその不確かさから作る"""
+    # ±記号の後の誤差は、値が存在する場合のみ表示 (有効数字は仮)
+    if plot_type == "通常":
+        B_e_str = f" \pm {B_e:.3f}" if not np.isnan(B_e) else ""
+        A_e_str = f" \pm {A_e:.3f}" if not np.isnan(A_e) else ""
+        return (f"y = ({B_v:.3f}{B_e_str})x + ({A_v:.3f}{A_e_str})",
+                rf"$y = ({B_v:.3f}{B_e_str})x + ({A_v:.3f}{A_e_str})$")
+    if plot_type == "片対数 (X軸対数)":
         A_e_str = f" \pm {A_e:.2f}" if not np.isnan(A_e) else ""
         B_e_str = f" \pm {B_e:.2f}" if not np.isnan(B_e) else ""
-        fit_results.update({
-            "A_val": A_v, "A_err": A_e, "B_val": B_v, "B_err": B_e,
-            "equation_text": f"y = ({B_v:.2f}{B_e_str}) ln(x) + ({A_v:.2f}{A_e_str})",
-            "equation_latex": rf"$y = ({B_v:.2f}{B_e_str}) \ln(x) + ({A_v:.2f}{A_e_str})$"
-        })
-    elif plot_type == "両対数": # intercept = ln(A), slope = B
-        A_v = np.exp(i_val)
-        A_e = A_v * i_err if not np.isnan(i_err) else np.nan
-        B_v, B_e = s_val, s_err
+        return (f"y = ({B_v:.2f}{B_e_str}) ln(x) + ({A_v:.2f}{A_e_str})",
+                rf"$y = ({B_v:.2f}{B_e_str}) \ln(x) + ({A_v:.2f}{A_e_str})$")
 
-        A_e_str = f" \pm {A_e:.1e}" if not np.isnan(A_e) else ""
-        B_e_str = f" \pm {B_e:.2f}" if not np.isnan(B_e) else ""
+    A_e_str = f" \pm {A_e:.1e}" if not np.isnan(A_e) else ""
+    B_e_str = f" \pm {B_e:.2f}" if not np.isnan(B_e) else ""
+    if plot_type == "片対数 (Y軸対数)":
+        return (f"y = ({A_v:.2e}{A_e_str}) exp(({B_v:.2f}{B_e_str})x)",
+                rf"$y = ({A_v:.2e}{A_e_str}) e^{{({B_v:.2f}{B_e_str})x}}$")
+    # 両対数
+    return (f"y = ({A_v:.2e}{A_e_str}) x^({B_v:.2f}{B_e_str})",
+            rf"$y = ({A_v:.2e}{A_e_str}) x^{{({B_v:.2f}{B_e_str})}}$")
+
+
+def calculate_nonlinear_fit(x_data_orig, y_data_orig, plot_type, model=None, warm_start=None):
+    """
+    y を変換せずに、元の空間で model（nf.MODELS のキー。None ならグラフ種類の既定のモデル）を
+    非線形最小二乗法でフィットし、calculate_fitting_parameters_v3 と同じ形式の辞書を返す。
+    warm_start は前回の再実行で求めたパラメータ（あれば反復の初期値の候補にする）。
+    (A, B) のモデルでは A, B と、変換後の空間の傾き・切片に相当する値（指数・べき関数の切片は ln A）を設定する。
+    それ以外のモデルでは傾き・切片を NaN、A・B を None とし、パラメータは params に入る。
+    x_transformed, y_transformed にはフィットに使った元の空間の値を入れる。
+    """
+    model_name = model or nf.DEFAULT_MODELS[plot_type]
+    nl_model = nf.MODELS[model_name]
+    fit_results = new_fit_results()
+    fit_results.update({"fit_method": NONLINEAR_FIT_METHOD, "model": model_name,
+                        "param_names": nl_model.param_names})
+
+    x = np.asarray(x_data_orig, dtype=float)
+    y = np.asarray(y_data_orig, dtype=float)
+    valid_indices = nl_model.valid_mask(x) & np.isfinite(y)
+    if valid_indices.all():  # 入力配列は書き換えないため複製しない
+        x_fit, y_fit = x, y
+    else:
+        x_fit, y_fit = x[valid_indices], y[valid_indices]
+    fit_results.update({"x_transformed": x_fit, "y_transformed": y_fit, "valid_indices": valid_indices})
+    if len(x_fit) == 0:
+        fit_results["error_message"] = nl_model.domain_error or "フィットに使用できる有効なデータ点がありません。"
+        return fit_results
+
+    start = time.perf_counter()
+    solution = nf.fit_model(nl_model, x_fit, y_fit, warm_start)
+    if solution is None:
+        fit_results["error_message"] = "フィット計算に失敗しました。"
+        return fit_results
+    log_event("nonlinear_fit", model=model_name, n_points=len(x_fit), n_iterations=solution["n_iterations"],
+              start=solution["start"], converged=solution["converged"],
+              ms=round((time.perf_counter() - start) * 1e3, 3))
+
+    params, errors = solution["params"], solution["param_errors"]
+    fit_results.update({
+        "params": params, "param_errors": errors, "covariance": solution["covariance"],
+        "n_iterations": solution["n_iterations"], "r_squared": solution["r_squared"],
+    })
+    if nl_model.ab_plot_type is not None:
+        (A_v, B_v), (A_e, B_e) = params, errors
+        i_val, i_err = A_v, A_e
+        if nl_model.ab_plot_type in ("片対数 (Y軸対数)", "両対数"): # 変換後の空間の切片は ln(A)
+            i_val, i_err = (np.log(A_v), A_e / A_v) if A_v > 0 else (np.nan, np.nan)
+        equation_text, equation_latex = format_ab_equation(A_v, A_e, B_v, B_e, nl_model.ab_plot_type)
         fit_results.update({
+            "slope_val": B_v, "slope_err": B_e, "intercept_val": i_val, "intercept_err": i_err,
             "A_val": A_v, "A_err": A_e, "B_val": B_v, "B_err": B_e,
-            "equation_text": f"y = ({A_v:.2e}{A_e_str}) x^({B_v:.2f}{B_e_str})",
-            "equation_latex": rf"$y = ({A_v:.2e}{A_e_str}) x^{{({B_v:.2f}{B_e_str})}}$"
         })
-        
+    else:
+        equation_text, equation_latex = nl_model.equation(params, errors)
+        fit_results.update({"slope_val": np.nan, "intercept_val": np.nan})
+    fit_results.update({"equation_text": equation_text, "equation_latex": equation_latex})
     return fit_results
 
+
+class RangeFitIndex:
+    """
+    データをxで一度だけソートし、グラフ種類ごとの変換後の空間での
+    x, y, x^2, xy, y^2 の累積和を保持する。
+    任意のx範囲の最小二乗フィットを、二分探索2回と累積和の差分だけで求める。
+    外れ値に強い手法は累積和では求まらないため、ソート済みの変換後の配列から範囲の点を切り出してフィットする。
+    非線形最小二乗法では、ソート済みの元の空間の配列から範囲の点を切り出す。
+    """
+
+    def __init__(self, x_data_orig, y_data_orig, plot_type):
+        x = np.asarray(x_data_orig, dtype=float)
+        y = np.asarray(y_data_orig, dtype=float)
+        order = np.argsort(x, kind="stable")
+        x = x[order]
+        y = y[order]
+
+        # calculate_fitting_parameters_v3 と同じ条件で、対数変換できる点だけを有効とする
+        if plot_type == "片対数 (Y軸対数)":
+            valid = y > 0
+        elif plot_type == "片対数 (X軸対数)":
+            valid = x > 0
+        elif plot_type == "両対数":
+            valid = (x > 0) & (y > 0)
+        else:
+            valid = np.ones(len(x), dtype=bool)
+        x_t = np.where(valid, x, 0.0)
+        y_t = np.where(valid, y, 0.0)
+        if plot_type in ("片対数 (X軸対数)", "両対数"):
+            x_t = np.log(x, out=x_t, where=valid)
+        if plot_type in ("片対数 (Y軸対数)", "両対数"):
+            y_t = np.log(y, out=y_t, where=valid)
+
+        self.plot_type = plot_type
+        self._x_sorted = x
+        self._y_sorted = y
+        self._x_t = x_t
+        self._y_t = y_t
+        self._valid = valid
+
+        # 全体の平均でずらしてから累積和を取り、差分を取るときの桁落ちを抑える
+        n_valid = np.count_nonzero(valid)
+        self._x_shift = x_t[valid].mean() if n_valid else 0.0
+        self._y_shift = y_t[valid].mean() if n_valid else 0.0
+        u = np.where(valid, x_t - self._x_shift, 0.0)
+        v = np.where(valid, y_t - self._y_shift, 0.0)
+
+        def prefix(values):
+            return np.concatenate(([0.0], np.cumsum(values)))
+
+        self._c_n = np.concatenate(([0], np.cumsum(valid)))
+        self._c_u = prefix(u)
+        self._c_v = prefix(v)
+        self._c_uu = prefix(u * u)
+        self._c_uv = prefix(u * v)
+        self._c_vv = prefix(v * v)
+
+    def _bounds(self, x_min, x_max):
+        lo = np.searchsorted(self._x_sorted, x_min, side="left")
+        hi = np.searchsorted(self._x_sorted, x_max, side="right")
+        return int(lo), int(hi)
+
+    def count_in_range(self, x_min, x_max):
+        """x_min <= x <= x_max を満たすデータ点の数を返す"""
+        lo, hi = self._bounds(x_min, x_max)
+        return max(hi - lo, 0)
+
+    def fit(self, x_min, x_max, method=DEFAULT_FIT_METHOD, model=None, warm_start=None):
+        """
+        x_min <= x <= x_max のデータ点で method（FIT_METHOD_NAMES の値）のフィットを行い、
+        calculate_fitting_parameters_v3 と同じ形式の辞書を返す。
+        範囲内にデータ点が無い場合は None を返す。
+        直線フィットでは点ごとの配列は作らないため、x_transformed, y_transformed, valid_indices は None のままとなる。
+        """
+        lo, hi = self._bounds(x_min, x_max)
+        if hi <= lo:
+            return None
+        if method == NONLINEAR_FIT_METHOD:
+            return calculate_nonlinear_fit(self._x_sorted[lo:hi], self._y_sorted[lo:hi], self.plot_type,
+                                           model, warm_start)
+
+        fit_results = new_fit_results()
+        fit_results["fit_method"] = method
+        n = int(self._c_n[hi] - self._c_n[lo])
+        if n == 0:
+            fit_results["error_message"] = POSITIVE_DATA_ERROR_MESSAGES.get(
+                self.plot_type, "フィットに使用できる有効なデータ点がありません。"
+            )
+            return fit_results
+        if n < 2:
+            fit_results["error_message"] = "フィット計算に失敗しました。"
+            return fit_results
+
+        if method != DEFAULT_FIT_METHOD or hi - lo <= RANGE_FIT_DIRECT_MAX_POINTS:
+            valid = self._valid[lo:hi]
+            fit_params = FIT_METHODS[method](self._x_t[lo:hi][valid], self._y_t[lo:hi][valid])
+        else:
+            s_u = self._c_u[hi] - self._c_u[lo]
+            s_v = self._c_v[hi] - self._c_v[lo]
+            u_mean = s_u / n
+            v_mean = s_v / n
+            sxx = max(self._c_uu[hi] - self._c_uu[lo] - s_u * u_mean, 0.0)
+            sxy = self._c_uv[hi] - self._c_uv[lo] - s_u * v_mean
+            syy = max(self._c_vv[hi] - self._c_vv[lo] - s_v * v_mean, 0.0)
+            fit_params = _ols_from_centered_sums(
+                n, self._x_shift + u_mean, self._y_shift + v_mean, sxx, sxy, syy
+            )
+
+        s_val, s_err, i_val, i_err, r_sq = fit_params
+        if s_val is None:
+            fit_results["error_message"] = "フィット計算に失敗しました。"
+            return fit_results
+        return apply_linear_fit_parameters(fit_results, s_val, s_err, i_val, i_err, r_sq, self.plot_type)
+
+
+def freeze_fit_results(fit_results):
+    """
+    フィット結果を書き換えできない辞書（MappingProxyType）にして返す。配列も読み取り専用にする。
+    値を追加する場合は {**fit_results, "key": value} のように複製する。None はそのまま返す。
+    """
+    if fit_results is None or isinstance(fit_results, MappingProxyType):
+        return fit_results
+    frozen = {}
+    for key, value in fit_results.items():
+        if isinstance(value, np.ndarray) and value.flags.writeable:
+            value = value.view()
+            value.flags.writeable = False
+        frozen[key] = value
+    return MappingProxyType(frozen)
+
+
+def cached_fit(data_key, plot_type, x_range, compute, method=DEFAULT_FIT_METHOD, model=None):
+    """
+    フィット結果を、プロセス全体（すべてのセッション）で共有するキャッシュから返す。
+    キー (data_key, plot_type, x_range, method, model) の結果が無ければ compute() で計算して格納する。
+    x_range は範囲フィットの (最小, 最大)、全データのフィットでは None。
+    data_key が None の場合はキャッシュを使わない。結果は freeze_fit_results で書き換えできなくする。
+    """
+    if data_key is None:
+        return freeze_fit_results(compute())
+    key = (data_key, plot_type, x_range, method, model)
+    cached = _fit_cache.get(key, _MISSING)
+    if cached is not _MISSING:
+        return cached
+    result = freeze_fit_results(compute())
+    _fit_cache.put(key, result)
+    return result
+
+
+def get_fit_cache_stats():
+    """フィット結果キャッシュのヒット数・ミス数・エントリ数などを返す"""
+    return _fit_cache.stats()
+
+
+def fit_multiple_series(x_data_orig, y_data_matrix, plot_type, series_names=None, method=DEFAULT_FIT_METHOD,
+                        model=None):
+    """
+    1つのxと複数のy（y_data_matrix の各列）を、行列演算でまとめて直線フィットする。
+    NaN と対数変換できない点は系列ごとのマスクで除き、各系列を calculate_fitting_parameters_v3 に
+    その系列の有効な点だけを渡した場合と同じ値を求める。
+    外れ値に強い手法（method）では、系列ごとに有効な点を切り出してフィットする。
+    非線形最小二乗法では、系列ごとに NaN を除いた点を calculate_nonlinear_fit に渡す。
+    戻り値は系列ごとに1行の pandas.DataFrame（列は series, n_points, slope, ..., equation, error）。
+    """
+    import pandas as pd
+
+    x = np.asarray(x_data_orig, dtype=float)
+    y = np.asarray(y_data_matrix, dtype=float)
+    if y.ndim == 1:
+        y = y[:, np.newaxis]
+    n_series = y.shape[1]
+    if series_names is None:
+        series_names = [f"y{i + 1}" for i in range(n_series)]
+    if method == NONLINEAR_FIT_METHOD:
+        rows = []
+        for i in range(n_series):
+            finite = np.isfinite(x) & np.isfinite(y[:, i])
+            result = calculate_nonlinear_fit(x[finite], y[finite, i], plot_type, model)
+            failed = result["error_message"] is not None
+            row = {"series": series_names[i], "n_points": int(np.count_nonzero(result["valid_indices"]))}
+            for column, key in (("slope", "slope_val"), ("slope_err", "slope_err"),
+                                ("intercept", "intercept_val"), ("intercept_err", "intercept_err"),
+                                ("A", "A_val"), ("A_err", "A_err"), ("B", "B_val"), ("B_err", "B_err"),
+                                ("r_squared", "r_squared")):
+                value = result[key]
+                row[column] = np.nan if failed or value is None else float(value)
+            row["equation"] = None if failed else result["equation_text"]
+            row["error"] = result["error_message"]
+            rows.append(row)
+        return pd.DataFrame(rows).astype({"equation": object, "error": object})
+    log_x = plot_type in ("片対数 (X軸対数)", "両対数")
+    log_y = plot_type in ("片対数 (Y軸対数)", "両対数")
+
+    # 系列ごとの有効な点のマスク
+    x_valid = np.isfinite(x)
+    has_finite = (x_valid[:, np.newaxis] & np.isfinite(y)).any(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if log_x:
+            x_valid &= x > 0
+            x_t = np.log(x)
+        else:
+            x_t = x
+        y_valid = y > 0 if log_y else np.isfinite(y)  # NaN は比較で False になる
+        y_t = np.log(y) if log_y else y
+    valid = y_valid & x_valid[:, np.newaxis]
+    n = valid.sum(axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # xは全系列で共通のため、全体の平均だけずらした値の和と二乗和を行列積1回で求める
+        x_shift = x_t[x_valid].mean() if x_valid.any() else 0.0
+        x_c = np.where(x_valid, x_t - x_shift, 0.0)
+        s_x, s_xx = np.stack([x_c, x_c * x_c]) @ valid
+        x_mean_c = s_x / n
+        x_mean = x_shift + x_mean_c
+        sxx = np.maximum(s_xx - s_x * x_mean_c, 0.0)
+
+        # yは系列ごとの平均を引いた偏差から積和を取り、桁落ちを抑える（無効な点の偏差は0）
+        y_dev = np.where(valid, y_t, 0.0)
+        y_mean = y_dev.sum(axis=0) / n
+        y_dev -= y_mean
+        y_dev *= valid
+        syy = np.einsum("ij,ij->j", y_dev, y_dev)
+        sxy = x_c @ y_dev  # 有効な点の y_dev の和は0のため、xの平均を引く必要がない
+
+        # _ols_from_centered_sums と同じ規則を系列ごとに適用する
+        slope = np.where(sxx > 0, sxy / sxx, 0.0)
+        intercept = y_mean - slope * x_mean
+        ss_res = np.maximum(syy - slope * sxy, 0.0)
+        r_squared = np.where(syy > 0, 1.0 - ss_res / syy, np.where(ss_res == 0, 1.0, 0.0))
+        has_err = (n > 2) & (sxx > 0)
+        std_error_of_residuals = np.sqrt(ss_res / np.where(has_err, n - 2, 1))
+        slope_err = np.where(has_err, std_error_of_residuals / np.sqrt(sxx), np.nan)
+        intercept_err = np.where(
+            has_err, std_error_of_residuals * np.sqrt(1 / n + x_mean**2 / np.where(sxx > 0, sxx, 1.0)), np.nan
+        )
+
+    if method != DEFAULT_FIT_METHOD:
+        for i in np.flatnonzero(n >= 2):
+            column = valid[:, i]
+            slope[i], slope_err[i], intercept[i], intercept_err[i], r_squared[i] = \
+                FIT_METHODS[method](x_t[column], y_t[column, i])
+
+    if log_y:  # intercept = ln(A), slope = B
+        A_val = np.exp(intercept)
+        A_err = A_val * intercept_err
+    else:
+        A_val, A_err = intercept, intercept_err
+
+    # エラーメッセージと近似式の文字列（系列数ぶんの書式化のみ）
+    errors = np.full(n_series, None, dtype=object)
+    errors[n < 2] = "フィット計算に失敗しました。"
+    errors[n == 0] = "フィットに使用できる有効なデータ点がありません。"
+    if plot_type in POSITIVE_DATA_ERROR_MESSAGES:
+        errors[(n == 0) & has_finite] = POSITIVE_DATA_ERROR_MESSAGES[plot_type]
+    failed = n < 2
+    equations = np.full(n_series, None, dtype=object)
+    for i in np.flatnonzero(~failed):
+        equations[i] = apply_linear_fit_parameters(
+            new_fit_results(), float(slope[i]), float(slope_err[i]), float(intercept[i]),
+            float(intercept_err[i]), float(r_squared[i]), plot_type
+        )["equation_text"]
+
+    def values(arr):  # フィットできなかった系列の数値は NaN にする
+        return np.where(failed, np.nan, arr)
+
+    return pd.DataFrame({
+        "series": list(series_names), "n_points": n,
+        "slope": values(slope), "slope_err": values(slope_err),
+        "intercept": values(intercept), "intercept_err": values(intercept_err),
+        "A": values(A_val), "A_err": values(A_err), "B": values(slope), "B_err": values(slope_err),
+        "r_squared": values(r_squared),
+        # 成功した系列の error を None のまま保つため、文字列の列は object 型にする
+        "equation": pd.Series(equations, dtype=object), "error": pd.Series(errors, dtype=object),
+    })
+
+
+def _bootstrap_chunk(x_t, y_t, seed_seq, n_resamples):
+    """
+    再標本のインデックスを (n_resamples, 点数) の行列として一度に生成し、
+    各行の直線フィットの傾きと切片をまとめて計算する。xが一定になった再標本は NaN とする。
+    """
+    rng = np.random.default_rng(seed_seq)
+    n = len(x_t)
+    indices = rng.integers(0, n, size=(n_resamples, n), dtype=np.int32 if n < 2**31 else np.int64)
+    x_b = x_t[indices]
+    y_b = y_t[indices]
+    x_mean = x_b.mean(axis=1)
+    y_mean = y_b.mean(axis=1)
+    x_b -= x_mean[:, np.newaxis]
+    y_b -= y_mean[:, np.newaxis]
+    sxx = np.einsum("ij,ij->i", x_b, x_b)
+    sxy = np.einsum("ij,ij->i", x_b, y_b)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = np.where(sxx > 0, sxy / sxx, np.nan)
+    return slope, y_mean - slope * x_mean
+
+
+def _bootstrap_chunk_shared(name, n, seed_seq, n_resamples):
+    """
+    プールのプロセスで、共有メモリ name のデータ点 (x, y) から再標本の塊を計算する。
+    共有メモリは塊ごとに開いて閉じる（親プロセスが消した後まで開いたままにしない）。
+    """
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        data = np.ndarray((2, n), dtype=float, buffer=shm.buf)
+        result = _bootstrap_chunk(data[0], data[1], seed_seq, n_resamples)
+        del data  # 配列が共有メモリを参照している間は閉じられない
+    finally:
+        shm.close()
+    return result
+
+
+def _get_bootstrap_pool():
+    """プロセス全体で共有するブートストラップ用のプロセスプール（最初の呼び出しで起動する）"""
+    global _bootstrap_pool
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    with _bootstrap_pool_lock:
+        if _bootstrap_pool is None:
+            # Streamlitのサーバープロセスから fork しないよう spawn で起動する
+            _bootstrap_pool = ProcessPoolExecutor(max_workers=BOOTSTRAP_POOL_WORKERS,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+        return _bootstrap_pool
+
+
+def _discard_bootstrap_pool(executor):
+    """プロセスが異常終了して使えなくなったプールを捨てる（次の呼び出しで起動し直す）"""
+    global _bootstrap_pool
+    with _bootstrap_pool_lock:
+        if _bootstrap_pool is executor:
+            _bootstrap_pool = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _bootstrap_chunks_in_pool(x_t, y_t, chunks, deadline, workers):
+    """
+    再標本の塊を共有のプロセスプールで計算し、制限時間までに終わった結果を返す。
+    データ点は共有メモリに一度だけ書き込み、塊ごとには (乱数列, 再標本数) だけを送る。
+    同時に投入する塊は workers 個までとし、他のセッションの計算もプールを使えるようにする。
+    共有メモリは、取り消せなかった塊（実行中または実行待ちの列にあるもの）が終わってから消す。
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+    from concurrent.futures.process import BrokenProcessPool
+    from multiprocessing import shared_memory
+
+    n = len(x_t)
+    executor = _get_bootstrap_pool()
+    shm = shared_memory.SharedMemory(create=True, size=2 * n * np.dtype(float).itemsize)
+    results = {}
+    pending = {}
+    try:
+        data = np.ndarray((2, n), dtype=float, buffer=shm.buf)
+        data[0], data[1] = x_t, y_t
+        del data
+        queued = iter(enumerate(chunks))
+        timed_out = False
+        while True:
+            if not timed_out:
+                for i, (seed_seq, size) in queued:
+                    pending[executor.submit(_bootstrap_chunk_shared, shm.name, n, seed_seq, size)] = i
+                    if len(pending) >= workers:
+                        break
+            if not pending:
+                break
+            timeout = None if deadline is None else max(deadline - time.perf_counter(), 0.0)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:  # 制限時間切れ（少なくとも1つの結果は待つ）
+                if results:
+                    break
+                timed_out = True
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+            if timed_out:
+                break
+    except BrokenProcessPool:
+        _discard_bootstrap_pool(executor)
+        raise
+    finally:
+        _release_when_done(shm, [future for future in pending if not future.cancel()])
+    return [results[i] for i in sorted(results)]
+
+
+def _release_when_done(shm, futures):
+    """futures がすべて終わったら共有メモリを閉じて消す（待たずに戻る）"""
+    def release():
+        shm.close()
+        shm.unlink()
+
+    if not futures:
+        release()
+        return
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            release()
+
+    for future in futures:
+        future.add_done_callback(on_done)
+
+
+def bootstrap_fit_parameters(x_transformed, y_transformed, plot_type, n_resamples=BOOTSTRAP_DEFAULT_RESAMPLES,
+                             confidence=0.95, seed=0, time_budget_s=None, workers=1):
+    """
+    変換後の空間のデータ点を復元抽出した再標本で直線フィットを繰り返し、
+    傾き・切片と A, B のパーセンタイル信頼区間を求める（ブートストラップ法）。
+    seed が同じなら、再標本は計算の分割方法やプロセス数によらず同じになる。
+    time_budget_s を超えた場合は、それまでに計算した再標本だけで区間を求める（truncated=True）。
+    workers と BOOTSTRAP_POOL_WORKERS がともに2以上で、点数が BOOTSTRAP_POOL_MIN_POINTS 以上の場合は、
+    共有のプロセスプールで分割して計算する（同時に計算する塊は workers 個まで）。
+    点数が3未満の場合は None を返す。
+    """
+    x_t = np.ascontiguousarray(x_transformed, dtype=float)
+    y_t = np.ascontiguousarray(y_transformed, dtype=float)
+    n = len(x_t)
+    if n < 3 or len(y_t) != n:
+        return None
+
+    start = time.perf_counter()
+    deadline = None if time_budget_s is None else start + time_budget_s
+
+    # 塊の大きさは点数だけで決め、塊ごとに独立した乱数列を割り当てる
+    chunk_size = max(1, min(n_resamples, BOOTSTRAP_CHUNK_ELEMENTS // n))
+    sizes = [chunk_size] * (n_resamples // chunk_size)
+    if n_resamples % chunk_size:
+        sizes.append(n_resamples % chunk_size)
+    chunks = list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+
+    workers = min(workers or 1, BOOTSTRAP_POOL_WORKERS)
+    if workers > 1 and n >= BOOTSTRAP_POOL_MIN_POINTS and len(chunks) > 1:
+        results = _bootstrap_chunks_in_pool(x_t, y_t, chunks, deadline, workers)
+    else:
+        results = []
+        for seed_seq, size in chunks:
+            results.append(_bootstrap_chunk(x_t, y_t, seed_seq, size))
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+
+    slopes = np.concatenate([r[0] for r in results])
+    intercepts = np.concatenate([r[1] for r in results])
+    ok = np.isfinite(slopes) & np.isfinite(intercepts)
+    slopes, intercepts = slopes[ok], intercepts[ok]
+
+    # A, B は apply_linear_fit_parameters と同じ対応（指数・べき関数では A = exp(切片)）
+    if plot_type in ("片対数 (Y軸対数)", "両対数"):
+        A_samples = np.exp(intercepts)
+    else:
+        A_samples = intercepts
+
+    alpha = (1.0 - confidence) / 2.0
+    quantiles = [alpha, 1.0 - alpha]
+
+    def interval(samples):
+        if len(samples) < 2:
+            return (np.nan, np.nan)
+        low, high = np.quantile(samples, quantiles)
+        return (float(low), float(high))
+
+    elapsed = time.perf_counter() - start
+    result = {
+        "n_resamples": int(len(slopes)), "requested_resamples": n_resamples,
+        "confidence": confidence, "seed": seed,
+        "truncated": sum(len(r[0]) for r in results) < n_resamples,
+        "elapsed_s": elapsed,
+        "slope_ci": interval(slopes), "intercept_ci": interval(intercepts),
+        "A_ci": interval(A_samples), "B_ci": interval(slopes),
+        "slope_se": float(np.std(slopes, ddof=1)) if len(slopes) > 1 else np.nan,
+        "intercept_se": float(np.std(intercepts, ddof=1)) if len(intercepts) > 1 else np.nan,
+    }
+    log_event("bootstrap", n_points=n, n_resamples=result["n_resamples"], truncated=result["truncated"],
+              ms=round(elapsed * 1e3, 3))
+    return result
+
+
 def get_fit_equation_string(fit_results, plot_type):
     """
     近似式の凡例用の文字列を生成する。
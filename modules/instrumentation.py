@@ -0,0 +1,105 @@
+# modules/instrumentation.py
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# ログレベルは環境変数 STREAM_LOG_LEVEL で変更できる（既定は INFO）
+logger = logging.getLogger("stream")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(os.environ.get("STREAM_LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """イベント名と任意の項目を、1行のJSONとしてログに出力する"""
+    if not logger.isEnabledFor(level):
+        return
+    record = {"ts": round(time.time(), 3), "event": event, **fields}
+    logger.log(level, json.dumps(record, ensure_ascii=False, default=str))
+
+
+# メモリ割り当ての計測（tracemalloc）はプロセス全体で共有されるため、セッションごとには切り替えず、
+# 環境変数 STREAM_TRACE_ALLOCATIONS=1 で起動した場合だけ有効にする（すべての処理が遅くなる）
+TRACE_ALLOCATIONS = os.environ.get("STREAM_TRACE_ALLOCATIONS", "0") not in ("", "0")
+if TRACE_ALLOCATIONS and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+# 計測中の段階の数と、段階が重なった回数。割り当てとピークはプロセス全体の値のため、
+# 他のセッションや計算プールの段階と重なった段階では記録しない
+_traced_lock = threading.Lock()
+_traced_active = 0
+_traced_overlaps = 0
+
+
+class RerunTimings:
+    """
+    1回の再実行について、処理段階ごとの経過時間と（有効な場合は）メモリ割り当てを記録する。
+    メモリ割り当ては trace_allocations=True で、かつ STREAM_TRACE_ALLOCATIONS で計測を有効にした場合だけ記録する。
+    """
+
+    def __init__(self, trace_allocations=False):
+        self.trace_allocations = trace_allocations and tracemalloc.is_tracing()
+        self.stages = []
+        self.finished = False
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """with ブロック内の処理を name という段階として計測する"""
+        global _traced_active, _traced_overlaps
+        if self.trace_allocations:
+            with _traced_lock:
+                _traced_active += 1
+                alone = _traced_active == 1
+                if alone:
+                    tracemalloc.reset_peak()
+                else:
+                    _traced_overlaps += 1
+                overlaps = _traced_overlaps
+                before, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {"stage": name, "ms": round((time.perf_counter() - start) * 1e3, 3)}
+            if self.trace_allocations:
+                with _traced_lock:
+                    current, peak = tracemalloc.get_traced_memory()
+                    _traced_active -= 1
+                    overlapped = not alone or overlaps != _traced_overlaps
+                record["alloc_kb"] = None if overlapped else round((current - before) / 1024, 1)
+                record["peak_kb"] = None if overlapped else round((peak - before) / 1024, 1)
+            self.stages.append(record)
+
+    def finish(self, **fields):
+        """再実行全体の経過時間を確定し、構造化ログを出力して記録内容を返す"""
+        summary = {
+            "total_ms": round((time.perf_counter() - self._started) * 1e3, 3),
+            "stages": self.stages,
+            **fields,
+        }
+        self.finished = True
+        log_event("rerun", **summary)
+        return summary
+
+
+@contextmanager
+def fragment_timings(timings, scope):
+    """
+    フラグメント内の計測。スクリプト全体の再実行中は timings にそのまま記録し、
+    フラグメントだけの再実行（timings は前回の計測で確定済み）では新しく計測して scope として記録する。
+    """
+    if not timings.finished:
+        yield timings
+        return
+    own = RerunTimings(trace_allocations=timings.trace_allocations)
+    yield own
+    own.finish(scope=scope)
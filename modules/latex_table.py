@@ -0,0 +1,96 @@
+# modules/latex_table.py
+
+# この行数を超える表は、ページに埋め込まずファイルとしてダウンロードさせる
+LATEX_INLINE_MAX_ROWS = 1000
+# ジェネレーターが1回に返す行数
+LATEX_CHUNK_ROWS = 10_000
+
+
+def _column_strings(df, col_name, common_dtype):
+    """
+    列の値を文字列のリストに変換する。
+    従来の iterrows + str() と同じ表記になるよう、全列に共通するdtypeへ揃えてから変換する。
+    """
+    values = df[col_name].to_numpy(dtype=common_dtype)
+    # tolist() でPythonのfloat/intにしてから str() する方が ndarray.astype(str) より速い
+    return list(map(str, values.tolist()))
+
+
+def _header_lines(x_header, y_header):
+    return [
+        "\\hline\\hline",
+        f"{x_header} & {y_header} \\\\",  # LaTeXの改行は \\
+        "\\hline",
+    ]
+
+
+def _table_begin_lines(longtable, x_header, y_header):
+    if not longtable:
+        return [
+            "\\begin{tabular}{cc}",
+            "\\label{tab:table_label}",
+            "\\caption{string}",
+            "\\centering",
+            *_header_lines(x_header, y_header),
+        ]
+    # longtable はページをまたぐ場合に見出しを各ページの先頭に繰り返す
+    return [
+        "\\begin{longtable}{cc}",
+        "\\caption{string}",
+        "\\label{tab:table_label} \\\\",
+        *_header_lines(x_header, y_header),
+        "\\endfirsthead",
+        *_header_lines(x_header, y_header),
+        "\\endhead",
+        "\\hline\\hline",
+        "\\endlastfoot",
+    ]
+
+
+def _table_end_lines(longtable):
+    if longtable:
+        return ["\\end{longtable}"]
+    return ["\\hline\\hline", "\\end{tabular}"]
+
+
+def iter_latex_table(df, x_col_name='x', y_col_name='y', x_header='$x$', y_header='$y$',
+                     longtable=False, rows_per_table=None, chunk_rows=LATEX_CHUNK_ROWS):
+    """
+    DataFrameをLaTeXの表に変換し、数千行ずつの文字列として順に返すジェネレーター。
+    longtable=True の場合は longtable 環境で出力する。
+    rows_per_table を指定すると、tabular をその行数ごとに分割して出力する（longtable では無視）。
+    """
+    if df is None or df.empty:
+        return
+
+    common_dtype = df.iloc[:0].to_numpy().dtype
+    x_strings = _column_strings(df, x_col_name, common_dtype)
+    y_strings = _column_strings(df, y_col_name, common_dtype)
+    n_rows = len(x_strings)
+
+    if longtable or not rows_per_table:
+        rows_per_table = n_rows
+    begin = "\n".join(_table_begin_lines(longtable, x_header, y_header)) + "\n"
+    end = "\n".join(_table_end_lines(longtable))
+
+    for table_start in range(0, n_rows, rows_per_table):
+        table_stop = min(table_start + rows_per_table, n_rows)
+        yield begin if table_start == 0 else "\n\n" + begin
+        for start in range(table_start, table_stop, chunk_rows):
+            stop = min(start + chunk_rows, table_stop)
+            yield "".join(
+                f"{x_val} & {y_val} \\\\\n" for x_val, y_val in zip(x_strings[start:stop], y_strings[start:stop])
+            )
+        yield end
+
+
+def generate_latex_table(df, x_col_name='x', y_col_name='y', x_header='$x$', y_header='$y$',
+                         longtable=False, rows_per_table=None):
+    """
+    DataFrameをLaTeXの表の文字列に変換する。
+    x_header, y_header はLaTeXで表示する列名。
+    """
+    return "".join(iter_latex_table(
+        df, x_col_name, y_col_name, x_header, y_header, longtable=longtable, rows_per_table=rows_per_table
+    ))
+
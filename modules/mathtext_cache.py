@@ -0,0 +1,50 @@
+# modules/mathtext_cache.py
+"""
+数式（mathtext）の解析・レイアウト結果を、すべての figure で共有するキャッシュ。
+
+matplotlib はレンダラーごとに MathTextParser を作るため、figure を作り直すたびに
+凡例の近似式や軸ラベル・対数軸の目盛りの数式を pyparsing で解析し直している
+（matplotlib 自身のキャッシュはパーサーごとで、全体で50件しかない）。
+CachedMathtextCanvas で描画すると、レンダラーが共有のパーサーを使い、
+同じ文字列・フォント・解像度の数式は2回目以降に解析を省略できる。
+
+matplotlib を読み込むため、plot_generator からは最初にグラフを描画するときに読み込む。
+"""
+import functools
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.mathtext import MathTextParser
+
+# 共有キャッシュの上限件数。1つのグラフの数式は、画面表示と画像書き出しの解像度ごとに数十件程度
+MATHTEXT_CACHE_SIZE = 1024
+
+
+class SharedMathTextParser(MathTextParser):
+    """解析結果を（パーサーごとではなく）文字列・解像度・フォントをキーにキャッシュするパーサー"""
+
+    def parse(self, s, dpi=72, prop=None, *, antialiased=None):
+        # FontProperties は変更可能なため、キーには複製を使う
+        return self._parse_shared(s, dpi, None if prop is None else prop.copy(), antialiased)
+
+    @functools.lru_cache(MATHTEXT_CACHE_SIZE)
+    def _parse_shared(self, s, dpi, prop, antialiased):
+        return super().parse(s, dpi, prop, antialiased=antialiased)
+
+
+# レイアウト結果は変更されずに参照されるだけなので、スレッド（セッション）間で共有できる
+mathtext_parser = SharedMathTextParser('path')
+
+
+class CachedMathtextCanvas(FigureCanvasAgg):
+    """数式の解析に共有パーサーを使う Agg キャンバス（画面表示と PNG 書き出し）"""
+
+    def get_renderer(self):
+        renderer = super().get_renderer()
+        renderer.mathtext_parser = mathtext_parser
+        return renderer
+
+
+def cache_stats():
+    """共有キャッシュのヒット数・ミス数・エントリ数を返す"""
+    info = SharedMathTextParser._parse_shared.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "entries": info.currsize, "max_entries": info.maxsize}
@@ -0,0 +1,303 @@
+# modules/nonlinear_fit.py
+"""
+元の空間（x, y を対数変換しない）での非線形最小二乗法。
+指数関数・べき関数などを対数変換して直線フィットすると、誤差の重みが変わるため A, B に偏りが出て、
+y が0以下の点も使えない。ここでは y の残差平方和を Levenberg–Marquardt 法で直接最小化する。
+
+モデルは関数値とヤコビアン（パラメータによる偏微分）を配列演算で計算する関数の組で、
+MODELS に登録する。利用者のモデルも register_model で追加できる（数式の文字列は評価しない）。
+初期値は、線形化したフィットの解と、前回の再実行で求めたパラメータ（warm_start）のうち残差の小さい方を使う。
+"""
+import numpy as np
+
+# Levenberg–Marquardt 法の反復（ヤコビアンの計算）の最大回数と収束の判定
+NL_MAX_ITER = 200
+NL_XTOL = 1.5e-8  # パラメータの相対的な変化（scipy.optimize.least_squares の既定値と同じ sqrt(eps)）
+NL_FTOL = 1.5e-8  # 残差平方和の相対的な減少
+# 減衰係数の初期値（列を正規化したヤコビアンに対する値）と、ステップが採用されなかったときの上限
+NL_INITIAL_DAMPING = 1e-6
+NL_MAX_DAMPING = 1e16
+# この比より小さい特異値は0とみなし、共分散を求めない（パラメータが決まらない）
+NL_SINGULAR_RTOL = 1e-12
+
+
+class NonlinearModel:
+    """
+    y = function(x, params) のモデル。
+    jacobian(x, params) は (点数, パラメータ数) の偏微分の行列、initial_guess(x, y) は線形化したフィットの解、
+    domain(x) は使える点のマスク（None ならすべて）、equation(params, errors) は (文字列, LaTeX) を返す。
+    ab_plot_type は、パラメータ (A, B) の意味と近似式の形が同じグラフ種類（それ以外のモデルは None）。
+    """
+
+    __slots__ = ("name", "param_names", "function", "jacobian", "initial_guess", "domain", "equation",
+                 "ab_plot_type", "domain_error")
+
+    def __init__(self, name, param_names, function, jacobian, initial_guess, domain=None, equation=None,
+                 ab_plot_type=None, domain_error=None):
+        self.name = name
+        self.param_names = tuple(param_names)
+        self.function = function
+        self.jacobian = jacobian
+        self.initial_guess = initial_guess
+        self.domain = domain
+        self.equation = equation or _generic_equation(name, self.param_names)
+        self.ab_plot_type = ab_plot_type
+        self.domain_error = domain_error
+
+    def predict(self, x, params):
+        """モデルの値。定義域の外やオーバーフローした点は NaN/Inf になる"""
+        with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+            return np.asarray(self.function(np.asarray(x, dtype=float), np.asarray(params, dtype=float)),
+                              dtype=float)
+
+    def valid_mask(self, x):
+        """モデルを計算できる点のマスク"""
+        mask = np.isfinite(x)
+        if self.domain is not None:
+            mask &= self.domain(x)
+        return mask
+
+
+def _generic_equation(name, param_names):
+    def equation(params, errors):
+        terms = [(n, v, e) for n, v, e in zip(param_names, params, errors)]
+        text = ", ".join(f"{n} = {v:.3g}" + (f" ± {e:.2g}" if np.isfinite(e) else "") for n, v, e in terms)
+        latex = ", ".join(f"{n} = {v:.3g}" + (rf" \pm {e:.2g}" if np.isfinite(e) else "") for n, v, e in terms)
+        return f"{name}: {text}", f"${latex}$"
+    return equation
+
+
+def _line(x, y):
+    """直線 y = a + b x の最小二乗解 (a, b)。x が一定なら傾き0"""
+    x_mean, y_mean = x.mean(), y.mean()
+    x_dev = x - x_mean
+    sxx = float(x_dev @ x_dev)
+    slope = float(x_dev @ (y - y_mean)) / sxx if sxx > 0 else 0.0
+    return y_mean - slope * x_mean, slope
+
+
+def _log_linear_guess(u, y):
+    """
+    y = A exp(B u) を ln|y| = ln|A| + B u と線形化した解。y の符号が多い方の点を使う
+    （対数変換したフィットと同じ解。使える点が2点未満なら A = 平均, B = 0）
+    """
+    positive = y > 0
+    negative = y < 0
+    sign = 1.0 if np.count_nonzero(positive) >= np.count_nonzero(negative) else -1.0
+    use = positive if sign > 0 else negative
+    if np.count_nonzero(use) < 2:
+        return np.array([y.mean(), 0.0])
+    intercept, slope = _line(u[use], np.log(sign * y[use]))
+    return np.array([sign * np.exp(intercept), slope])
+
+
+def _positive_x(x):
+    return x > 0
+
+
+def _line_function(x, p):
+    return p[0] + p[1] * x
+
+
+def _line_jacobian(x, p):
+    return np.column_stack([np.ones_like(x), x])
+
+
+def _exp_function(x, p):
+    return p[0] * np.exp(p[1] * x)
+
+
+def _exp_jacobian(x, p):
+    e = np.exp(p[1] * x)
+    return np.column_stack([e, p[0] * x * e])
+
+
+def _power_function(x, p):
+    return p[0] * x ** p[1]
+
+
+def _power_jacobian(x, p):
+    xb = x ** p[1]
+    return np.column_stack([xb, p[0] * xb * np.log(x)])
+
+
+def _log_function(x, p):
+    return p[0] + p[1] * np.log(x)
+
+
+def _log_jacobian(x, p):
+    return np.column_stack([np.ones_like(x), np.log(x)])
+
+
+def polynomial_model(degree):
+    """y = c0 + c1 x + ... + c_degree x^degree（パラメータについて線形なので1回の反復で収束する）"""
+    names = [f"c{k}" for k in range(degree + 1)]
+
+    def initial_guess(x, y):
+        if len(x) <= degree:
+            return np.zeros(degree + 1)
+        return np.polynomial.polynomial.polyfit(x, y, degree)
+
+    def equation(params, errors):
+        text_terms, latex_terms = [], []
+        for k, (v, e) in enumerate(zip(params, errors)):
+            power = "" if k == 0 else ("x" if k == 1 else f"x^{k}")
+            latex_power = "" if k == 0 else ("x" if k == 1 else f"x^{{{k}}}")
+            text_terms.append(f"({v:.3g}" + (f" ± {e:.2g}" if np.isfinite(e) else "") + f"){power}")
+            latex_terms.append(f"({v:.3g}" + (rf" \pm {e:.2g}" if np.isfinite(e) else "") + f"){latex_power}")
+        return "y = " + " + ".join(text_terms), "$y = " + " + ".join(latex_terms) + "$"
+
+    return NonlinearModel(
+        f"{degree}次多項式", names,
+        lambda x, p: np.polynomial.polynomial.polyval(x, p),
+        lambda x, p: np.vander(x, degree + 1, increasing=True),
+        initial_guess, equation=equation,
+    )
+
+
+# 登録されたモデル（UIの表示名 → NonlinearModel）
+MODELS = {}
+
+
+def register_model(name, param_names, function, jacobian, initial_guess, domain=None, equation=None,
+                   domain_error=None):
+    """
+    利用者のモデルを登録して返す。function(x, params) と jacobian(x, params) は配列演算で計算すること。
+    同じ名前のモデルがすでにある場合は ValueError。
+    """
+    if name in MODELS:
+        raise ValueError(f"モデル「{name}」はすでに登録されています。")
+    model = NonlinearModel(name, param_names, function, jacobian, initial_guess, domain=domain,
+                           equation=equation, domain_error=domain_error)
+    MODELS[name] = model
+    return model
+
+
+for _model in (
+    NonlinearModel("直線", ("A", "B"), _line_function, _line_jacobian,
+                   lambda x, y: np.array(_line(x, y)), ab_plot_type="通常"),
+    NonlinearModel("指数関数", ("A", "B"), _exp_function, _exp_jacobian,
+                   _log_linear_guess, ab_plot_type="片対数 (Y軸対数)"),
+    NonlinearModel("対数関数", ("A", "B"), _log_function, _log_jacobian,
+                   lambda x, y: np.array(_line(np.log(x), y)), domain=_positive_x,
+                   ab_plot_type="片対数 (X軸対数)", domain_error="対数関数のため、正のXデータが必要です。"),
+    NonlinearModel("べき関数", ("A", "B"), _power_function, _power_jacobian,
+                   lambda x, y: _log_linear_guess(np.log(x), y), domain=_positive_x,
+                   ab_plot_type="両対数", domain_error="べき関数のため、正のXデータが必要です。"),
+    polynomial_model(2),
+    polynomial_model(3),
+):
+    MODELS[_model.name] = _model
+
+# グラフ種類ごとの既定のモデル（対数変換した直線フィットと同じ形）
+DEFAULT_MODELS = {
+    "通常": "直線",
+    "片対数 (Y軸対数)": "指数関数",
+    "片対数 (X軸対数)": "対数関数",
+    "両対数": "べき関数",
+}
+
+
+def _residual_cost(model, x, y, params):
+    """残差と残差平方和。計算できない場合の平方和は inf"""
+    residuals = y - model.predict(x, params)
+    cost = float(residuals @ residuals)
+    return residuals, cost if np.isfinite(cost) else np.inf
+
+
+def _scaled_svd(model, x, params):
+    """列ごとのノルムで正規化したヤコビアンの特異値分解と、列のノルム"""
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        jacobian = np.asarray(model.jacobian(x, params), dtype=float)
+    if not np.isfinite(jacobian).all():
+        return None
+    scale = np.sqrt(np.einsum("ij,ij->j", jacobian, jacobian))
+    scale[scale == 0] = 1.0
+    u, s, vt = np.linalg.svd(jacobian / scale, full_matrices=False)
+    return u, s, vt, scale
+
+
+def levenberg_marquardt(model, x, y, p0, max_iter=NL_MAX_ITER, xtol=NL_XTOL, ftol=NL_FTOL):
+    """
+    p0 から Levenberg–Marquardt 法で残差平方和を最小化し、(パラメータ, 残差平方和, 反復回数, 収束したか) を返す。
+    減衰付きの正規方程式は、列を正規化したヤコビアンの特異値分解で解く（多項式でも条件数が2乗にならない）。
+    減衰係数を変えて解き直す場合は、同じ分解を使う。初期値で残差を計算できない場合は None。
+    """
+    params = np.array(p0, dtype=float)
+    residuals, cost = _residual_cost(model, x, y, params)
+    if not np.isfinite(cost):
+        return None
+    damping = NL_INITIAL_DAMPING
+    n_iter = 0
+    converged = False
+    while n_iter < max_iter and not converged:
+        n_iter += 1
+        decomposition = _scaled_svd(model, x, params)
+        if decomposition is None:
+            break
+        u, s, vt, scale = decomposition
+        projected = u.T @ residuals
+        while True:
+            step = (vt.T @ (s / (s * s + damping) * projected)) / scale
+            trial = params + step
+            trial_residuals, trial_cost = _residual_cost(model, x, y, trial)
+            if trial_cost <= cost:
+                break
+            damping *= 10.0
+            if damping > NL_MAX_DAMPING:  # どの方向にも減らせない（極小に達している）
+                return params, cost, n_iter, True
+        converged = (np.all(np.abs(step) <= xtol * (np.abs(params) + xtol))
+                     or cost - trial_cost <= ftol * cost)
+        params, residuals, cost = trial, trial_residuals, trial_cost
+        damping = max(damping / 10.0, 1e-12)
+    return params, cost, n_iter, converged
+
+
+def fit_model(model, x, y, warm_start=None):
+    """
+    モデルを x, y（モデルの定義域内の有限な値）にフィットし、次のキーの辞書を返す。
+    params, param_errors（包含係数1）, covariance, r_squared, n_iterations, converged,
+    start（"previous": 前回のパラメータから開始、"linearized": 線形化した解から開始）。
+    点数がパラメータ数未満、または残差を計算できない場合は None。
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n, n_params = len(x), len(model.param_names)
+    if n < n_params or n != len(y):
+        return None
+
+    # 線形化した解と前回のパラメータのうち、残差平方和の小さい方から始める
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        starts = [("linearized", np.asarray(model.initial_guess(x, y), dtype=float))]
+    if warm_start is not None:
+        previous = np.asarray(warm_start, dtype=float)
+        if previous.shape == (n_params,) and np.isfinite(previous).all():
+            starts.insert(0, ("previous", previous))
+    costs = [_residual_cost(model, x, y, p)[1] if p.shape == (n_params,) else np.inf for _, p in starts]
+    best = int(np.argmin(costs))
+    if not np.isfinite(costs[best]):
+        return None
+    start, p0 = starts[best]
+
+    solution = levenberg_marquardt(model, x, y, p0)
+    if solution is None:
+        return None
+    params, ss_res, n_iter, converged = solution
+
+    # 共分散 s^2 (J^T J)^-1（s^2 は残差平方和 / 自由度）
+    covariance = np.full((n_params, n_params), np.nan)
+    decomposition = _scaled_svd(model, x, params)
+    if n > n_params and decomposition is not None:
+        _, s, vt, scale = decomposition
+        if s[-1] > NL_SINGULAR_RTOL * s[0]:
+            inverse = (vt.T / (s * s)) @ vt
+            covariance = ss_res / (n - n_params) * inverse / np.outer(scale, scale)
+    param_errors = np.sqrt(np.diag(covariance))
+
+    y_dev = y - y.mean()
+    ss_tot = float(y_dev @ y_dev)
+    r_squared = 1.0 - ss_res / ss_tot if ss_tot > 0 else (1.0 if ss_res == 0 else 0.0)
+    return {
+        "params": params, "param_errors": param_errors, "covariance": covariance,
+        "r_squared": r_squared, "n_iterations": n_iter, "converged": bool(converged), "start": start,
+    }
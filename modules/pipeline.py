@@ -0,0 +1,122 @@
+# modules/pipeline.py
+"""
+再実行の処理を、入力を宣言した段階（Stage）の有向非巡回グラフとして実行する。
+各段階は設定のうち宣言した項目だけを受け取り、結果はセッションごとのメモに (キー, 値) として1つずつ保持する。
+キー（宣言した項目の値と前段のキー）が前回と同じなら計算せずに再利用するため、
+宣言していない設定を変えた再実行では、その段階と前段は計算し直さない。
+"""
+
+
+class Stage:
+    """
+    パイプラインの1段階。func(settings, *前段の結果, **sources) で計算する。
+    settings は inputs に宣言した項目だけの辞書で、キーにもこの値を使う。
+    sources はキーに含めない引数（キーの項目から決まる生データや、結果を変えない値）。
+    release を指定すると、置き換わった古い結果をその関数で破棄する（figure など）。
+    """
+
+    __slots__ = ("name", "func", "inputs", "depends", "sources", "release")
+
+    def __init__(self, name, func, inputs=(), depends=(), sources=(), release=None):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.depends = tuple(depends)
+        self.sources = tuple(sources)
+        self.release = release
+
+
+class StageCancelled(Exception):
+    """新しい入力の計算に置き換えられたため、段階の区切りで計算を打ち切った"""
+
+
+class StagePipeline:
+    """段階の並び。前段は先に宣言した段階だけを指定できるため、依存関係は循環しない"""
+
+    def __init__(self, stages):
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"段階 '{stage.name}' が重複しています。")
+            unknown = [name for name in stage.depends if name not in self.stages]
+            if unknown:
+                raise ValueError(f"段階 '{stage.name}' の前段 {unknown} が先に宣言されていません。")
+            self.stages[stage.name] = stage
+
+    def key(self, name, inputs):
+        """inputs で name の段階を計算したときのキー（宣言した項目の値と前段のキー）。何も計算しない"""
+        stage = self.stages[name]
+        return (tuple(inputs.get(item) for item in stage.inputs),
+                tuple(self.key(dep, inputs) for dep in stage.depends))
+
+    def is_current(self, name, inputs, memo):
+        """name の段階の結果が、inputs で計算したものとしてメモにあるか"""
+        entry = memo.get(name)
+        return entry is not None and entry[0] == self.key(name, inputs)
+
+    def run(self, name, inputs, memo, sources=None, timings=None, cancelled=None, release=True):
+        """
+        name の段階の結果を返す。前段から順に、キーが変わった段階だけを計算する。
+        inputs は設定の辞書（graph_settings など）、memo はセッションごとの辞書（段階名 → (キー, 値)）。
+        timings（RerunTimings）を渡すと、計算した段階の処理時間を記録する。
+        cancelled() が真になると、次の段階を計算する前に StageCancelled を送出する。
+        release=False では置き換わった古い結果を破棄しない（メモの写しで計算する場合）。
+        """
+        stage = self.stages[name]
+        upstream = [self.run(dep, inputs, memo, sources, timings, cancelled, release) for dep in stage.depends]
+        settings = {item: inputs.get(item) for item in stage.inputs}
+        key = (tuple(settings.values()), tuple(memo[dep][0] for dep in stage.depends))
+        entry = memo.get(name)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        if cancelled is not None and cancelled():
+            raise StageCancelled(name)
+
+        kwargs = {item: (sources or {}).get(item) for item in stage.sources}
+        if timings is not None:
+            with timings.stage(name):
+                value = stage.func(settings, *upstream, **kwargs)
+        else:
+            value = stage.func(settings, *upstream, **kwargs)
+        memo[name] = (key, value)
+        if release and entry is not None and stage.release is not None and entry[1] is not value:
+            stage.release(entry[1])
+        return value
+
+    def latest(self, name, memo):
+        """直前に計算した name の段階の結果（入力が変わっていても返す。無ければ None）"""
+        entry = memo.get(name)
+        return entry[1] if entry is not None else None
+
+    def last_key(self, name, memo):
+        """直前に計算（または再利用）した name の段階のキー。結果の内容を表すため、書き出しのキャッシュキーにも使う"""
+        entry = memo.get(name)
+        return entry[0] if entry is not None else None
+
+    def merge(self, memo, computed, base):
+        """
+        memo の写し base から計算した結果 computed のうち、新しく計算した段階を memo に反映する。
+        置き換わった古い結果は release で破棄する。
+        """
+        for name, entry in computed.items():
+            if base.get(name) is entry:
+                continue
+            previous = memo.get(name)
+            memo[name] = entry
+            stage = self.stages[name]
+            if previous is not None and stage.release is not None and previous[1] is not entry[1]:
+                stage.release(previous[1])
+
+    def release_computed(self, computed, base):
+        """反映しない computed のうち、新しく計算した結果を破棄する"""
+        for name, entry in computed.items():
+            stage = self.stages[name]
+            if base.get(name) is not entry and stage.release is not None:
+                stage.release(entry[1])
+
+    def discard(self, name, memo):
+        """name の段階の結果をメモから外す（release を指定した段階はその関数で破棄する）"""
+        entry = memo.pop(name, None)
+        stage = self.stages[name]
+        if entry is not None and stage.release is not None:
+            stage.release(entry[1])
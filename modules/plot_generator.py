@@ -1,23 +1,76 @@
 # modules/plot_generator.py
-import matplotlib.pyplot as plt
-import matplotlib.font_manager as fm
-import matplotlib_fontja  # 日本語フォントを有効にするためのインポート
+import io
+import logging
+import time
+
+import numpy as np
+
+import modules.nonlinear_fit as nf
+from modules.cache import LRUCache
+from modules.instrumentation import log_event
+from modules.shared_cache import SharedCache
+
+# ダウンロード用に書き出した画像のキャッシュ上限（合計バイト数）
+EXPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# 形式ごとの savefig の設定
+EXPORT_FORMATS = {
+    "png": {"format": "png", "dpi": 300, "bbox_inches": "tight"},
+    "svg": {"format": "svg", "bbox_inches": "tight"},
+}
+# 画面表示用の画像の設定（st.pyplot と同じ）
+DISPLAY_FORMAT = {"format": "png", "dpi": 200, "bbox_inches": "tight"}
+# Streamlit はこれより幅の広い画像を表示のたびに縮小して書き出し直すため、先に縮小しておく
+DISPLAY_MAX_WIDTH = 2 * 730
+
+# 共有キャッシュ（modules.shared_cache）が有効なら、他のプロセスで書き出した画像も使う
+_export_cache = SharedCache(LRUCache(EXPORT_CACHE_MAX_BYTES), "export", dumps=bytes, loads=bytes)
+
+# この点数を超えるデータは間引いて描画する（graph_settings の decimation_threshold で変更可能）
+DEFAULT_DECIMATION_THRESHOLD = 50_000
+# 間引きに使う格子の分割数（横, 縦）。1格子がマーカー直径の1/4程度になるようにする
+DECIMATION_GRID = (400, 280)
+
 # --- フォントと共通設定 ---
+# matplotlib と日本語フォントの読み込みは起動時間の大半を占めるため、
+# 最初にグラフを描画するときまで遅らせる
+
+_jp_font = None
 
-# 日本語用フォントプロパティ（単体動作確認済みのIPAGothic）
 
-jp_font = fm.FontProperties(family='IPAGothic')
+def get_jp_font():
+    """
+    matplotlib と日本語フォントを読み込んで共通設定を適用し、
+    日本語用フォントプロパティ（単体動作確認済みのIPAGothic）を返す。2回目以降は設定済みのものを返す。
+    """
+    global _jp_font
+    if _jp_font is None:
+        import matplotlib
+        import matplotlib.font_manager as fm
+        import matplotlib_fontja  # noqa: F401 日本語フォントを有効にするためのインポート
 
-# 数式フォントの設定（英語テキスト描画の要）
-plt.rcParams['mathtext.fontset'] = 'stix'
-plt.rcParams['axes.unicode_minus'] = False
+        # 数式フォントの設定（英語テキスト描画の要）
+        matplotlib.rcParams['mathtext.fontset'] = 'stix'
+        matplotlib.rcParams['axes.unicode_minus'] = False
+        _jp_font = fm.FontProperties(family='IPAGothic')
+    return _jp_font
 
-import matplotlib.ticker as ticker
-import numpy as np
 
 def create_figure_and_axes(graph_settings):
-    # ... (変更なし) ...
-    fig, ax = plt.subplots(figsize=(10, 7))
+    """
+    figure と axes を作る。pyplot を使わずオブジェクトAPIで作るため、pyplot の figure 管理に登録されず、
+    参照がなくなれば解放される（不要になった時点で release_figure を呼ぶと、より早く解放できる）。
+    キャンバスは数式のレイアウトを figure 間で共有するもの（modules/mathtext_cache.py）を使う。
+    """
+    get_jp_font()
+    import matplotlib.ticker as ticker
+    from matplotlib.figure import Figure
+
+    from modules.mathtext_cache import CachedMathtextCanvas
+
+    fig = Figure(figsize=(10, 7))
+    CachedMathtextCanvas(fig)
+    ax = fig.add_subplot()
 
     # 目盛りのフォーマッターを設定し、不要な桁を削減
     ax.xaxis.set_major_formatter(ticker.FormatStrFormatter('%g'))
@@ -35,118 +88,193 @@ def create_figure_and_axes(graph_settings):
     ax.minorticks_on()
     return fig, ax
 
+def axis_scales(plot_type):
+    """グラフ種類から (X軸が対数か, Y軸が対数か) を返す"""
+    return plot_type in ("片対数 (X軸対数)", "両対数"), plot_type in ("片対数 (Y軸対数)", "両対数")
+
+
 def set_plot_scale(ax, plot_type):
-    # ... (変更なし) ...
-    if plot_type == "片対数 (Y軸対数)": ax.set_yscale('log')
-    elif plot_type == "片対数 (X軸対数)": ax.set_xscale('log')
-    elif plot_type == "両対数":
-        ax.set_xscale('log')
-        ax.set_yscale('log')
+    x_log, y_log = axis_scales(plot_type)
+    if x_log: ax.set_xscale('log')
+    if y_log: ax.set_yscale('log')
+
+def decimate_points(x, y, y_err=None, x_log=False, y_log=False, grid=DECIMATION_GRID):
+    """
+    表示空間（対数軸では log10）でデータ範囲を格子に分け、点を含む格子ごとに代表点を1つだけ残す。
+    格子はマーカーより細かいため、見た目の点の分布はほぼ変わらない。
+    エラーバーは格子内の (y - 誤差) の最小値から (y + 誤差) の最大値までにまとめ、
+    代表点に対する下側・上側の誤差として返す。対数軸で表示できない0以下の点は除く。
+
+    戻り値: (x, y, yerr)。yerr は y_err が None なら None、それ以外は shape (2, 点数) の配列
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = np.isfinite(x) & np.isfinite(y)
+    if x_log:
+        keep &= x > 0
+    if y_log:
+        keep &= y > 0
+    kept = np.flatnonzero(keep)
+    if kept.size == 0:
+        return x[kept], y[kept], (None if y_err is None else np.zeros((2, 0)))
+
+    def cell_index(values, n_cells):
+        v_min, v_max = values.min(), values.max()
+        if v_max <= v_min:
+            return np.zeros(len(values), dtype=np.int64)
+        scaled = (values - v_min) / (v_max - v_min) * n_cells
+        return np.minimum(scaled.astype(np.int64), n_cells - 1)
+
+    grid_x = np.log10(x[kept]) if x_log else x[kept]
+    grid_y = np.log10(y[kept]) if y_log else y[kept]
+    cells = cell_index(grid_x, grid[0]) * grid[1] + cell_index(grid_y, grid[1])
+
+    # 格子番号で安定ソートし、各格子の先頭（元の順で最初の点）を代表点にする
+    order = np.argsort(cells, kind="stable")
+    sorted_cells = cells[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_cells[1:] != sorted_cells[:-1])))
+    representatives = kept[order[starts]]
+    x_out = x[representatives]
+    y_out = y[representatives]
+    if y_err is None:
+        return x_out, y_out, None
+
+    err = np.broadcast_to(np.asarray(y_err, dtype=float), x.shape)
+    members = kept[order]
+    lower = np.minimum.reduceat(y[members] - err[members], starts)
+    upper = np.maximum.reduceat(y[members] + err[members], starts)
+    return x_out, y_out, np.vstack([y_out - lower, upper - y_out])
+
+
+def error_bar_values(data, graph_settings):
+    """
+    エラーバーの長さを返す（表示しない場合は None）。
+    誤差の列が無い場合は平均の標準誤差をすべての点に使う。
+    """
+    if not graph_settings.get("show_error_bars"):
+        return None
+    if data.y_error is not None and len(data) > 0:
+        return data.y_error
+    return np.std(data.y, ddof=1) / np.sqrt(len(data.y))
+
+
+def display_points(data, graph_settings, x_log=False, y_log=False):
+    """
+    描画するデータ点 (x, y, yerr) を返す。data は NaN を除いた Dataset。
+    点数が decimation_threshold を超える場合は decimate_points で間引いた代表点だけを返す。
+    """
+    x, y = data.x, data.y
+    y_err = error_bar_values(data, graph_settings)
+    decimation_threshold = graph_settings.get("decimation_threshold", DEFAULT_DECIMATION_THRESHOLD)
+    if decimation_threshold and len(x) > decimation_threshold:
+        x, y, y_err = decimate_points(x, y, y_err, x_log=x_log, y_log=y_log)
+    return x, y, y_err
+
+
+def plot_data_points(ax, data, graph_settings):
+    """
+    データ点（とエラーバー）を描画する。data は NaN を除いた Dataset。
+    フィッティングは呼び出し側で全データに対して行う。
+    """
+    x, y, y_err = display_points(
+        data, graph_settings, x_log=ax.get_xscale() == 'log', y_log=ax.get_yscale() == 'log'
+    )
 
-def plot_data_points(ax, df, graph_settings):
-    # ... (変更なし) ...
     if graph_settings.get("show_error_bars"):
-        y_err = None
-        if 'y_error' in df.columns and df['y_error'].notna().any():
-            y_err = df['y_error']
-        else:
-            y_err = df['y'].std() / np.sqrt(df['y'].count())
-        
-        ax.errorbar(df['x'], df['y'], yerr=y_err, fmt='o', label=graph_settings["data_legend_label"], markersize=5, capsize=3)
+        ax.errorbar(x, y, yerr=y_err, fmt='o', label=graph_settings["data_legend_label"], markersize=5, capsize=3)
     else:
         if graph_settings["show_legend"]:
-            ax.plot(df['x'], df['y'], 'o', label=graph_settings["data_legend_label"], markersize=5)
+            ax.plot(x, y, 'o', label=graph_settings["data_legend_label"], markersize=5)
         else:
-            ax.plot(df['x'], df['y'], 'o', markersize=5)
+            ax.plot(x, y, 'o', markersize=5)
 
 
-def determine_final_axis_ranges(ax, graph_settings, x_data_orig=None, y_data_orig=None):
-    """
-    データ点プロット後のaxオブジェクトと設定に基づき、最終的なX軸・Y軸の範囲を計算して返す。
-    この時点では ax.set_xlim/ylim は行わない。
-    """
-    # ... (変更なし) ...
-    current_xlim_auto = ax.get_xlim()
-    current_ylim_auto = ax.get_ylim()
+def _padded_data_range(values, log, default):
+    """データの範囲を前後10%広げた範囲。対数軸で下限が0以下になる場合は、正の値の範囲を対数で10%広げる"""
+    if values is None or len(values) == 0:
+        return list(default)
+    v_min, v_max = np.min(values), np.max(values)
+    v_range = v_max - v_min
+    lower, upper = v_min - v_range * 0.1, v_max + v_range * 0.1
+    if log and lower <= 0:
+        positive = values[values > 0]
+        if positive.size:
+            p_min, p_max = np.min(positive), np.max(positive)
+            lower = p_min / (p_max / p_min) ** 0.1 if p_max > p_min else p_min / 2
+    return [lower, upper]
+
 
-    final_xlim_to_return = list(current_xlim_auto)
-    final_ylim_to_return = list(current_ylim_auto)
+def _manual_axis_range(graph_settings, axis, log, values, current):
+    """手動で指定した軸の範囲。対数軸で0以下の指定はデータの正の範囲で補う。指定が不正なら current を返す"""
+    min_setting = graph_settings.get(f'{axis}_axis_min')
+    max_setting = graph_settings.get(f'{axis}_axis_max')
+    if min_setting is None or max_setting is None or min_setting >= max_setting:
+        log_event("manual_axis_range_invalid", level=logging.WARNING, axis=axis)
+        return current
+    if not log:
+        return [min_setting, max_setting]
 
-    # データに基づいて範囲を計算
-    if x_data_orig is not None and len(x_data_orig) > 0:
-        x_min, x_max = np.min(x_data_orig), np.max(x_data_orig)
-        x_range = x_max - x_min
-        final_xlim_to_return = [x_min - x_range * 0.1, x_max + x_range * 0.1]
+    has_positive = values is not None and np.any(values > 0)
+    min_final = min_setting if min_setting > 0 else \
+                (np.min(values[values > 0]) if has_positive else np.finfo(float).eps)
+    max_final = max_setting if max_setting > min_final else \
+                (np.max(values[values > 0]) if has_positive and np.max(values[values > 0]) > min_final else min_final * 100)
+    return [min_final, max_final] if min_final < max_final else current
 
-    if y_data_orig is not None and len(y_data_orig) > 0:
-        y_min, y_max = np.min(y_data_orig), np.max(y_data_orig)
-        y_range = y_max - y_min
-        final_ylim_to_return = [y_min - y_range * 0.1, y_max + y_range * 0.1]
 
+def compute_axis_ranges(x_data, y_data, graph_settings, x_log=False, y_log=False,
+                        auto_xlim=(0.0, 1.0), auto_ylim=(0.0, 1.0)):
+    """
+    最終的な X軸・Y軸の範囲を計算する（matplotlib に依存しない。ブラウザ側の描画でも使う）。
+    データ範囲の前後10%、原点を含める設定、手動の範囲指定の順に適用する。
+    データが無い軸は auto_xlim / auto_ylim を使う。
+    """
+    xlim = _padded_data_range(x_data, x_log, auto_xlim)
+    ylim = _padded_data_range(y_data, y_log, auto_ylim)
 
-    if graph_settings.get('force_origin_visible', False) and \
-       ax.get_xscale() != 'log' and ax.get_yscale() != 'log':
-        final_xlim_to_return[0] = min(0, final_xlim_to_return[0])
-        final_xlim_to_return[1] = max(0, final_xlim_to_return[1])
-        final_ylim_to_return[0] = min(0, final_ylim_to_return[0])
-        final_ylim_to_return[1] = max(0, final_ylim_to_return[1])
+    if graph_settings.get('force_origin_visible', False) and not x_log and not y_log:
+        xlim = [min(0, xlim[0]), max(0, xlim[1])]
+        ylim = [min(0, ylim[0]), max(0, ylim[1])]
 
     if graph_settings.get('manual_x_axis', False):
-        x_min_setting = graph_settings.get('x_axis_min')
-        x_max_setting = graph_settings.get('x_axis_max')
-        if x_min_setting is not None and x_max_setting is not None and x_min_setting < x_max_setting:
-            if ax.get_xscale() == 'log':
-                x_min_final_manual = x_min_setting if x_min_setting > 0 else \
-                                     (np.min(x_data_orig[x_data_orig>0]) if x_data_orig is not None and np.any(x_data_orig>0) else np.finfo(float).eps)
-                x_max_final_manual = x_max_setting if x_max_setting > x_min_final_manual else \
-                                     (np.max(x_data_orig[x_data_orig>0]) if x_data_orig is not None and np.any(x_data_orig>0) and np.max(x_data_orig[x_data_orig>0]) > x_min_final_manual else x_min_final_manual * 100)
-                if x_min_final_manual < x_max_final_manual:
-                    final_xlim_to_return = [x_min_final_manual, x_max_final_manual]
-            else:
-                final_xlim_to_return = [x_min_setting, x_max_setting]
-        else:
-            print("Manual X axis range is invalid, using auto/origin-adjusted range.")
-
+        xlim = _manual_axis_range(graph_settings, 'x', x_log, x_data, xlim)
     if graph_settings.get('manual_y_axis', False):
-        y_min_setting = graph_settings.get('y_axis_min')
-        y_max_setting = graph_settings.get('y_axis_max')
-        if y_min_setting is not None and y_max_setting is not None and y_min_setting < y_max_setting:
-            if ax.get_yscale() == 'log':
-                y_min_final_manual = y_min_setting if y_min_setting > 0 else \
-                                     (np.min(y_data_orig[y_data_orig>0]) if y_data_orig is not None and np.any(y_data_orig>0) else np.finfo(float).eps)
-                y_max_final_manual = y_max_setting if y_max_setting > y_min_final_manual else \
-                                     (np.max(y_data_orig[y_data_orig>0]) if y_data_orig is not None and np.any(y_data_orig>0) and np.max(y_data_orig[y_data_orig>0]) > y_min_final_manual else y_min_final_manual * 100)
-                if y_min_final_manual < y_max_final_manual:
-                    final_ylim_to_return = [y_min_final_manual, y_max_final_manual]
-            else:
-                final_ylim_to_return = [y_min_setting, y_max_setting]
-        else:
-            print("Manual Y axis range is invalid, using auto/origin-adjusted range.")
+        ylim = _manual_axis_range(graph_settings, 'y', y_log, y_data, ylim)
+    return tuple(xlim), tuple(ylim)
 
-    return tuple(final_xlim_to_return), tuple(final_ylim_to_return)
 
+def determine_final_axis_ranges(ax, graph_settings, x_data_orig=None, y_data_orig=None):
+    """
+    データ点プロット後のaxオブジェクトと設定に基づき、最終的なX軸・Y軸の範囲を計算して返す。
+    この時点では ax.set_xlim/ylim は行わない。
+    """
+    return compute_axis_ranges(
+        x_data_orig, y_data_orig, graph_settings,
+        x_log=ax.get_xscale() == 'log', y_log=ax.get_yscale() == 'log',
+        auto_xlim=ax.get_xlim(), auto_ylim=ax.get_ylim()
+    )
 
-def plot_fit_line_on_final_axes(ax, final_xlim_to_use, x_data_orig, fit_results, plot_type, graph_settings, legend_label, line_style, color):
+
+def compute_fit_line(fit_results, plot_type, xlim, x_data_orig, x_log=False, y_log=False, n_points=200):
     """
-    指定された最終X軸範囲 (final_xlim_to_use) に基づいて近似直線/曲線を描画する。
-    凡例ラベル、線のスタイル、色を引数で指定できる。
+    X軸範囲 xlim の全体にわたる近似直線/曲線の座標 (x, y) を返す（matplotlib に依存しない）。
+    非線形最小二乗法の結果はグラフ種類によらず、フィットしたモデルの値を使う。
+    フィットに失敗している場合や、表示できる点が無い場合は None を返す。
     """
     if fit_results is None or fit_results.get("slope_val") is None or fit_results.get("error_message"):
-        return
-
-    current_x_scale = ax.get_xscale()
+        return None
 
-    if current_x_scale == 'log':
-        x_start_for_line = final_xlim_to_use[0] if final_xlim_to_use[0] > 0 else np.finfo(float).eps
-        x_end_for_line = final_xlim_to_use[1]
+    if x_log:
+        x_start_for_line = xlim[0] if xlim[0] > 0 else np.finfo(float).eps
+        x_end_for_line = xlim[1]
         if x_start_for_line >= x_end_for_line: # フォールバック
              x_data_positive = x_data_orig[x_data_orig > 0]
              x_start_for_line = np.min(x_data_positive) if np.any(x_data_positive) else 1e-3
              x_end_for_line = np.max(x_data_positive) if np.any(x_data_positive) else 1e+3
              if x_start_for_line >= x_end_for_line: x_start_for_line=1e-1; x_end_for_line=1e1;
-        x_fit_line = np.geomspace(x_start_for_line, x_end_for_line, 200)
+        x_fit_line = np.geomspace(x_start_for_line, x_end_for_line, n_points)
     else: # 線形スケール
-        x_fit_line = np.linspace(final_xlim_to_use[0], final_xlim_to_use[1], 200)
+        x_fit_line = np.linspace(xlim[0], xlim[1], n_points)
 
     slope_val = fit_results.get("slope_val")
     intercept_val = fit_results.get("intercept_val")
@@ -155,7 +283,13 @@ def plot_fit_line_on_final_axes(ax, final_xlim_to_use, x_data_orig, fit_results,
     y_pred_line = np.zeros_like(x_fit_line, dtype=float)
 
     can_plot_fit = True
-    if plot_type == "通常":
+    model = nf.MODELS.get(fit_results.get("model"))
+    if model is not None:
+        y_pred_line = model.predict(x_fit_line, fit_results["params"])
+        y_pred_line[~model.valid_mask(x_fit_line)] = np.nan
+    elif fit_results.get("model") is not None: # このプロセスに登録されていないモデル
+        can_plot_fit = False
+    elif plot_type == "通常":
         if slope_val is not None and intercept_val is not None: y_pred_line = slope_val * x_fit_line + intercept_val
         else: can_plot_fit = False
     elif plot_type == "片対数 (Y軸対数)":
@@ -170,16 +304,31 @@ def plot_fit_line_on_final_axes(ax, final_xlim_to_use, x_data_orig, fit_results,
     else:
         can_plot_fit = False
 
-    if can_plot_fit and np.any(y_pred_line):
-        valid_plot_indices = np.isfinite(y_pred_line)
-        if ax.get_yscale() == 'log':
-            valid_plot_indices &= (y_pred_line > 0)
+    if not can_plot_fit or not np.any(y_pred_line):
+        return None
+    valid_plot_indices = np.isfinite(y_pred_line)
+    if y_log:
+        valid_plot_indices &= (y_pred_line > 0)
+    if not np.any(valid_plot_indices):
+        return None
+    return x_fit_line[valid_plot_indices], y_pred_line[valid_plot_indices]
 
-        if np.any(valid_plot_indices):
-            if graph_settings.get("show_legend", True):
-                ax.plot(x_fit_line[valid_plot_indices], y_pred_line[valid_plot_indices], linestyle=line_style, color=color, label=legend_label)
-            else:
-                ax.plot(x_fit_line[valid_plot_indices], y_pred_line[valid_plot_indices], linestyle=line_style, color=color)
+
+def plot_fit_line_on_final_axes(ax, final_xlim_to_use, x_data_orig, fit_results, plot_type, graph_settings, legend_label, line_style, color):
+    """
+    指定された最終X軸範囲 (final_xlim_to_use) に基づいて近似直線/曲線を描画する。
+    凡例ラベル、線のスタイル、色を引数で指定できる。
+    """
+    line = compute_fit_line(
+        fit_results, plot_type, final_xlim_to_use, x_data_orig,
+        x_log=ax.get_xscale() == 'log', y_log=ax.get_yscale() == 'log'
+    )
+    if line is None:
+        return
+    if graph_settings.get("show_legend", True):
+        ax.plot(*line, linestyle=line_style, color=color, label=legend_label)
+    else:
+        ax.plot(*line, linestyle=line_style, color=color)
 
 
 def apply_final_axes_and_legend(ax, final_xlim, final_ylim, graph_settings):
@@ -194,4 +343,101 @@ def apply_final_axes_and_legend(ax, final_xlim, final_ylim, graph_settings):
         handles, labels = ax.get_legend_handles_labels()
         if handles: # 凡例エントリが実際に存在する場合のみ表示
             legend_fontsize = graph_settings.get("legend_fontsize", 20)
-            ax.legend(handles, labels, loc='best', fontsize=legend_fontsize)
\ No newline at end of file
+            ax.legend(handles, labels, loc='best', fontsize=legend_fontsize)
+
+def draw_graph(data, graph_settings, fit_lines=(), axis_ranges=None):
+    """
+    データ点と近似線を描画した (fig, ax) を返す（app.py と一括処理で共通の描画手順）。
+    data は NaN を除いた Dataset。
+    fit_lines は (fit_results, 凡例, 線種, 色) の並びで、フィットに失敗した結果は描画しない。
+    axis_ranges に compute_axis_ranges で求めた (xlim, ylim) を渡すと、軸範囲を計算し直さない。
+    """
+    plot_type = graph_settings["plot_type"]
+    x_values = data.x
+    fig, ax = create_figure_and_axes(graph_settings)
+    set_plot_scale(ax, plot_type)
+    plot_data_points(ax, data, graph_settings)
+
+    if axis_ranges is None:
+        axis_ranges = determine_final_axis_ranges(ax, graph_settings, x_values, data.y)
+    final_xlim, final_ylim = axis_ranges
+    for fit_results, legend_label, line_style, color in fit_lines:
+        if fit_results and not fit_results.get("error_message"):
+            plot_fit_line_on_final_axes(
+                ax, final_xlim, x_values, fit_results, plot_type, graph_settings,
+                legend_label=legend_label, line_style=line_style, color=color
+            )
+
+    apply_final_axes_and_legend(ax, final_xlim, final_ylim, graph_settings)
+    return fig, ax
+
+
+def release_figure(fig):
+    """
+    描画と書き出しが終わった figure の中身（Artist）を破棄する。
+    figure と axes は相互に参照しているため、参照が切れてもガベージコレクションまで解放されない。
+    先に中身を消しておくことで、大きなデータ点の配列などをすぐに解放する。
+    """
+    if fig is not None:
+        fig.clear()
+
+
+def display_png_bytes(fig):
+    """
+    画面表示用に figure を PNG で書き出したバイト列を返す。
+    st.pyplot と同じ解像度で書き出し、表示の幅を超える場合は st.pyplot と同じ方法で縮小する。
+    """
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, **DISPLAY_FORMAT)
+    image = Image.open(buffer)
+    if image.width <= DISPLAY_MAX_WIDTH:
+        return buffer.getvalue()
+    height = int(1.0 * image.height * DISPLAY_MAX_WIDTH / image.width)
+    resized = io.BytesIO()
+    image.resize((DISPLAY_MAX_WIDTH, height), resample=Image.BILINEAR).save(resized, format="PNG")
+    return resized.getvalue()
+
+
+def export_figure_bytes(fig, fmt, cache_key=None):
+    """
+    figure を指定形式 (png / svg) で書き出したバイト列を返す。
+    cache_key（描画したデータと設定のハッシュ）を指定すると、同じ内容の書き出しを再利用する。
+    fig には figure を作る関数も渡せる。その場合はキャッシュに無いときだけ描画し、書き出し後に破棄する。
+    """
+    key = (cache_key, fmt) if cache_key is not None else None
+    if key is not None:
+        cached = _export_cache.get(key)
+        if cached is not None:
+            return cached
+
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    if callable(fig):
+        figure = fig()
+        try:
+            figure.savefig(buffer, **EXPORT_FORMATS[fmt])
+        finally:
+            release_figure(figure)
+    else:
+        fig.savefig(buffer, **EXPORT_FORMATS[fmt])
+    data = buffer.getvalue()
+    log_event("export", format=fmt, ms=round((time.perf_counter() - start) * 1e3, 3), bytes=len(data))
+    if key is not None:
+        _export_cache.put(key, data)
+    return data
+
+
+def get_export_cache_stats():
+    """書き出し画像キャッシュのエントリ数・使用バイト数などを返す"""
+    return _export_cache.stats()
+
+
+def get_mathtext_cache_stats():
+    """数式レイアウトキャッシュのヒット数・ミス数・エントリ数を返す（まだ描画していなければ None）"""
+    if _jp_font is None:
+        return None
+    import modules.mathtext_cache as mc
+
+    return mc.cache_stats()
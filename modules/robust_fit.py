@@ -0,0 +1,346 @@
+# modules/robust_fit.py
+"""
+外れ値に強い直線フィット（Theil–Sen 推定と Huber の M 推定）。
+どちらも変換後の空間の x, y を受け取り、perform_linear_fit_with_uncertainty と同じ
+(傾き, 傾きの不確かさ, 切片, 切片の不確かさ, R^2) を返す。不確かさの包含係数は1。
+
+Theil–Sen の傾きはすべての点の組の傾きの中央値だが、組は n(n-1)/2 個あるため列挙しない。
+傾きが t 以下の組の数は、x の順に並べた点の y - t x の反転数に等しく、O(n log n) で数えられる。
+無作為に抽出した組の傾きで中央値を挟む区間を決め、区間内の組の数を数えながら区間を狭め、
+残りの組がわずかになったところで区間内の組だけを列挙して中央値を選ぶ。
+"""
+import numpy as np
+
+# この点数以下では、すべての組の傾きを直接計算する（組の数は約 n^2/2）
+THEIL_SEN_DIRECT_MAX_POINTS = 2000
+# 中央値を挟む最初の区間を決めるために抽出する組の数（点数に対する倍率）
+THEIL_SEN_SAMPLE_FACTOR = 4
+# 区間内の組を列挙する条件。区間の両端で並び順の位置が動く幅の最大値（列挙の手間は点数 × この値）
+THEIL_SEN_MAX_SHIFT = 64
+# 乱数のシード（抽出する組は区間の決め方にだけ使い、結果の値には影響しない）
+THEIL_SEN_SEED = 0
+# 反転数を数えるとき、マージせずに全ての組を直接比べるブロックの大きさ
+INVERSION_BASE_BLOCK = 32
+
+# Huber 関数のしきい値（誤差が正規分布のとき最小二乗法に対して95%の効率）
+HUBER_THRESHOLD = 1.345
+HUBER_MAX_ITER = 100
+HUBER_TOL = 1e-10
+# 正規分布の標準偏差に換算する MAD の係数
+MAD_TO_SIGMA = 1.4826
+
+_FAILED = (None, np.nan, None, np.nan, None)
+
+
+def _validated(x_numeric, y_numeric):
+    """float の配列にして返す。点数が2未満・長さが異なる・NaN/Inf を含む場合は None"""
+    x = np.asarray(x_numeric, dtype=float)
+    y = np.asarray(y_numeric, dtype=float)
+    if len(x) < 2 or len(x) != len(y) or not (np.isfinite(x).all() and np.isfinite(y).all()):
+        return None
+    return x, y
+
+
+def _r_squared(y, y_pred):
+    """決定係数（perform_linear_fit_with_uncertainty と同じ定義。外れ値の影響で負になることがある）"""
+    y_dev = y - y.mean()
+    ss_tot = float(y_dev @ y_dev)
+    residuals = y - y_pred
+    ss_res = float(residuals @ residuals)
+    if ss_tot > 0:
+        return 1.0 - ss_res / ss_tot
+    return 1.0 if ss_res == 0 else 0.0
+
+
+def count_inversions(ranks):
+    """順列 ranks（0..n-1 の並べ替え）で、a < b かつ ranks[a] > ranks[b] となる組の数を数える"""
+    ranks = np.asarray(ranks, dtype=np.int64)
+    n = len(ranks)
+    if n < 2:
+        return 0
+    total = 0
+    # INVERSION_BASE_BLOCK 個ずつのブロック内は、ずらした位置どうしを直接比べて数える
+    width = min(INVERSION_BASE_BLOCK, n)
+    full = n - n % width
+    blocks = ranks[:full].reshape(-1, width)
+    tail = ranks[full:]
+    for d in range(1, width):
+        total += int(np.count_nonzero(blocks[:, :-d] > blocks[:, d:]))
+        if d < len(tail):
+            total += int(np.count_nonzero(tail[:-d] > tail[d:]))
+
+    # それより上はボトムアップのマージソートと同じ分割で、幅 2*width のブロックごとに
+    # 右半分の各要素より大きい左半分の要素を数える（ブロック番号との合成キーで全ブロックを一度に処理する）
+    index = np.arange(n, dtype=np.int64)
+    while width < n:
+        block = index // (2 * width)
+        right = (index // width) % 2 == 1
+        key = block * n + ranks
+        left_sorted = np.sort(key[~right])
+        smaller = np.searchsorted(left_sorted, key[right]) - block[right] * width
+        total += int((width - smaller).sum())
+        width *= 2
+    return total
+
+
+class PairSlopes:
+    """
+    点の組 (i, j)（x_i < x_j）の傾き (y_j - y_i) / (x_j - x_i) の順位統計量を、組を列挙せずに求める。
+    x が等しい組は傾きが定まらないため除く。
+    """
+
+    def __init__(self, x, y, seed=THEIL_SEN_SEED):
+        # x の昇順。x が等しい点は y の降順にし、その組を常に「t 以下」に数えて一定数として差し引く
+        order = np.lexsort((-y, x))
+        self.x = x[order]
+        self.y = y[order]
+        self.n_points = n = len(x)
+        _, tie_sizes = np.unique(self.x, return_counts=True)
+        self.tie_sizes = tie_sizes[tie_sizes > 1]
+        self._tied_pairs = int((self.tie_sizes * (self.tie_sizes - 1) // 2).sum())
+        self.n_pairs = n * (n - 1) // 2 - self._tied_pairs
+        self._rng = np.random.default_rng(seed)
+        self._counts = {}  # しきい値 t → 傾きが t 以下の組の数
+        self._sample = None
+        self._all_slopes = None
+        self._listed = None  # 列挙した区間 (lo, hi, lo以下の数, 区間内の傾き)
+
+        if self.n_pairs > 0:
+            # 傾きの絶対値の上限（隣り合う異なる x の最小の間隔と y の範囲から）で全体を挟む
+            x_steps = np.diff(self.x)
+            bound = 2.0 * (self.y.max() - self.y.min()) / x_steps[x_steps > 0].min() + 1.0
+            self._counts[-bound] = 0
+            self._counts[bound] = self.n_pairs
+        if n <= THEIL_SEN_DIRECT_MAX_POINTS:
+            i, j = np.triu_indices(n, 1)
+            dx = self.x[j] - self.x[i]
+            keep = dx != 0
+            self._all_slopes = np.sort((self.y[j] - self.y[i])[keep] / dx[keep])
+
+    def _order_at(self, t):
+        """y - t x の昇順（等しい場合は x の順で後ろの点を先）に並べた点の番号"""
+        u = self.y - t * self.x
+        order = np.argsort(u)
+        sorted_u = u[order]
+        if np.any(sorted_u[1:] == sorted_u[:-1]):  # 等しい値がある場合だけ、順序を決めて並べ直す
+            order = np.lexsort((-np.arange(self.n_points), u))
+        return order
+
+    def count_at_or_below(self, t):
+        """傾きが t 以下の組の数（y - t x の並び順が x の順と逆になる組の数）"""
+        t = float(t)
+        if t not in self._counts:
+            ranks = np.empty(self.n_points, dtype=np.int64)
+            ranks[self._order_at(t)] = np.arange(self.n_points)
+            self._counts[t] = count_inversions(ranks) - self._tied_pairs
+        return self._counts[t]
+
+    def _bracket(self, k):
+        """数えたしきい値のうち、k 番目の傾きを挟む最も狭い区間 (lo, lo以下の数, hi, hi以下の数)"""
+        lo, c_lo, hi, c_hi = -np.inf, 0, np.inf, self.n_pairs
+        for t, c in self._counts.items():
+            if c < k and t > lo:
+                lo, c_lo = t, c
+            elif c >= k and t < hi:
+                hi, c_hi = t, c
+        return lo, c_lo, hi, c_hi
+
+    def _sampled_slopes(self):
+        if self._sample is None:
+            m = THEIL_SEN_SAMPLE_FACTOR * self.n_points
+            i = self._rng.integers(0, self.n_points, m)
+            j = self._rng.integers(0, self.n_points, m)
+            dx = self.x[j] - self.x[i]
+            keep = dx != 0
+            self._sample = np.sort((self.y[j] - self.y[i])[keep] / dx[keep])
+        return self._sample
+
+    def _slopes_between(self, lo, hi):
+        """
+        傾きが (lo, hi] の組の傾きを列挙する。その組は lo と hi で y - t x の並び順が入れ替わるため、
+        並び順の位置が動く幅が小さければ、近い位置どうしの比較だけで列挙できる。幅が大きい場合は None。
+        """
+        n = self.n_points
+        order_lo = self._order_at(lo)
+        position_hi = np.empty(n, dtype=np.int64)
+        position_hi[self._order_at(hi)] = np.arange(n)
+        s = position_hi[order_lo]
+        max_shift = int(np.abs(s - np.arange(n)).max())
+        if max_shift > THEIL_SEN_MAX_SHIFT:
+            return None
+        slopes = []
+        for d in range(1, 2 * max_shift):  # 入れ替わる2点の位置の差は 2 * max_shift 未満
+            first, second = order_lo[:-d], order_lo[d:]
+            swapped = (s[:-d] > s[d:]) & (first < second)
+            i, j = first[swapped], second[swapped]
+            slopes.append((self.y[j] - self.y[i]) / (self.x[j] - self.x[i]))
+        return np.concatenate(slopes) if slopes else np.empty(0)
+
+    def select(self, k, tolerance=0):
+        """
+        k 番目（1始まり）に小さい傾きを返す。
+        tolerance > 0 の場合は、順位の誤差が tolerance 程度の近似値（区間内の線形補間）でよいものとする。
+        """
+        if self._all_slopes is not None:
+            return float(self._all_slopes[k - 1])
+
+        sample = self._sampled_slopes()
+        if len(sample):
+            # 抽出した傾きの順位の標準偏差の4倍の幅で、k 番目の傾きを挟む
+            p = (k - 0.5) / self.n_pairs
+            spread = 4.0 * np.sqrt(len(sample) * p * (1.0 - p)) + 1.0
+            for q in (p * len(sample) - spread, p * len(sample) + spread):
+                t = sample[int(np.clip(q, 0, len(sample) - 1))]
+                lo, _, hi, _ = self._bracket(k)
+                if lo < t < hi:
+                    self.count_at_or_below(t)
+
+        previous_inside = None
+        while True:
+            lo, c_lo, hi, c_hi = self._bracket(k)
+            n_inside = c_hi - c_lo
+            if n_inside <= tolerance:
+                return float(lo + (hi - lo) * (k - c_lo) / n_inside)
+            if np.nextafter(lo, hi) >= hi:  # 区間をこれ以上狭められない（同じ傾きの組が多い）
+                return float(hi)
+            if tolerance > 0:
+                # 順位が k に十分近いしきい値を数えてあれば、それを返す
+                t, c = min(self._counts.items(), key=lambda item: abs(item[1] - k))
+                if abs(c - k) <= tolerance:
+                    return float(t)
+            elif n_inside <= 2 * self.n_points:
+                if self._listed is None or self._listed[:2] != (lo, hi):
+                    slopes = self._slopes_between(lo, hi)
+                    self._listed = None if slopes is None else (lo, hi, c_lo, np.sort(slopes))
+                if self._listed is not None:
+                    slopes = self._listed[3]
+                    if len(slopes) == 0:
+                        return float(hi)
+                    # 丸め誤差で組の数が数えた値とわずかに異なる場合に備え、範囲内に収める
+                    return float(slopes[min(max(k - c_lo - 1, 0), len(slopes) - 1)])
+
+            # 区間内で傾きが一様に分布するとみなし、k 番目の（厳密に求める場合はその前後の）順位に当たるしきい値で数える
+            if tolerance > 0:
+                # 片側からしか狭まらない場合（区間の数が半分以下にならない場合）は二分する
+                stalled = previous_inside is not None and n_inside > previous_inside // 2
+                targets = () if stalled else (k,)
+            else:
+                gap = max(n_inside // 64, min(self.n_points // 2, n_inside // 16), 1)
+                targets = (k - gap, k + gap)
+            for target in targets:
+                t = lo + (hi - lo) * (target - c_lo) / n_inside
+                if lo < t < hi:
+                    self.count_at_or_below(t)
+            if self._bracket(k)[::2] == (lo, hi):  # 狭まらなかった場合は二分する
+                self.count_at_or_below(lo + (hi - lo) / 2)
+            previous_inside = n_inside
+
+
+def theil_sen_fit(x_numeric, y_numeric, seed=THEIL_SEN_SEED):
+    """
+    Theil–Sen 推定で直線フィットを行う。傾きは点の組の傾きの中央値、切片は y - 傾き*x の中央値。
+    傾きの不確かさは Sen の信頼区間（Kendall の順位相関の分散から求める順位）の幅の半分（包含係数1）、
+    切片の不確かさは、残差の中央値の標準誤差と傾きの不確かさを x の中央値で伝播したものの合成。
+    """
+    validated = _validated(x_numeric, y_numeric)
+    if validated is None:
+        return _FAILED
+    x, y = validated
+    n = len(x)
+
+    pairs = PairSlopes(x, y, seed=seed)
+    n_pairs = pairs.n_pairs
+    if n_pairs == 0:  # 全てのxが同じ値の場合（最小二乗法と同様に傾き0とする）
+        slope, slope_err = 0.0, np.nan
+    else:
+        slope = pairs.select((n_pairs + 1) // 2)
+        if n_pairs % 2 == 0:
+            slope = (slope + pairs.select(n_pairs // 2 + 1)) / 2
+
+        ties = pairs.tie_sizes
+        var_kendall = (n * (n - 1) * (2 * n + 5) - float((ties * (ties - 1) * (2 * ties + 5)).sum())) / 18
+        sigma = np.sqrt(var_kendall)
+        lower_rank = int(np.clip(np.round((n_pairs - sigma) / 2), 1, n_pairs))
+        upper_rank = int(np.clip(np.round((n_pairs + sigma) / 2) + 1, 1, n_pairs))
+        # 区間の端は中央値ほどの精度は要らないため、順位の誤差が区間の幅の5%程度の近似値で求める
+        tolerance = int(sigma / 20)
+        slope_err = (pairs.select(upper_rank, tolerance) - pairs.select(lower_rank, tolerance)) / 2
+        if n <= 2:
+            slope_err = np.nan
+
+    residuals = y - slope * x
+    intercept = float(np.median(residuals))
+    intercept_err = np.nan
+    if n > 2:
+        sigma_residuals = MAD_TO_SIGMA * float(np.median(np.abs(residuals - intercept)))
+        # 正規分布の誤差での中央値の標準誤差は sqrt(pi/2) * sigma / sqrt(n)
+        intercept_err = np.sqrt(np.pi / 2 * sigma_residuals**2 / n + (float(np.median(x)) * slope_err)**2)
+
+    return float(slope), float(slope_err), intercept, float(intercept_err), _r_squared(y, slope * x + intercept)
+
+
+def _weighted_line(x, y, w):
+    """重み付き最小二乗法の直線（傾き, 切片）"""
+    w_sum = w.sum()
+    x_mean = (w @ x) / w_sum
+    y_mean = (w @ y) / w_sum
+    x_dev = x - x_mean
+    sxx = w @ (x_dev * x_dev)
+    slope = (w @ (x_dev * (y - y_mean))) / sxx if sxx > 0 else 0.0
+    return slope, y_mean - slope * x_mean
+
+
+def huber_fit(x_numeric, y_numeric, threshold=HUBER_THRESHOLD, max_iter=HUBER_MAX_ITER, tol=HUBER_TOL):
+    """
+    Huber の M 推定で直線フィットを行う（反復重み付き最小二乗法、IRLS）。
+    残差の尺度は毎回 MAD から推定し、|残差/尺度| が threshold を超える点の重みを threshold/|残差/尺度| に下げる。
+    不確かさは Huber (1981) の漸近共分散（補正係数つき）の平方根（包含係数1）。
+    """
+    validated = _validated(x_numeric, y_numeric)
+    if validated is None:
+        return _FAILED
+    x, y = validated
+    n = len(x)
+
+    # x の平均でずらして条件を良くし、最小二乗法の直線から始める
+    x_shift = x.mean()
+    xc = x - x_shift
+    slope, intercept = _weighted_line(xc, y, np.ones(n))
+    scale = 0.0
+    for _ in range(max_iter):
+        residuals = y - (slope * xc + intercept)
+        new_scale = MAD_TO_SIGMA * float(np.median(np.abs(residuals - np.median(residuals))))
+        if new_scale <= 0:  # 半数以上の点が直線上にある（不確かさには直前の尺度を使う）
+            break
+        scale = new_scale
+        abs_u = np.abs(residuals) / scale
+        weights = threshold / np.maximum(abs_u, threshold)
+        new_slope, new_intercept = _weighted_line(xc, y, weights)
+        converged = (abs(new_slope - slope) <= tol * (1 + abs(slope))
+                     and abs(new_intercept - intercept) <= tol * (1 + abs(intercept)))
+        slope, intercept = new_slope, new_intercept
+        if converged:
+            break
+
+    # 不確かさは最終的な直線の残差の尺度で求める
+    residuals = y - (slope * xc + intercept)
+    final_scale = MAD_TO_SIGMA * float(np.median(np.abs(residuals - np.median(residuals))))
+    if final_scale > 0:
+        scale = final_scale
+    slope_err, intercept_err = np.nan, np.nan
+    sxx = float(xc @ xc)
+    if n > 2 and sxx > 0 and scale > 0:
+        u = residuals / scale
+        psi = np.clip(u, -threshold, threshold)
+        psi_deriv = (np.abs(u) <= threshold).astype(float)
+        m = psi_deriv.mean()
+        if m > 0:
+            p = 2
+            k = 1 + p / n * psi_deriv.var() / m**2
+            variance_factor = scale**2 * k**2 * (psi @ psi) / (n - p) / m**2
+            slope_err = np.sqrt(variance_factor / sxx)
+            intercept_err = np.sqrt(variance_factor * (1 / n + x_shift**2 / sxx))
+
+    intercept_at_zero = intercept - slope * x_shift
+    return (float(slope), float(slope_err), float(intercept_at_zero), float(intercept_err),
+            _r_squared(y, slope * xc + intercept))
@@ -0,0 +1,357 @@
+# modules/shared_cache.py
+"""
+複数のプロセス（ロードバランサの後ろに並べたコンテナなど）で共有する、永続化したキャッシュ。
+共有ボリューム上の SQLite データベース（sqlite）またはディレクトリ（files）に、
+パース結果・フィット結果・書き出した画像をバイト列として保存し、合計バイト数が上限を超えたら
+最も長く使われていないものから消す。各プロセスではこれまでどおり LRUCache を手前に置き、
+手前に無いときだけ共有のキャッシュを読む（SharedCache）。
+
+環境変数で有効にする（未設定なら共有しない）:
+    STREAM_SHARED_CACHE_PATH    保存先（sqlite ではファイル、files ではディレクトリ）
+    STREAM_SHARED_CACHE_BACKEND sqlite（既定）または files
+    STREAM_SHARED_CACHE_MAX_MB  合計サイズの上限（MB、既定 1024）
+SQLite のロックはネットワークファイルシステム（NFS など）では信頼できないため、
+複数のホストから同じボリュームを使う場合は files を使う。
+保存した値は pickle で読み込むため、保存先にはこのアプリのプロセスだけが書き込めるようにすること。
+"""
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+
+from modules.cache import make_cache_key
+from modules.instrumentation import log_event
+
+SHARED_CACHE_DEFAULT_MAX_MB = 1024
+# 保存する値の形式を変えたら上げる（古い形式のエントリはキーが一致しなくなり、やがて追い出される）
+SHARED_CACHE_FORMAT_VERSION = 1
+# SQLite で他のプロセスの書き込みが終わるのを待つ時間（秒）。超えたらキャッシュを使わずに続ける
+SQLITE_BUSY_TIMEOUT_S = 5.0
+# 読み込みで最後に使った時刻を書き直す最短の間隔（秒）。読み込みのたびに書き込み（sqlite では書き込みロック、
+# files では更新時刻の変更）をしないよう、前回の記録からこれ以上経ったときだけ書き直す
+SHARED_CACHE_ACCESS_INTERVAL_S = 60.0
+# files で、追い出しのためにディレクトリ全体を走査する最長の間隔（秒）。走査の間は、このプロセスが書いた分を
+# 合計サイズの見積もりに足し、見積もりが上限を超えたときだけ走査する（他のプロセスが書いた分は次の走査で数える）
+FILE_CACHE_SCAN_INTERVAL_S = 60.0
+
+
+class SqliteCacheStore:
+    """
+    1つの SQLite ファイルに保存する共有キャッシュ。WAL モードで読み込みと書き込みを並行させ、
+    書き込み（追加と追い出し）は1つのトランザクションで行うため、複数のプロセスから同時に使える。
+    最後に使った時刻は access_interval_s ごとにしか更新しないため、追い出す順序はその精度になる。
+    """
+
+    def __init__(self, path, max_bytes, access_interval_s=SHARED_CACHE_ACCESS_INTERVAL_S):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.access_interval_s = access_interval_s
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # fork した子プロセスでは親の接続を使わずに開き直す
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_S, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "nbytes INTEGER NOT NULL, accessed REAL NOT NULL, expires REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key):
+        """(key のバイト列, 有効期限の UNIX 時刻（無期限は None）) を返す。無いか期限切れなら None"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value, expires, accessed FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires, accessed = row
+            if expires is not None and now >= expires:
+                conn.execute("DELETE FROM entries WHERE key = ? AND expires <= ?", (key, now))
+                return None
+            if now - accessed >= self.access_interval_s:
+                conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            return value, expires
+
+    def put(self, key, data, ttl_s=None):
+        """key にバイト列を保存し、上限を超えた分を追い出す。追い出した件数を返す"""
+        if len(data) > self.max_bytes:
+            return 0
+        now = time.time()
+        expires = now + ttl_s if ttl_s is not None else None
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, nbytes, accessed, expires) VALUES (?, ?, ?, ?, ?)",
+                    (key, sqlite3.Binary(data), len(data), now, expires),
+                )
+                conn.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?", (now,))
+                evicted = 0
+                total = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entries").fetchone()[0]
+                if total > self.max_bytes:
+                    for old_key, nbytes in conn.execute(
+                        "SELECT key, nbytes FROM entries WHERE key != ? ORDER BY accessed", (key,)
+                    ).fetchall():
+                        if total <= self.max_bytes:
+                            break
+                        conn.execute("DELETE FROM entries WHERE key = ?", (old_key,))
+                        total -= nbytes
+                        evicted += 1
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return evicted
+
+    def usage(self):
+        """(エントリ数, 合計バイト数)"""
+        with self._lock:
+            return tuple(self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM entries"
+            ).fetchone())
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute("DELETE FROM entries")
+
+
+class FileCacheStore:
+    """
+    ディレクトリに1エントリ1ファイルで保存する共有キャッシュ。一時ファイルに書いてから os.replace で
+    置き換えるため、読み込み側は書きかけのファイルを読まない。ロックを使わないため、
+    NFS などのネットワークファイルシステムでも使える（追い出しが重なっても消えたファイルは無視する）。
+    ファイルの先頭8バイトは有効期限（UNIX 時刻のミリ秒、無期限は 0）、最終更新時刻を最後に使った時刻とする。
+    追い出しのための走査は scan_interval_s ごとか、合計サイズの見積もりが上限を超えたときだけ行うため、
+    他のプロセスの書き込みで合計サイズが一時的に上限を超えることがある。
+    """
+
+    _SUFFIX = ".bin"
+    _HEADER_BYTES = 8
+
+    def __init__(self, path, max_bytes, access_interval_s=SHARED_CACHE_ACCESS_INTERVAL_S,
+                 scan_interval_s=FILE_CACHE_SCAN_INTERVAL_S):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.access_interval_s = access_interval_s
+        self.scan_interval_s = scan_interval_s
+        self._lock = threading.Lock()
+        self._estimated_bytes = None  # 最初の書き込みで走査する
+        self._scanned_at = 0.0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + self._SUFFIX)
+
+    def get(self, key):
+        path = self._file(key)
+        try:
+            with open(path, "rb") as f:
+                header, data = f.read(self._HEADER_BYTES), f.read()
+                accessed = os.fstat(f.fileno()).st_mtime
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        expires = int.from_bytes(header, "big") / 1e3
+        if expires and now >= expires:
+            self._unlink(path)
+            return None
+        if now - accessed >= self.access_interval_s:
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                pass
+        return data, expires or None
+
+    def put(self, key, data, ttl_s=None):
+        if len(data) > self.max_bytes:
+            return 0
+        expires = int((time.time() + ttl_s) * 1e3) if ttl_s is not None else 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(expires.to_bytes(self._HEADER_BYTES, "big"))
+                f.write(data)
+            os.replace(tmp_path, self._file(key))
+        except BaseException:
+            self._unlink(tmp_path)
+            raise
+        with self._lock:
+            if self._estimated_bytes is not None:
+                self._estimated_bytes += len(data)
+            due = (self._estimated_bytes is None or self._estimated_bytes > self.max_bytes
+                   or time.monotonic() - self._scanned_at >= self.scan_interval_s)
+        return self._evict() if due else 0
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if not entry.name.endswith(self._SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size - self._HEADER_BYTES, entry.path))
+        return entries
+
+    def _evict(self):
+        scanned_at = time.monotonic()
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._unlink(path)
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._estimated_bytes, self._scanned_at = total, scanned_at
+        return evicted
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def usage(self):
+        entries = self._entries()
+        return len(entries), sum(size for _, size, _ in entries)
+
+    def clear(self):
+        for _, _, path in self._entries():
+            self._unlink(path)
+
+
+BACKENDS = {"sqlite": SqliteCacheStore, "files": FileCacheStore}
+
+_store = None
+_store_lock = threading.Lock()
+_store_configured = False
+_MISSING = object()
+
+
+def get_shared_store():
+    """環境変数で指定した共有キャッシュを返す（最初の呼び出しで開く）。指定が無ければ None"""
+    global _store, _store_configured
+    with _store_lock:
+        if not _store_configured:
+            _store = open_store(
+                os.environ.get("STREAM_SHARED_CACHE_PATH"),
+                os.environ.get("STREAM_SHARED_CACHE_BACKEND", "sqlite"),
+                int(os.environ.get("STREAM_SHARED_CACHE_MAX_MB", SHARED_CACHE_DEFAULT_MAX_MB)) * 1024 * 1024,
+            )
+            _store_configured = True
+        return _store
+
+
+def open_store(path, backend="sqlite", max_bytes=SHARED_CACHE_DEFAULT_MAX_MB * 1024 * 1024, **options):
+    """backend の共有キャッシュを path に開く。path が空なら None。options は backend のクラスに渡す"""
+    if not path:
+        return None
+    if backend not in BACKENDS:
+        raise ValueError(f"共有キャッシュの種類 '{backend}' は使えません（{', '.join(BACKENDS)}）。")
+    return BACKENDS[backend](path, max_bytes, **options)
+
+
+class SharedCache:
+    """
+    プロセス内の LRUCache と共有キャッシュ（store）の2段のキャッシュ。LRUCache と同じ get / put / stats を持つ。
+    namespace はキャッシュの種類（parse / fit / export）で、キーは make_cache_key で文字列にする。
+    値は dumps でバイト列にして保存し、loads で戻す。共有キャッシュの読み書きに失敗しても
+    例外は送出せず、プロセス内のキャッシュだけで続ける。
+    store を省略すると get_shared_store() を使う（None なら共有しない）。
+    """
+
+    def __init__(self, local, namespace, dumps=pickle.dumps, loads=pickle.loads, store=None):
+        self.local = local
+        self.namespace = namespace
+        self._dumps = dumps
+        self._loads = loads
+        self._store = store
+        self._lock = threading.Lock()
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+        self.shared_evictions = 0
+
+    @property
+    def store(self):
+        return self._store if self._store is not None else get_shared_store()
+
+    def _count(self, field, n=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + n)
+
+    def _shared_key(self, key):
+        return make_cache_key(SHARED_CACHE_FORMAT_VERSION, self.namespace, key)
+
+    def get(self, key, default=None):
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        store = self.store
+        if store is None:
+            return default
+        try:
+            entry = store.get(self._shared_key(key))
+            if entry is None:
+                self._count("shared_misses")
+                return default
+            data, expires = entry
+            value = self._loads(data)
+        except Exception as e:
+            self._count("shared_errors")
+            log_event("shared_cache_error", namespace=self.namespace, operation="get", error=repr(e))
+            return default
+        self._count("shared_hits")
+        # 共有キャッシュに保存した時点からの期限を引き継ぐ（プロセス内で期限を延ばさない）
+        self.local.put(key, value, ttl_s=None if expires is None else max(expires - time.time(), 0.0))
+        return value
+
+    def put(self, key, value):
+        self.local.put(key, value)
+        store = self.store
+        if store is None:
+            return
+        try:
+            evicted = store.put(self._shared_key(key), self._dumps(value), ttl_s=self.local.ttl_s)
+        except Exception as e:
+            self._count("shared_errors")
+            log_event("shared_cache_error", namespace=self.namespace, operation="put", error=repr(e))
+            return
+        if evicted:
+            self._count("shared_evictions", evicted)
+
+    def clear(self):
+        """プロセス内のキャッシュを空にする（共有キャッシュは他のプロセスも使うため消さない）"""
+        self.local.clear()
+
+    def __len__(self):
+        return len(self.local)
+
+    def stats(self):
+        """プロセス内のキャッシュの統計に、共有キャッシュのヒット数などを加えて返す"""
+        stats = self.local.stats()
+        if self.store is not None:
+            with self._lock:
+                stats.update(shared_hits=self.shared_hits, shared_misses=self.shared_misses,
+                             shared_errors=self.shared_errors, shared_evictions=self.shared_evictions)
+        return stats
@@ -0,0 +1,203 @@
+# modules/stages.py
+"""
+app.py の再実行の処理段階（パース → 整形 → 変換 → フィット → 軸範囲 → 描画 → 書き出し）。
+段階ごとに使う設定の項目を宣言し、modules.pipeline でセッションごとにメモ化する。
+例えば凡例の文字サイズを変えた再実行では描画と書き出しだけを、
+2本目の近似線の範囲を変えた再実行では2本目のフィットと描画・書き出しだけを計算し直す。
+UI（st.*）は呼ばず、結果の表示は app.py が行う。
+"""
+import modules.data_handler as dh
+import modules.fitting_calculator as fc
+import modules.plot_generator as pg
+import modules.vega_chart as vc
+from modules.cache import make_cache_key
+from modules.dataset import Dataset
+from modules.pipeline import Stage, StagePipeline
+
+# 軸範囲に使う設定
+AXIS_RANGE_INPUTS = (
+    "plot_type", "force_origin_visible", "manual_x_axis", "manual_y_axis",
+    "x_axis_min", "x_axis_max", "y_axis_min", "y_axis_max",
+)
+# 描画（画像とインタラクティブ表示で共通）に使う設定
+DRAW_INPUTS = (
+    "plot_type", "x_label", "y_label", "tick_length", "show_legend", "show_error_bars", "decimation_threshold",
+    "data_legend_label", "legend_fontsize", "show_fitting", "fit_legend_label", "show_fitting_2", "fit_legend_label_2",
+)
+# ブートストラップ法の設定（app.py では bootstrap_ を付けて graph_settings とは別の項目にする）
+BOOTSTRAP_INPUTS = (
+    "plot_type", "bootstrap_enabled", "bootstrap_n_resamples", "bootstrap_confidence", "bootstrap_seed",
+    "bootstrap_time_budget_s",
+)
+
+
+def parse(settings, raw_data_str=None, file_bytes=None, file_name=None):
+    """テキストまたはアップロードされたファイルを読み込み (df_orig, df_numeric, error_message) を返す"""
+    if file_bytes is not None:
+        return dh.read_uploaded_file_cached(
+            file_bytes, file_name, data_key=settings["data_key"], multi_y=settings["multi_y"]
+        )
+    return dh.parse_text_data_cached(raw_data_str, data_key=settings["data_key"], multi_y=settings["multi_y"])
+
+
+def clean(settings, parsed):
+    """
+    表示する系列を選び、数値データを連続した読み取り専用の配列にまとめて NaN を含む行を除く。
+    (df_orig, plot_data, フィット結果のキャッシュに使うデータのキー) を返す。plot_data はデータが無ければ None。
+    """
+    df_orig, df_numeric, _ = parsed
+    data_key = settings["data_key"]
+    if settings["series_name"] is not None and df_numeric is not None:
+        df_orig = dh.select_series(df_orig, settings["series_name"])
+        df_numeric = dh.select_series(df_numeric, settings["series_name"])
+        data_key = make_cache_key(data_key, settings["series_name"])
+    plot_data = None
+    if df_numeric is not None and not df_numeric.empty:
+        plot_data = Dataset.from_frame(df_numeric).valid()
+    return df_orig, plot_data, data_key
+
+
+def _has_points(cleaned):
+    return cleaned[1] is not None and len(cleaned[1]) > 0
+
+
+def fit_all_series(settings, parsed):
+    """複数のY系列を読み込んだ場合に、全系列をまとめてフィットした表を返す"""
+    df_numeric = parsed[1]
+    if not (settings["multi_y"] and settings["show_fitting"]) or df_numeric is None:
+        return None
+    return fc.fit_multiple_series(
+        df_numeric['x'].values, df_numeric.iloc[:, 1:].to_numpy(dtype=float),
+        settings["plot_type"], series_names=list(df_numeric.columns[1:]),
+        method=settings["fit_method"], model=settings["fit_model"]
+    )
+
+
+def transform(settings, cleaned):
+    """
+    範囲フィット用に、xでソートした累積和インデックスをデータとグラフ種類ごとに1回だけ作る。
+    範囲を変えた再実行では二分探索だけでフィットする。2本目の近似線を使わない場合は None。
+    """
+    if not settings["show_fitting_2"] or not _has_points(cleaned):
+        return None
+    plot_data = cleaned[1]
+    return fc.RangeFitIndex(plot_data.x, plot_data.y, settings["plot_type"])
+
+
+def fit_1(settings, cleaned, warm_starts=None):
+    """
+    データ全体のフィット結果（同じデータの結果はセッション間で共有する）。
+    非線形最小二乗法は、前回求めたパラメータ（近似線・モデルごと）を反復の初期値の候補にする。
+    """
+    if not settings["show_fitting"] or not _has_points(cleaned):
+        return None
+    _, plot_data, data_key = cleaned
+    warm_starts = warm_starts if warm_starts is not None else {}
+    fit_model = settings["fit_model"]
+    fit_results = fc.cached_fit(
+        data_key, settings["plot_type"], None,
+        lambda: fc.calculate_fitting_parameters_v3(
+            plot_data.x, plot_data.y, settings["plot_type"], settings["fit_method"],
+            model=fit_model, warm_start=warm_starts.get(("fit_1", fit_model))
+        ),
+        method=settings["fit_method"], model=fit_model
+    )
+    if fit_results.get("params") is not None:
+        warm_starts[("fit_1", fit_model)] = fit_results["params"]
+    return fit_results
+
+
+def bootstrap(settings, fit_results):
+    """
+    1本目のフィットのブートストラップ法による信頼区間（無効な場合やフィットに失敗した場合は None）。
+    点数が多い場合は、共有のプロセスプール（BOOTSTRAP_POOL_WORKERS）で分割して計算する。
+    """
+    if not settings["bootstrap_enabled"] or not fit_results or fit_results.get("slope_val") is None:
+        return None
+    return fc.bootstrap_fit_parameters(
+        fit_results["x_transformed"], fit_results["y_transformed"], settings["plot_type"],
+        n_resamples=settings["bootstrap_n_resamples"], confidence=settings["bootstrap_confidence"],
+        seed=settings["bootstrap_seed"], time_budget_s=settings["bootstrap_time_budget_s"],
+        workers=fc.BOOTSTRAP_POOL_WORKERS
+    )
+
+
+def fit_2(settings, cleaned, range_index, warm_starts=None):
+    """
+    指定範囲のフィット結果。2本目の近似線を使わない場合や範囲が正しくない場合、
+    範囲にデータ点が無い場合は None を返す。
+    """
+    min_x, max_x = settings["fit_range_x_min"], settings["fit_range_x_max"]
+    if range_index is None or min_x is None or max_x is None or min_x >= max_x:
+        return None
+    warm_starts = warm_starts if warm_starts is not None else {}
+    fit_model = settings["fit_model"]
+    fit_results = fc.cached_fit(
+        cleaned[2], settings["plot_type"], (min_x, max_x),
+        lambda: range_index.fit(min_x, max_x, settings["fit_method"], model=fit_model,
+                                warm_start=warm_starts.get(("fit_2", fit_model))),
+        method=settings["fit_method"], model=fit_model
+    )
+    if fit_results is not None and fit_results.get("params") is not None:
+        warm_starts[("fit_2", fit_model)] = fit_results["params"]
+    return fit_results
+
+
+def axis_ranges(settings, cleaned):
+    """最終的な (xlim, ylim)。画像とインタラクティブ表示で共通"""
+    if not _has_points(cleaned):
+        return None
+    plot_data = cleaned[1]
+    x_log, y_log = pg.axis_scales(settings["plot_type"])
+    return pg.compute_axis_ranges(plot_data.x, plot_data.y, settings, x_log=x_log, y_log=y_log)
+
+
+def fit_lines(settings, fit_results_1, fit_results_2):
+    """draw_graph / build_vega_lite_spec に渡す (fit_results, 凡例, 線種, 色) の並び"""
+    lines = []
+    if settings.get("show_fitting"):
+        lines.append((fit_results_1, settings.get("fit_legend_label") or "", '--', 'red'))
+    if settings.get("show_fitting_2"):
+        lines.append((fit_results_2, settings.get("fit_legend_label_2") or "", ':', 'green'))
+    return lines
+
+
+def draw(settings, cleaned, ranges, fit_results_1, fit_results_2):
+    """matplotlib の figure（置き換わった前回の figure は release_figure で破棄する）"""
+    if not _has_points(cleaned):
+        return None
+    fig, _ = pg.draw_graph(cleaned[1], settings, fit_lines(settings, fit_results_1, fit_results_2),
+                           axis_ranges=ranges)
+    return fig
+
+
+def chart_spec(settings, cleaned, ranges, fit_results_1, fit_results_2):
+    """インタラクティブ表示用の Vega-Lite の仕様"""
+    if not _has_points(cleaned):
+        return None
+    return vc.build_vega_lite_spec(cleaned[1], settings, fit_lines(settings, fit_results_1, fit_results_2),
+                                   axis_ranges=ranges)
+
+
+def display_png(settings, fig):
+    """画面表示用の PNG。figure が変わらない再実行では書き出し直さない"""
+    return pg.display_png_bytes(fig) if fig is not None else None
+
+
+PIPELINE = StagePipeline([
+    Stage("parse", parse, inputs=("data_key", "multi_y"), sources=("raw_data_str", "file_bytes", "file_name")),
+    Stage("clean", clean, inputs=("data_key", "series_name"), depends=("parse",)),
+    Stage("fit_all_series", fit_all_series, inputs=("multi_y", "show_fitting", "plot_type", "fit_method", "fit_model"),
+          depends=("parse",)),
+    Stage("transform", transform, inputs=("plot_type", "show_fitting_2"), depends=("clean",)),
+    Stage("fit_1", fit_1, inputs=("plot_type", "show_fitting", "fit_method", "fit_model"), depends=("clean",),
+          sources=("warm_starts",)),
+    Stage("bootstrap", bootstrap, inputs=BOOTSTRAP_INPUTS, depends=("fit_1",)),
+    Stage("fit_2", fit_2, inputs=("plot_type", "fit_range_x_min", "fit_range_x_max", "fit_method", "fit_model"),
+          depends=("clean", "transform"), sources=("warm_starts",)),
+    Stage("axis_ranges", axis_ranges, inputs=AXIS_RANGE_INPUTS, depends=("clean",)),
+    Stage("draw", draw, inputs=DRAW_INPUTS, depends=("clean", "axis_ranges", "fit_1", "fit_2"),
+          release=pg.release_figure),
+    Stage("chart_spec", chart_spec, inputs=DRAW_INPUTS, depends=("clean", "axis_ranges", "fit_1", "fit_2")),
+    Stage("display_png", display_png, depends=("draw",)),
+])
@@ -1,8 +1,18 @@
 # modules/ui_components.py
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
 import streamlit as st
-import pandas as pd
-import io
-import streamlit.components.v1 as components
+
+import modules.data_handler as dh
+import modules.fitting_calculator as fc
+import modules.latex_table as lt
+import modules.nonlinear_fit as nf
+import modules.plot_generator as pg
+
+# 非線形最小二乗法で、グラフ種類の既定のモデルを使う選択肢
+AUTO_FIT_MODEL = "グラフ種類に合わせる"
+# 計算の完了を確かめる間隔（秒）。この間隔で表示を更新し、新しい入力があれば再実行を打ち切る
+WAIT_POLL_INTERVAL_S = 0.1
 
 def render_sidebar_main_settings():
     """サイドバーの基本的なグラフ設定UI（凡例を除く）をレンダリングする"""
@@ -26,8 +36,71 @@ def render_sidebar_main_settings():
         "グラフ種類", ["通常", "片対数 (Y軸対数)", "片対数 (X軸対数)", "両対数"]
     )
     settings['show_legend'] = st.sidebar.checkbox("凡例を表示する", True)
-    settings['show_fitting'] = st.sidebar.checkbox("最小二乗法でフィッティングを行う")
+    settings['show_fitting'] = st.sidebar.checkbox("フィッティングを行う")
+    settings['fit_method'] = fc.DEFAULT_FIT_METHOD
+    settings['fit_model'] = None
+    if settings['show_fitting']:
+        settings['fit_method'] = st.sidebar.selectbox(
+            "フィット手法", fc.FIT_METHOD_NAMES, key="fit_method",
+            help="Theil–Sen 推定と Huber 推定は、外れ値（測定の失敗など）の影響を受けにくい手法です。"
+                 "どちらもグラフ種類に応じて変換した後の空間で直線をフィットします。"
+                 "非線形最小二乗法は、対数変換せずに元のYの残差でモデルをフィットします。"
+        )
+        if settings['fit_method'] == fc.NONLINEAR_FIT_METHOD:
+            fit_model = st.sidebar.selectbox(
+                "モデル", [AUTO_FIT_MODEL, *nf.MODELS], key="fit_model",
+                help="「グラフ種類に合わせる」では、通常は直線、片対数 (Y軸対数) は指数関数、"
+                     "片対数 (X軸対数) は対数関数、両対数はべき関数をフィットします。"
+            )
+            if fit_model == AUTO_FIT_MODEL:
+                fit_model = nf.DEFAULT_MODELS[settings['plot_type']]
+            settings['fit_model'] = fit_model
     settings['show_error_bars'] = st.sidebar.checkbox("エラーバーを表示する", False)
+
+    decimate = st.sidebar.checkbox(
+        "大量のデータ点を間引いて描画する", True,
+        help="点数が多い場合、見た目が変わらない範囲で代表点だけを描画します。フィッティングには全データを使います。"
+    )
+    settings['decimation_threshold'] = None
+    if decimate:
+        settings['decimation_threshold'] = st.sidebar.number_input(
+            "間引きを始める点数", min_value=1000, value=pg.DEFAULT_DECIMATION_THRESHOLD, step=10000
+        )
+    return settings
+
+def render_sidebar_bootstrap_settings(graph_settings):
+    """
+    ブートストラップ法による信頼区間の設定UI（フィッティングが有効な場合のみ）。
+    グラフの見た目には影響しないため、graph_settings とは別の辞書で返す。
+    """
+    settings = {"enabled": False}
+    if not graph_settings.get('show_fitting'):
+        return settings
+    if graph_settings.get('fit_method', fc.DEFAULT_FIT_METHOD) != fc.DEFAULT_FIT_METHOD:
+        st.sidebar.caption("ブートストラップ法による信頼区間は、最小二乗法でのみ求められます。")
+        return settings
+    settings["enabled"] = st.sidebar.checkbox(
+        "ブートストラップ法で信頼区間を求める", False, key="bootstrap_enabled",
+        help="データ点を復元抽出した再標本で繰り返しフィットし、パラメータのパーセンタイル信頼区間を求めます。"
+             "誤差が点ごとに異なるデータや対数変換したデータでは、解析的な標準誤差より信頼できます。"
+    )
+    if settings["enabled"]:
+        settings["n_resamples"] = int(st.sidebar.number_input(
+            "再標本の数", min_value=100, max_value=100_000, value=fc.BOOTSTRAP_DEFAULT_RESAMPLES, step=500,
+            key="bootstrap_resamples"
+        ))
+        settings["confidence"] = st.sidebar.selectbox(
+            "信頼水準", [0.68, 0.90, 0.95, 0.99], index=2, format_func=lambda c: f"{c:.0%}",
+            key="bootstrap_confidence"
+        )
+        settings["seed"] = int(st.sidebar.number_input(
+            "乱数のシード", min_value=0, value=0, step=1, key="bootstrap_seed",
+            help="同じシードでは同じ結果になります。"
+        ))
+        settings["time_budget_s"] = float(st.sidebar.number_input(
+            "計算時間の上限 [秒]", min_value=0.1, value=2.0, step=0.5, key="bootstrap_time_budget",
+            help="上限に達した場合は、それまでに計算した再標本だけで信頼区間を求めます。"
+        ))
     return settings
 
 def render_sidebar_second_fit_settings(graph_settings):
@@ -131,20 +204,86 @@ def render_data_input_area():
 
     return raw_data_str
 
-def render_download_buttons(fig, png_filename="graph.png", svg_filename="graph.svg"):
+def render_file_upload_area():
+    """
+    データファイルのアップロードUI。アップロードされたファイル（UploadedFile）か None を返す。
+    大きなデータはテキストエリアに貼り付けるよりも、ファイルで渡す方が速い。
+    """
+    return st.file_uploader(
+        "またはファイルをアップロード (CSV / TSV / Excel / Parquet / 空白区切りテキスト)",
+        type=dh.UPLOAD_FILE_TYPES, key="data_file",
+        help="ファイルをアップロードした場合は、テキストエリアの内容より優先して使います。"
+             "先頭の列から順に X, Y（, Yの誤差）として読み込みます。"
+    )
+
+def render_data_format_setting():
+    """データの列の扱いを選ぶUI。複数のy列として読み込む場合は True を返す"""
+    return st.checkbox(
+        "2列目以降をそれぞれ別のY系列として読み込む", False, key="multi_y",
+        help="1列目をX、2列目以降をY1, Y2, ... として全系列をまとめてフィットします。"
+             "オフの場合、3列目はYの誤差として扱います。"
+    )
+
+def render_series_selector(series_names):
+    """グラフに表示するY系列を選ぶUI"""
+    return st.selectbox("グラフに表示する系列", series_names, key="selected_series")
+
+def render_multi_fit_results_table(fit_table):
+    """全系列のフィッティング結果を表として表示する"""
+    st.write("**全系列のフィッティング結果:**")
+    st.dataframe(fit_table, hide_index=True)
+
+def render_display_mode_setting():
+    """
+    グラフの表示方式を選ぶUI。インタラクティブ表示ではブラウザ側で描画し（Vega-Lite）、
+    サーバーでの画像の作成はダウンロード時だけにする。インタラクティブ表示なら True を返す
+    """
+    mode = st.radio(
+        "表示方式", ["画像", "インタラクティブ"], horizontal=True, key="display_mode",
+        help="インタラクティブ表示では、グラフをブラウザで描画します。ドラッグで移動、ホイールで拡大縮小でき、"
+             "設定を変えたときの表示も速くなります。数式は簡易的な表示になるため、論文などには画像をダウンロードしてください。"
+    )
+    return mode == "インタラクティブ"
+
+def render_interactive_chart(spec):
+    """build_vega_lite_spec で作った仕様のグラフを表示する"""
+    st.vega_lite_chart(spec, width="stretch", theme=None)
+
+def wait_for_job(future, message):
+    """
+    プールで計算中の結果を待つ。待つ間は message を表示する。表示の更新が Streamlit の中断点になるため、
+    新しい入力があればこの再実行はすぐに打ち切られ、計算は次の再実行が引き継ぐか取り消す。
+    """
+    status = st.empty()
+    while True:
+        try:
+            result = future.result(timeout=WAIT_POLL_INTERVAL_S)
+        except FutureTimeoutError:
+            status.caption(message)
+            continue
+        except Exception:
+            status.empty()
+            raise
+        status.empty()
+        return result
+
+def render_graph_image(png_bytes):
+    """display_png_bytes で書き出したグラフの画像を表示する（st.pyplot と同じく列の幅に合わせる）"""
+    st.image(png_bytes, width="stretch")
+
+def render_download_buttons(fig, png_filename="graph.png", svg_filename="graph.svg", cache_key=None):
     """
-    Matplotlibのfigureオブジェクトを受け取り、PNGとSVGのダウンロードボタンを描画する。
+    Matplotlibのfigureオブジェクト（または figure を作る関数）を受け取り、PNGとSVGのダウンロードボタンを描画する。
+    画像はボタンが押されたときに初めて書き出す。cache_key を渡すと、同じ内容の書き出しを再利用する。
     """
     if fig is None:
         return
 
-    img_png = io.BytesIO()
-    fig.savefig(img_png, format='png', dpi=300, bbox_inches='tight')
-    img_png.seek(0)
+    def img_png():
+        return pg.export_figure_bytes(fig, "png", cache_key)
 
-    img_svg = io.BytesIO()
-    fig.savefig(img_svg, format='svg', bbox_inches='tight')
-    img_svg.seek(0)
+    def img_svg():
+        return pg.export_figure_bytes(fig, "svg", cache_key)
 
     col1, col2 = st.columns(2)
     with col1:
@@ -177,6 +316,7 @@ def render_fitting_results_display(fit_equation_latex, fit_r_squared_text, fit_s
             st.code( fit_equation_latex_for_code, language="latex")
 
             button_id_eq = f"copy_eq_btn_{hash(fit_equation_latex_for_code)}"
+            import streamlit.components.v1 as components  # コピーボタンを表示するときだけ読み込む
             components.html(
                 f'''
                 <button id="{button_id_eq}" style="margin-top: 5px; padding: 5px 10px; border-radius: 5px; border: 1px solid #ccc; background-color: #f0f0f0; cursor: pointer;">
@@ -204,78 +344,158 @@ def render_fitting_results_display(fit_equation_latex, fit_r_squared_text, fit_s
     elif show_fitting_toggle:
         st.warning("選択されたグラフ種類とデータではフィッティングを実行できませんでした。")
 
-def generate_latex_table(df, x_col_name='x', y_col_name='y', x_header='$x$', y_header='$y$'):
+def render_bootstrap_results(fit_results, plot_type):
+    """ブートストラップ法で求めたパラメータの信頼区間を表示する"""
+    bootstrap = fit_results.get("bootstrap") if fit_results else None
+    if not bootstrap:
+        return
+    if plot_type == "通常":
+        rows = [("傾き", fit_results["slope_val"], bootstrap["slope_ci"]),
+                ("切片", fit_results["intercept_val"], bootstrap["intercept_ci"])]
+    else:
+        rows = [("A", fit_results["A_val"], bootstrap["A_ci"]),
+                ("B", fit_results["B_val"], bootstrap["B_ci"])]
+    st.write(f"**ブートストラップ法による {bootstrap['confidence']:.0%} 信頼区間:**")
+    st.dataframe(
+        [{"パラメータ": name, "値": value, "下限": ci[0], "上限": ci[1]} for name, value, ci in rows],
+        hide_index=True
+    )
+    st.caption(
+        f"再標本 {bootstrap['n_resamples']:,} 回（シード {bootstrap['seed']}、{bootstrap['elapsed_s']:.2f} 秒）"
+    )
+    if bootstrap["truncated"]:
+        st.warning(
+            f"計算時間の上限に達したため、{bootstrap['requested_resamples']:,} 回のうち "
+            f"{bootstrap['n_resamples']:,} 回の再標本で信頼区間を求めました。"
+        )
+
+def render_nonlinear_fit_details(fit_results):
+    """非線形最小二乗法で求めたパラメータとその不確かさ、反復回数を表示する"""
+    if not fit_results or fit_results.get("params") is None:
+        return
+    st.dataframe(
+        [{"パラメータ": name, "値": value, "不確かさ": err}
+         for name, value, err in zip(fit_results["param_names"], fit_results["params"], fit_results["param_errors"])],
+        hide_index=True
+    )
+    st.caption(f"モデル: {fit_results['model']}（元の空間で {fit_results['n_iterations']} 回の反復）")
+
+def generate_latex_table(df, x_col_name='x', y_col_name='y', x_header='$x$', y_header='$y$', **options):
     """
     DataFrameをLaTeXのtabular形式の文字列に変換する。
     x_header, y_header はLaTeXで表示する列名。
+    実装は modules.latex_table にある（options は longtable, rows_per_table）。
     """
-    if df is None or df.empty:
-        return ""
-
-    # LaTeXのソースコードを行ごとにリストとして作成
-    # st.code()で正しく改行を表示するため、各行をリストの要素とし、最後に \n で結合する
-    lines = [
-        "\\begin{tabular}{cc}",
-        "\\label{tab:table_label}",
-        "\\caption{string}",
-        "\\centering",
-        "\\hline\\hline",
-        f"{x_header} & {y_header} \\\\", # LaTeXの改行は \\
-        "\\hline"
-    ]
-
-    # データ行を追加
-    for index, row in df.iterrows():
-        x_val_str = str(row[x_col_name])
-        y_val_str = str(row[y_col_name])
-        lines.append(f"{x_val_str} & {y_val_str} \\\\")
-
-    # テーブルの終わり
-    lines.extend([
-        "\\hline\\hline",
-        "\\end{tabular}"
-    ])
-
-    # Pythonの改行文字 `\n` で各行を結合して、単一の複数行文字列を返す
-    return "\n".join(lines)
+    return lt.generate_latex_table(df, x_col_name, y_col_name, x_header, y_header, **options)
+
+def render_latex_copy_button(latex_str, button_id):
+    """LaTeXソースをクリップボードにコピーするボタンを表示する"""
+    import streamlit.components.v1 as components  # コピーボタンを表示するときだけ読み込む
+    components.html(
+        f'''
+        <button id="{button_id}" style="margin-top: 5px; padding: 5px 10px; border-radius: 5px; border: 1px solid #ccc; background-color: #f0f0f0; cursor: pointer;">
+            LaTeX ソースをコピー
+        </button>
+        <script>
+        document.getElementById("{button_id}").onclick = function() {{
+            navigator.clipboard.writeText(`{latex_str.replace('`', '\`').replace('\\', '\\\\')}`)
+            .then(() => {{
+                let btn = document.getElementById("{button_id}");
+                let originalText = btn.innerText;
+                btn.innerText = "コピーしました!";
+                setTimeout(() => {{ btn.innerText = originalText; }}, 2000);
+            }})
+            .catch(err => {{
+                console.error('クリップボードへのコピーに失敗しました: ', err);
+                alert('コピーに失敗しました。コンソールでエラーを確認してください。');
+            }});
+        }}
+        </script>
+        ''',
+        height=45,
+    )
 
 def render_data_table_latex_export(df, graph_settings):
-
+    """
+    データのLaTeX表を表示する。
+    行数が LATEX_INLINE_MAX_ROWS を超える場合は、ページに埋め込まず先頭部分だけを表示し、
+    全体はダウンロードボタンを押したときに生成する。
+    df は LazyOriginalFrame でもよい（全体が必要になるまで DataFrame を作らない）。
+    """
     if df is None or df.empty:
         return
 
     st.subheader("データテーブル (LaTeX)")
 
-    x_header_latex = graph_settings.get('x_label', '$x$')
-    y_header_latex = graph_settings.get('y_label', '$y$')
+    col1, col2 = st.columns(2)
+    with col1:
+        longtable = st.checkbox(
+            "longtable 形式で出力する", value=False, key="latex_longtable",
+            help="ページをまたぐ長い表を longtable 環境（要 \\usepackage{longtable}）で出力します。"
+        )
+    with col2:
+        rows_per_table = st.number_input(
+            "1つの表に入れる行数（0 で分割しない）", min_value=0, value=0, step=10, key="latex_rows_per_table",
+            disabled=longtable, help="tabular をこの行数ごとに分割して出力します。"
+        )
 
-    latex_table_str = generate_latex_table(df, x_header=x_header_latex, y_header=y_header_latex)
+    options = {"longtable": longtable, "rows_per_table": int(rows_per_table) or None}
+    headers = {
+        "x_header": graph_settings.get('x_label', '$x$'),
+        "y_header": graph_settings.get('y_label', '$y$'),
+    }
 
-    if latex_table_str:
+    if len(df) <= lt.LATEX_INLINE_MAX_ROWS:
+        latex_table_str = generate_latex_table(dh.as_frame(df), **headers, **options)
         st.caption("データのLaTeX tableソース:")
         st.code(latex_table_str, language="latex")
+        render_latex_copy_button(latex_table_str, f"copy_table_btn_{hash(latex_table_str)}")
+        return
 
-        button_id_table = f"copy_table_btn_{hash(latex_table_str)}"
-        components.html(
-            f'''
-            <button id="{button_id_table}" style="margin-top: 5px; padding: 5px 10px; border-radius: 5px; border: 1px solid #ccc; background-color: #f0f0f0; cursor: pointer;">
-                LaTeX ソースをコピー
-            </button>
-            <script>
-            document.getElementById("{button_id_table}").onclick = function() {{
-                navigator.clipboard.writeText(`{latex_table_str.replace('`', '\`').replace('\\', '\\\\')}`)
-                .then(() => {{
-                    let btn = document.getElementById("{button_id_table}");
-                    let originalText = btn.innerText;
-                    btn.innerText = "コピーしました!";
-                    setTimeout(() => {{ btn.innerText = originalText; }}, 2000);
-                }})
-                .catch(err => {{
-                    console.error('クリップボードへのコピーに失敗しました: ', err);
-                    alert('コピーに失敗しました。コンソールでエラーを確認してください。');
-                }});
-            }}
-            </script>
-            ''',
-            height=45,
-        )
+    # 大きな表はページに二重に埋め込まず、先頭部分の表示とファイルのダウンロードにする
+    preview_str = generate_latex_table(df.head(20), **headers, **options)
+    st.caption(
+        f"データが {len(df):,} 行あるため、先頭 20 行のみ表示しています。"
+        "全体は下のボタンから .tex ファイルとしてダウンロードできます。"
+    )
+    st.code(preview_str, language="latex")
+    st.download_button(
+        label="LaTeX ソースをダウンロード (.tex)",
+        data=lambda: generate_latex_table(dh.as_frame(df), **headers, **options),
+        file_name="table.tex",
+        mime="text/x-tex",
+    )
+
+def render_instrumentation_panel(rerun_summary):
+    """
+    サイドバーに処理段階ごとの計測結果を表示する（開発者向け、既定では非表示）。
+    チェックボックスの状態は次回の再実行の先頭で st.session_state から読み取る。
+    """
+    st.sidebar.markdown("---")
+    show_panel = st.sidebar.checkbox(
+        "処理時間の計測パネルを表示する", key="show_instrumentation",
+        help="再実行ごとの処理段階別の経過時間を表示します。メモリ割り当ては、環境変数 STREAM_TRACE_ALLOCATIONS=1 で"
+             "起動した場合に、他の処理と重ならなかった段階だけ表示します。"
+    )
+    if not show_panel or not rerun_summary:
+        return
+
+    with st.sidebar.expander("計測結果（直前の再実行）", expanded=True):
+        st.write(f"合計: {rerun_summary['total_ms']:.1f} ms")
+        if rerun_summary["stages"]:
+            st.dataframe(rerun_summary["stages"], hide_index=True)
+        for label, key in [
+            ("パースキャッシュ", "parse_cache"), ("フィット結果キャッシュ（全セッション共有）", "fit_cache"),
+            ("画像書き出しキャッシュ", "export_cache"), ("数式レイアウトキャッシュ", "mathtext_cache"),
+        ]:
+            stats = rerun_summary.get(key)
+            if stats:
+                lookups = stats['hits'] + stats['misses']
+                hit_ratio = f"（ヒット率 {stats['hits'] / lookups:.0%}）" if lookups else ""
+                size = f" {stats['bytes'] / 1024:.0f} KB" if "bytes" in stats else ""
+                shared = (f"、共有キャッシュ: ヒット {stats['shared_hits']} / ミス {stats['shared_misses']}"
+                          f" / エラー {stats['shared_errors']}" if "shared_hits" in stats else "")
+                st.caption(
+                    f"{label}: ヒット {stats['hits']} / ミス {stats['misses']}{hit_ratio}、{stats['entries']} 件{size}"
+                    f"{shared}"
+                )
@@ -0,0 +1,159 @@
+# modules/vega_chart.py
+"""
+ブラウザ側で描画するインタラクティブなグラフ（Vega-Lite）の仕様を作る。
+サーバーでは画像にせず、（間引いた）データ点と近似線の座標だけを列形式のデータとして送る
+（st.vega_lite_chart は datasets の DataFrame を Arrow 形式で送信する）。
+軸のスケールと範囲、間引き、近似線の座標は、matplotlib の描画と同じ plot_generator の関数で計算する。
+"""
+import json
+import re
+
+import numpy as np
+
+import modules.plot_generator as pg
+
+# pandas（と pyarrow）は読み込みに時間がかかるため、アプリの起動時ではなくグラフを作る関数の中で読み込む
+
+# matplotlib の線種に対応する破線のパターン
+LINE_DASHES = {'-': [], '--': [6, 4], ':': [2, 3], '-.': [6, 3, 2, 3]}
+# matplotlib の既定の1色目（データ点の色）
+DATA_COLOR = "#1f77b4"
+
+_MATHTEXT_REPLACEMENTS = [(r"\pm", "±"), (r"\times", "×"), (r"\cdot", "·"), ("{", "("), ("}", ")")]
+
+
+def mathtext_to_plain(label):
+    """$...$ の数式を含むラベルを、ブラウザで表示できる平文に近づける（\\pm → ± など）"""
+    if not label or "$" not in label:
+        return label or ""
+    text = label.replace("$", "")
+    for source, target in _MATHTEXT_REPLACEMENTS:
+        text = text.replace(source, target)
+    return re.sub(r"\\([A-Za-z]+)", r"\1", text)
+
+
+def _display_domain(lim, log):
+    """軸の表示範囲。matplotlib で set_xlim されない範囲（逆順・対数軸の0以下）は None（自動）"""
+    lower, upper = float(lim[0]), float(lim[1])
+    if not (np.isfinite(lower) and np.isfinite(upper)) or lower >= upper or (log and lower <= 0):
+        return None
+    return [lower, upper]
+
+
+def _scale(log, domain):
+    scale = {"type": "log" if log else "linear", "zero": False, "nice": False}
+    if domain is not None:
+        scale["domain"] = domain
+    return scale
+
+
+def _points_frame(data, graph_settings, x_log, y_log):
+    """描画するデータ点（とエラーバーの上下端）の DataFrame"""
+    import pandas as pd
+
+    x, y, y_err = pg.display_points(data, graph_settings, x_log=x_log, y_log=y_log)
+    keep = np.isfinite(x) & np.isfinite(y)
+    if x_log:
+        keep &= x > 0
+    if y_log:
+        keep &= y > 0
+    columns = {"x": x[keep], "y": y[keep]}
+    if y_err is not None:
+        y_err = np.asarray(y_err, dtype=float)
+        if y_err.ndim == 2:  # 間引いた場合は (下側, 上側) の組
+            lower, upper = y_err[0][keep], y_err[1][keep]
+        else:
+            lower = upper = np.broadcast_to(y_err, y.shape)[keep]
+        columns["y_low"] = columns["y"] - lower
+        columns["y_high"] = columns["y"] + upper
+    return pd.DataFrame(columns)
+
+
+def build_vega_lite_spec(data, graph_settings, fit_lines=(), axis_ranges=None):
+    """
+    draw_graph と同じ内容のグラフを Vega-Lite の仕様（dict）で返す。data は NaN を除いた Dataset。
+    fit_lines と axis_ranges は draw_graph と同じ (fit_results, 凡例, 線種, 色) の並びと (xlim, ylim)。
+    ドラッグで移動、ホイールで拡大縮小でき、ダブルクリックで元の範囲に戻る。
+    """
+    import pandas as pd
+
+    plot_type = graph_settings["plot_type"]
+    x_log, y_log = pg.axis_scales(plot_type)
+    show_legend = graph_settings.get("show_legend", True)
+
+    if axis_ranges is None:
+        axis_ranges = pg.compute_axis_ranges(data.x, data.y, graph_settings, x_log=x_log, y_log=y_log)
+    xlim, ylim = axis_ranges
+    x_domain, y_domain = _display_domain(xlim, x_log), _display_domain(ylim, y_log)
+    points = _points_frame(data, graph_settings, x_log, y_log)
+    if y_log and y_domain is not None and "y_low" in points:
+        # 対数軸では0以下を表示できないため、エラーバーの下端を表示範囲の下限で切る
+        points["y_low"] = points["y_low"].clip(lower=y_domain[0])
+
+    datasets = {"points": points}
+    data_label = mathtext_to_plain(graph_settings.get("data_legend_label", "")) or "データ"
+    fit_series = []  # (凡例, 色, データセット名, 線種)
+    for i, (fit_results, legend_label, line_style, color) in enumerate(fit_lines):
+        if not fit_results or fit_results.get("error_message"):
+            continue
+        # 表示範囲が自動の場合は matplotlib と同じく計算した範囲で線を引き、はみ出した部分は切り取る
+        line = pg.compute_fit_line(fit_results, plot_type, xlim, data.x, x_log=x_log, y_log=y_log)
+        if line is None:
+            continue
+        name = f"fit_{i}"
+        datasets[name] = pd.DataFrame({"x": line[0], "y": line[1]})
+        label = mathtext_to_plain(legend_label or fit_results.get("equation_latex")) or name
+        fit_series.append((label, color, name, line_style))
+
+    # 系列の凡例と色（各層で系列名の列をブラウザ側で計算し、すべての層で同じ色の対応を使う）
+    color_scale = {
+        "domain": [data_label] + [label for label, _, _, _ in fit_series],
+        "range": [DATA_COLOR] + [color for _, color, _, _ in fit_series],
+    }
+
+    def series_layer(layer, label, color):
+        if not show_legend:
+            layer["encoding"]["color"] = {"value": color}
+            return layer
+        layer["transform"] = [{"calculate": json.dumps(label, ensure_ascii=False), "as": "series"}]
+        layer["encoding"]["color"] = {
+            "field": "series", "type": "nominal", "scale": color_scale, "legend": {"title": None}
+        }
+        return layer
+
+    x_encoding = {"field": "x", "type": "quantitative", "scale": _scale(x_log, x_domain),
+                  "title": mathtext_to_plain(graph_settings.get("x_label", ""))}
+    y_encoding = {"field": "y", "type": "quantitative", "scale": _scale(y_log, y_domain),
+                  "title": mathtext_to_plain(graph_settings.get("y_label", ""))}
+
+    layers = [series_layer({
+        "data": {"name": "points"},
+        "mark": {"type": "point", "filled": True, "size": 40, "clip": True},
+        "encoding": {"x": x_encoding, "y": y_encoding,
+                     "tooltip": [{"field": "x", "type": "quantitative"}, {"field": "y", "type": "quantitative"}]},
+        "params": [{"name": "view", "select": "interval", "bind": "scales"}],
+    }, data_label, DATA_COLOR)]
+    if "y_low" in points:
+        layers.append(series_layer({
+            "data": {"name": "points"},
+            "mark": {"type": "rule", "clip": True},
+            "encoding": {"x": x_encoding, "y": {**y_encoding, "field": "y_low"}, "y2": {"field": "y_high"}},
+        }, data_label, DATA_COLOR))
+    for label, color, name, line_style in fit_series:
+        layers.append(series_layer({
+            "data": {"name": name},
+            "mark": {"type": "line", "clip": True, "strokeDash": LINE_DASHES.get(line_style, [])},
+            "encoding": {"x": x_encoding, "y": y_encoding},
+        }, label, color))
+
+    legend_fontsize = graph_settings.get("legend_fontsize", 15)
+    return {
+        "height": 500,
+        "datasets": datasets,
+        "layer": layers,
+        "config": {
+            "axis": {"titleFontSize": 16, "labelFontSize": 13, "grid": False,
+                     "tickSize": graph_settings.get("tick_length", 5)},
+            "legend": {"orient": "top-right", "labelFontSize": legend_fontsize * 0.8, "labelLimit": 0},
+        },
+    }